@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Semantic summaries of changed Python files for analyze_file_changes.
+
+Instead of raw hunks, a summary lists the functions and classes that were added,
+removed or modified, signature changes and decorators added or removed (such as
+@mcp.tool()). Old and new blobs are read through the git cat-file workers and
+parsed with ast in a process pool, so large refactors are parsed on all cores.
+"""
+
+import ast
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from git_cat_file import get_cat_file_pool
+
+# Worker processes for parsing; 0 parses in a thread of the server process
+AST_WORKERS = int(os.getenv("AST_SUMMARY_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+class Definition:
+    """What is compared between the old and new version of a function or class."""
+
+    def __init__(self, node: ast.AST):
+        self.decorators = [ast.unparse(decorator) for decorator in node.decorator_list]
+        if isinstance(node, ast.ClassDef):
+            bases = [ast.unparse(base) for base in (*node.bases, *node.keywords)]
+            self.signature = f"class {node.name}({', '.join(bases)})"
+            # Methods are compared on their own, so only the rest of the class body counts here
+            body = [statement for statement in node.body if not isinstance(statement, DEFINITIONS)]
+        else:
+            prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+            returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+            self.signature = f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+            body = node.body
+        self.body = ast.dump(ast.Module(body=body, type_ignores=[]))
+
+
+def definitions(source: Optional[str]) -> Dict[str, Definition]:
+    """Top-level functions and classes plus class members, by qualified name."""
+    found = {}
+    if not source:
+        return found
+
+    def visit(body: List[ast.stmt], prefix: str):
+        for node in body:
+            if isinstance(node, DEFINITIONS):
+                name = prefix + node.name
+                found[name] = Definition(node)
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, name + ".")
+
+    visit(ast.parse(source).body, "")
+    return found
+
+
+def summarize_source_change(path: str, status: str, old_source: Optional[str], new_source: Optional[str]) -> dict:
+    """Compare two versions of a Python file; runs in a worker process."""
+    summary = {"path": path, "status": status}
+    try:
+        old, new = definitions(old_source), definitions(new_source)
+    except SyntaxError as e:
+        summary["error"] = f"SyntaxError: {e.msg} (line {e.lineno})"
+        return summary
+    except (ValueError, RecursionError, MemoryError) as e:
+        # Source containing NUL bytes, or nested too deeply (the parser's stack overflow is a MemoryError)
+        summary["error"] = f"{type(e).__name__}: {e}"
+        return summary
+
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    modified, signature_changes, decorators_added, decorators_removed = [], [], [], []
+    for name in added:
+        decorators_added.extend({"name": name, "decorator": d} for d in new[name].decorators)
+    for name, after in new.items():
+        before = old.get(name)
+        if before is None:
+            continue
+        if before.signature != after.signature:
+            signature_changes.append({"name": name, "old": before.signature, "new": after.signature})
+        decorators_added.extend(
+            {"name": name, "decorator": d} for d in after.decorators if d not in before.decorators
+        )
+        decorators_removed.extend(
+            {"name": name, "decorator": d} for d in before.decorators if d not in after.decorators
+        )
+        if (before.signature, before.decorators, before.body) != (after.signature, after.decorators, after.body):
+            modified.append(name)
+
+    # Empty sections are left out to keep the summary small
+    for key, value in (
+        ("added", added),
+        ("removed", removed),
+        ("modified", modified),
+        ("signature_changes", signature_changes),
+        ("decorators_added", decorators_added),
+        ("decorators_removed", decorators_removed)
+    ):
+        if value:
+            summary[key] = value
+    return summary
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if _executor is None and AST_WORKERS > 0:
+        # Forking the multi-threaded server could copy a lock held by another thread into the worker
+        _executor = ProcessPoolExecutor(
+            max_workers=AST_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _executor
+
+
+async def close_summary_workers():
+    """Stop the parsing processes; the next summary starts a new pool."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Wait for the processes to exit without blocking the event loop
+        await asyncio.to_thread(executor.shutdown)
+
+
+async def _summarize(path: str, status: str, old_source: Optional[str], new_source: Optional[str]) -> dict:
+    global _executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), summarize_source_change, path, status, old_source, new_source)
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool and try once more
+        _executor = None
+        return await loop.run_in_executor(_get_executor(), summarize_source_change, path, status, old_source, new_source)
+
+
+async def summarize_python_changes(
+    cwd: str,
+    old_revision: str,
+    new_revision: str,
+    changes: List[Tuple[str, Optional[str], str]]
+) -> List[dict]:
+    """Summarize the changed .py files among changes, given as (status, old_path, path).
+
+    Blobs are read with the repository's cat-file workers and parsed concurrently.
+    """
+    python_changes = [change for change in changes if change[2].endswith(".py")]
+    pool = get_cat_file_pool(cwd)
+    specs = []
+    for status, old_path, path in python_changes:
+        specs.append(f"{old_revision}:{old_path or path}" if status != "A" else None)
+        specs.append(f"{new_revision}:{path}" if status != "D" else None)
+    blobs = await asyncio.gather(*(pool.read(spec) if spec else _nothing() for spec in specs))
+
+    def text(blob) -> Optional[str]:
+        return blob.data.decode(errors="replace") if blob is not None else None
+
+    return list(await asyncio.gather(*(
+        _summarize(path, status, text(blobs[2 * i]), text(blobs[2 * i + 1]))
+        for i, (status, _old_path, path) in enumerate(python_changes)
+    )))
+
+
+async def _nothing() -> None:
+    return None
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Local change-type classifier for analyze_file_changes.
+
+Scores the PR template change types from commit-message prefixes and keywords,
+the kinds of files touched and a few features of the diff, so a template can be
+suggested without another model round trip. Heuristic by design: the ranking is
+a starting point the model can confirm or override with suggest_template.
+
+ChangeTypeResolver maps the free-form change_type given to suggest_template
+("bugfix", "perf", "Docs update", ...) to a template file.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from git_analysis import classify_path, parse_name_status
+
+CHANGE_TYPES = ("bug", "feature", "docs", "refactor", "test", "performance", "security")
+
+# Conventional commit prefixes (fix:, feat(api):, perf!:, ...)
+COMMIT_PREFIX = re.compile(r"^(\w+)(\([^)]*\))?!?:")
+PREFIX_TYPES = {
+    "fix": "bug", "bugfix": "bug", "hotfix": "bug",
+    "feat": "feature", "feature": "feature",
+    "docs": "docs", "doc": "docs",
+    "refactor": "refactor", "style": "refactor", "chore": "refactor", "cleanup": "refactor",
+    "test": "test", "tests": "test",
+    "perf": "performance",
+    "security": "security", "sec": "security"
+}
+
+# Words in commit subjects, matched at word starts
+SUBJECT_KEYWORDS = {
+    "bug": ("fix", "bug", "crash", "regression", "broken", "error", "issue"),
+    "feature": ("add", "implement", "support", "introduce", "new", "allow"),
+    "docs": ("doc", "readme", "typo", "comment", "guide"),
+    "refactor": ("refactor", "clean", "rename", "simplify", "restructure", "move", "extract"),
+    "test": ("test", "coverage"),
+    "performance": ("perf", "speed", "fast", "optimi", "cache", "latency", "memory"),
+    "security": ("secur", "vulnerab", "cve", "xss", "csrf", "injection", "sanitiz", "auth")
+}
+
+# Markers in added diff lines, with the most they can contribute
+DIFF_FEATURES = (
+    ("feature", re.compile(r"^\+\s*(async\s+)?(def|class)\s"), 0.5, 2.0),
+    ("feature", re.compile(r"^\+\s*@mcp\.(tool|prompt|resource)\("), 1.0, 2.0),
+    ("performance", re.compile(r"lru_cache|functools\.cache|asyncio\.gather|ProcessPool|ThreadPool|mmap"), 0.5, 2.0),
+    ("security", re.compile(r"sanitiz|escape\(|hmac|secrets\.|verify=True|permission", re.IGNORECASE), 0.5, 2.0),
+    ("bug", re.compile(r"^\+\s*(except\b|raise\b|if .* is None\b)"), 0.5, 1.5),
+)
+
+SECURITY_PATHS = re.compile(r"auth|secur|crypt|permission|secret|token", re.IGNORECASE)
+
+# Weight of one commit's conventional prefix compared to one keyword match
+PREFIX_WEIGHT = 3.0
+# Total weight shared by the files' categories
+PATH_WEIGHT = 2.0
+
+
+def classify_change(paths: Iterable[str], subjects: Iterable[str], diff: str = "") -> List[Tuple[str, float]]:
+    """Rank change types by confidence (summing to 1); empty if nothing points anywhere."""
+    scores: Dict[str, float] = dict.fromkeys(CHANGE_TYPES, 0.0)
+
+    for subject in subjects:
+        match = COMMIT_PREFIX.match(subject.strip())
+        if match and match.group(1).lower() in PREFIX_TYPES:
+            scores[PREFIX_TYPES[match.group(1).lower()]] += PREFIX_WEIGHT
+            subject = subject[match.end():]
+        words = re.findall(r"\w+", subject.lower())
+        for change_type, keywords in SUBJECT_KEYWORDS.items():
+            if any(word.startswith(keywords) for word in words):
+                scores[change_type] += 1.0
+
+    paths = list(paths)
+    for path in paths:
+        share = PATH_WEIGHT / len(paths)
+        category = classify_path(path)
+        if category == "docs":
+            scores["docs"] += share
+        elif category == "test":
+            scores["test"] += share
+        if SECURITY_PATHS.search(path):
+            scores["security"] += share
+
+    additions = deletions = 0
+    feature_scores = [0.0] * len(DIFF_FEATURES)
+    for line in diff.splitlines():
+        if line.startswith("+") and not line.startswith("+++"):
+            additions += 1
+            for i, (_, pattern, weight, cap) in enumerate(DIFF_FEATURES):
+                if pattern.search(line):
+                    feature_scores[i] = min(cap, feature_scores[i] + weight)
+        elif line.startswith("-") and not line.startswith("---"):
+            deletions += 1
+    for (change_type, _, _, _), score in zip(DIFF_FEATURES, feature_scores):
+        scores[change_type] += score
+    if deletions > 2 * additions and deletions >= 10:
+        # Mostly removed code reads as cleanup
+        scores["refactor"] += 1.0
+
+    total = sum(scores.values())
+    if not total:
+        return []
+    ranked = sorted(((t, s / total) for t, s in scores.items() if s), key=lambda item: item[1], reverse=True)
+    return [(change_type, round(confidence, 2)) for change_type, confidence in ranked]
+
+
+def classify_analysis(analysis: dict) -> List[Tuple[str, float]]:
+    """Classify an analyze_changes result in any of its output formats."""
+    if "files" in analysis:
+        paths = [f["path"] for f in analysis["files"]]
+    else:
+        paths = [path for _, _, path in parse_name_status(analysis.get("files_changed", ""))]
+
+    commits = analysis.get("commits", "")
+    if isinstance(commits, list):
+        subjects = [commit["subject"] for commit in commits]
+    else:
+        # `git log --oneline`: abbreviated SHA, then the subject
+        subjects = [line.partition(" ")[2] for line in commits.splitlines()]
+
+    diff = analysis.get("diff", "")
+    # Summarized Python files are not in the diff, so add back what the summary says
+    for summary in analysis.get("python_changes") or []:
+        extra = [f"+def {name}():" for name in summary.get("added", [])]
+        extra += [f"+@{d['decorator']}" for d in summary.get("decorators_added", [])]
+        diff += "\n" + "\n".join(extra)
+    return classify_change(paths, subjects, diff)
+
+
+# Suffixes stripped by stem(), longest first
+SUFFIXES = ("izations", "isations", "ization", "isation", "ations", "ation", "ments", "ment",
+            "ances", "ance", "ences", "ence", "ities", "ity", "izing", "izes", "ized", "ize",
+            "ising", "ises", "ised", "ise", "ings", "ing", "ers", "er", "ies", "es", "ed", "s", "e")
+# Words that say nothing about the change type
+STOP_WORDS = {"a", "an", "and", "the", "of", "for", "to", "in", "on", "with", "change", "changes",
+              "update", "updates", "pr", "minor", "small"}
+
+# Confidence of a word matched exactly, by stem, by prefix, and at most by trigram similarity
+EXACT_CONFIDENCE = 1.0
+STEM_CONFIDENCE = 0.9
+PREFIX_CONFIDENCE = 0.75
+KEYWORD_CONFIDENCE = 0.7
+NGRAM_CONFIDENCE = 0.6
+# Trigram similarity below which a word is not matched at all
+MIN_NGRAM_SIMILARITY = 0.4
+
+
+def stem(word: str) -> str:
+    """Crude suffix stripping, enough to make "tests", "testing" and "tested" agree."""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def trigrams(word: str) -> set:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Resolution(NamedTuple):
+    template: str
+    confidence: float
+    # exact, stem, prefix, keyword, ngram or default
+    match: str
+
+
+class ChangeTypeResolver:
+    """Index from change-type words to template files, built once per template set.
+
+    Each word of the input is looked up exactly, by stem, as a prefix of a
+    known word, by the subject keywords it starts with and finally by trigram
+    similarity; all but the last are a few dict lookups. The template with the
+    highest confidence wins, and words that point at more than one template
+    are ignored.
+    """
+
+    def __init__(self, aliases: Dict[str, str], default: str, keywords: Optional[Dict[str, str]] = None):
+        self.default = default
+        self.exact: Dict[str, Optional[str]] = {}
+        self.stems: Dict[str, Optional[str]] = {}
+        self.prefixes: Dict[str, Optional[str]] = {}
+        self.keywords: Dict[str, Optional[str]] = {}
+        for keyword, template in (keywords or {}).items():
+            self._add(self.keywords, keyword, template)
+        self.grams: Dict[str, List[str]] = {}
+        self.gram_counts: Dict[str, int] = {}
+        for alias, template in aliases.items():
+            self._add(self.exact, alias, template)
+            self._add(self.stems, stem(alias), template)
+        for word, template in self.exact.items():
+            if template is None:
+                continue
+            for end in range(3, len(word)):
+                self._add(self.prefixes, word[:end], template)
+            self.gram_counts[word] = len(trigrams(word))
+            for gram in trigrams(word):
+                self.grams.setdefault(gram, []).append(word)
+
+    @staticmethod
+    def _add(index: Dict[str, Optional[str]], key: str, template: str):
+        # None marks a key shared by several templates
+        index[key] = template if index.get(key, template) == template else None
+
+    @classmethod
+    def build(cls, type_mapping: Dict[str, str], templates: Iterable[Tuple[str, str]],
+              default: str) -> "ChangeTypeResolver":
+        """Index type_mapping, the commit prefixes and subject keywords, and (filename, title) of each template."""
+        aliases = {
+            prefix: type_mapping[change_type]
+            for prefix, change_type in PREFIX_TYPES.items() if change_type in type_mapping
+        }
+        # A template's own name beats a commit prefix (chore.md over "chore" meaning refactor)
+        names: Dict[str, str] = {}
+        for filename, title in templates:
+            for word in re.findall(r"[a-z0-9]+", f"{filename[:-3]} {title}".lower()):
+                if word not in STOP_WORDS:
+                    names.setdefault(word, filename)
+        aliases.update(names)
+        aliases.update(type_mapping)
+        keywords = {
+            keyword: type_mapping[change_type]
+            for change_type, words in SUBJECT_KEYWORDS.items() if change_type in type_mapping
+            for keyword in words
+        }
+        return cls(aliases, default, keywords)
+
+    def _word(self, word: str) -> Optional[Tuple[str, float, str]]:
+        for index, key, confidence, match in (
+            (self.exact, word, EXACT_CONFIDENCE, "exact"),
+            (self.stems, stem(word), STEM_CONFIDENCE, "stem"),
+            (self.prefixes, word, PREFIX_CONFIDENCE, "prefix")
+        ):
+            if index.get(key):
+                return index[key], confidence, match
+        for end in range(len(word), 2, -1):
+            if self.keywords.get(word[:end]):
+                return self.keywords[word[:end]], KEYWORD_CONFIDENCE, "keyword"
+        # Typos: the known word sharing the largest fraction of trigrams
+        grams = trigrams(word)
+        shared = Counter(known for gram in grams for known in self.grams.get(gram, ()))
+        best, best_similarity = None, 0.0
+        for known, count in shared.items():
+            similarity = count / (len(grams) + self.gram_counts[known] - count)
+            if similarity > best_similarity:
+                best, best_similarity = known, similarity
+        if best is None or best_similarity < MIN_NGRAM_SIMILARITY:
+            return None
+        return self.exact[best], round(NGRAM_CONFIDENCE * best_similarity, 2), "ngram"
+
+    def resolve(self, change_type: str) -> Resolution:
+        text = change_type.lower().strip()
+        words = [w for w in re.findall(r"[a-z0-9]+", text) if w not in STOP_WORDS]
+        # "bug fix" and "bug-fix" are also tried as "bugfix"
+        compact = "".join(words)
+        if self.exact.get(compact):
+            return Resolution(self.exact[compact], EXACT_CONFIDENCE, "exact")
+
+        best: Dict[str, Tuple[float, str]] = {}
+        for word in words:
+            found = self._word(word)
+            if found and found[1] > best.get(found[0], (0.0, ""))[0]:
+                best[found[0]] = found[1:]
+        if not best:
+            return Resolution(self.default, 0.0, "default")
+        template = max(best, key=lambda t: best[t][0])
+        return Resolution(template, *best[template])
@@ -0,0 +1,1427 @@
+#!/usr/bin/env python3
+"""
+Git helpers for the analyze_file_changes tool.
+Runs git as non-blocking asyncio subprocesses so the MCP event loop stays responsive,
+or reads the repository in-process through git_objects (GIT_ANALYSIS_BACKEND=inprocess).
+"""
+
+import asyncio
+import base64
+import fnmatch
+import itertools
+import json
+import os
+import re
+import secrets
+import subprocess
+import tempfile
+import time
+from array import array
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ast_summary import summarize_python_changes
+from git_objects import (
+    OBJECT_FORMAT_ERRORS, FileDiff, GitObjectError, format_name_status, format_stat, open_repository
+)
+
+# Bytes read from git's stdout per chunk when streaming
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Spooled diffs stay in memory up to this size, then move to a temporary file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+# Lines between two entries of a spooled diff's offset index
+SPOOL_INDEX_STRIDE = 256
+
+# git log records are separated by RS and fields by US, which never occur in commit metadata
+LOG_FORMAT = "%x1e%H%x1f%h%x1f%an <%ae>%x1f%at%x1f%s"
+RECORD_SEPARATOR = b"\x1e"
+
+# Extra git diff options for each of analyze_changes' diff modes
+DIFF_MODES = {
+    "default": [],
+    "minimal": ["--unified=0"],
+    "function": ["--function-context"],
+    "word": ["--word-diff=plain"]
+}
+
+# Values for analyze_changes' commit_format
+COMMIT_FORMATS = ("oneline", "full")
+
+# Seconds a git process gets to exit after SIGTERM before it is killed
+TERMINATE_GRACE_SECONDS = 2.0
+
+
+class ChildProcesses:
+    """Stops git processes whose caller was cancelled or timed out, and counts them.
+
+    Without this, a cancelled tool call leaves its git commands running to the end.
+    """
+
+    def __init__(self, grace_seconds: float = TERMINATE_GRACE_SECONDS):
+        self.grace_seconds = grace_seconds
+        self.reaping: Dict[asyncio.subprocess.Process, asyncio.Task] = {}
+        self.terminated = 0
+        self.killed = 0
+        self.timeouts = 0
+
+    def stop(self, process: asyncio.subprocess.Process):
+        """Send SIGTERM now and reap the process in the background.
+
+        Nothing is awaited, so this also works in a cancelled task where any await
+        would be interrupted again. Escalates to SIGKILL after grace_seconds.
+        """
+        if process.returncode is not None or process in self.reaping:
+            return
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            return
+        self.terminated += 1
+        task = asyncio.get_running_loop().create_task(self._reap(process))
+        self.reaping[process] = task
+        task.add_done_callback(lambda _: self.reaping.pop(process, None))
+
+    async def _reap(self, process: asyncio.subprocess.Process):
+        try:
+            await asyncio.wait_for(process.wait(), self.grace_seconds)
+        except asyncio.TimeoutError:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            else:
+                self.killed += 1
+            await process.wait()
+
+    def stats(self) -> dict:
+        return {
+            "terminated": self.terminated,
+            "killed": self.killed,
+            "reaping": len(self.reaping),
+            "timeouts": self.timeouts
+        }
+
+
+CHILD_PROCESSES = ChildProcesses()
+
+
+async def run_with_timeout(awaitable, timeout: Optional[float], what: str):
+    """Await with a timeout; on expiry the cancelled git processes are stopped by CHILD_PROCESSES."""
+    if not timeout:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        CHILD_PROCESSES.timeouts += 1
+        raise TimeoutError(f"{what} timed out after {timeout:g} seconds") from None
+
+
+async def run_git(args: List[str], cwd: str, check: bool = False) -> str:
+    """Run a git command without blocking the event loop and return its stdout.
+
+    Args:
+        args: Arguments passed to git (without the leading "git")
+        cwd: Directory to run the command in
+        check: Raise subprocess.CalledProcessError on a non-zero exit code
+    """
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except BaseException:
+        CHILD_PROCESSES.stop(process)
+        raise
+
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode,
+            ["git", *args],
+            output=stdout.decode(errors="replace"),
+            stderr=stderr.decode(errors="replace")
+        )
+
+    return stdout.decode(errors="replace")
+
+
+class DiffHunk(NamedTuple):
+    header: str
+    offset: int
+    length: int
+    line_start: int
+    line_count: int
+
+
+class DiffFile(NamedTuple):
+    path: str
+    old_path: str
+    offset: int
+    header_length: int
+    length: int
+    line_start: int
+    line_count: int
+    hunks: List[DiffHunk]
+    additions: int
+    deletions: int
+    binary: bool
+
+
+# Escapes in the paths git quotes (core.quotePath): octal bytes for non-ASCII, and these
+_PATH_ESCAPES = {b"a": b"\a", b"b": b"\b", b"t": b"\t", b"n": b"\n", b"v": b"\v", b"f": b"\f", b"r": b"\r"}
+_QUOTED_PATH_ESCAPE = re.compile(rb"\\([0-7]{3}|.)")
+
+
+def unquote_path(raw: bytes) -> bytes:
+    """A path as git printed it, with the quotes and C-style escapes of a quoted path undone."""
+    if len(raw) < 2 or not (raw.startswith(b'"') and raw.endswith(b'"')):
+        return raw
+    return _QUOTED_PATH_ESCAPE.sub(
+        lambda m: bytes([int(m[1], 8)]) if len(m[1]) == 3 else _PATH_ESCAPES.get(m[1], m[1]),
+        raw[1:-1]
+    )
+
+
+def _diff_path(raw: bytes, prefix: bytes) -> Optional[str]:
+    # "a/path" or "b/path" from ---/+++ lines; None for /dev/null
+    raw = unquote_path(raw.rstrip(b"\n").split(b"\t")[0])
+    if raw == b"/dev/null":
+        return None
+    return raw[len(prefix):].decode(errors="replace") if raw.startswith(prefix) else raw.decode(errors="replace")
+
+
+class SpooledDiff:
+    """Complete diff output spooled to a temporary file, for paging and file lookups.
+
+    Small diffs stay in memory and large ones roll over to disk. Two indexes are
+    built lazily on first use: a sparse index of line offsets (one every
+    SPOOL_INDEX_STRIDE lines), so a page costs a seek plus at most one stride of
+    extra lines, and a per-file index of hunks with byte offsets and line counts,
+    so single files or hunks are read straight from their offsets.
+    """
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        self.size_bytes = 0
+        self.total_lines = 0
+        self._checkpoints: Optional[array] = None
+        self._files: Optional[Dict[str, DiffFile]] = None
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.size_bytes += len(data)
+
+    def write_lines(self, lines: Iterable[str]):
+        for line in lines:
+            self.write(line.encode(errors="replace") + b"\n")
+
+    def _build_index(self):
+        checkpoints = array("Q", [0])
+        line = 0
+        offset = 0
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            pos = chunk.find(b"\n")
+            while pos != -1:
+                line += 1
+                if line % SPOOL_INDEX_STRIDE == 0:
+                    checkpoints.append(offset + pos + 1)
+                pos = chunk.find(b"\n", pos + 1)
+            offset += len(chunk)
+        self._checkpoints = checkpoints
+
+    def read_lines(self, start: int, count: int) -> List[str]:
+        """Read count lines starting at line number start (0-based)."""
+        if self._checkpoints is None:
+            self._build_index()
+        checkpoint = min(start // SPOOL_INDEX_STRIDE, len(self._checkpoints) - 1)
+        self.file.seek(self._checkpoints[checkpoint])
+        skip = start - checkpoint * SPOOL_INDEX_STRIDE
+        lines = []
+        for line in self.file:
+            if skip:
+                skip -= 1
+                continue
+            lines.append(line.rstrip(b"\n").decode(errors="replace"))
+            if len(lines) >= count:
+                break
+        return lines
+
+    def _build_file_index(self):
+        files = {}
+        current = None
+        hunks = []
+        offset = line_number = 0
+
+        def finish(end_offset: int, end_line: int):
+            if current is None:
+                return
+            path, old_path, start, start_line, additions, deletions, binary = current
+            header_end = hunks[0].offset if hunks else end_offset
+            closed = [hunk._replace(length=next_hunk.offset - hunk.offset,
+                                    line_count=next_hunk.line_start - hunk.line_start)
+                      for hunk, next_hunk in zip(hunks, hunks[1:])]
+            if hunks:
+                last = hunks[-1]
+                closed.append(last._replace(length=end_offset - last.offset,
+                                            line_count=end_line - last.line_start))
+            files[path] = DiffFile(path, old_path, start, header_end - start, end_offset - start,
+                                   start_line, end_line - start_line, closed, additions, deletions, binary)
+
+        self.file.seek(0)
+        for line in self.file:
+            if line.startswith(b"diff --git "):
+                finish(offset, line_number)
+                # "diff --git a/<path> b/<path>": exact when both sides are equal
+                names = line[len(b"diff --git "):].rstrip(b"\n")
+                half = (len(names) - 1) // 2
+                path = _diff_path(names[half + 1:], b"b/") or ""
+                current = [path, _diff_path(names[:half], b"a/") or path, offset, line_number, 0, 0, False]
+                hunks = []
+            elif hunks:
+                if line.startswith(b"+"):
+                    current[4] += 1
+                elif line.startswith(b"-"):
+                    current[5] += 1
+            elif current is not None:
+                if line.startswith(b"--- "):
+                    current[1] = _diff_path(line[4:], b"a/") or current[1]
+                elif line.startswith(b"+++ "):
+                    current[0] = _diff_path(line[4:], b"b/") or current[1]
+                elif line.startswith(b"rename to "):
+                    current[0] = unquote_path(line[len(b"rename to "):].rstrip(b"\n")).decode(errors="replace")
+                elif line.startswith(b"rename from "):
+                    current[1] = unquote_path(line[len(b"rename from "):].rstrip(b"\n")).decode(errors="replace")
+                elif line.startswith(b"Binary files ") or line.startswith(b"GIT binary patch"):
+                    current[6] = True
+            if current is not None and line.startswith(b"@@"):
+                hunks.append(DiffHunk(line.rstrip(b"\n").decode(errors="replace"), offset, 0, line_number, 0))
+            offset += len(line)
+            line_number += 1
+        finish(offset, line_number)
+        self._files = files
+
+    def files(self) -> Dict[str, DiffFile]:
+        """Index of the files in the diff, keyed by their new path."""
+        if self._files is None:
+            self._build_file_index()
+        return self._files
+
+    def read_bytes(self, offset: int, length: int) -> bytes:
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def close(self):
+        self.file.close()
+
+
+async def stream_git_lines(
+    args: List[str],
+    cwd: str,
+    max_lines: int,
+    exact_total: bool = True,
+    spool: Optional[SpooledDiff] = None
+) -> Tuple[List[str], Optional[int], bool]:
+    """Stream a git command's output, keeping at most max_lines lines in memory.
+
+    Lines past the cap are only counted. With exact_total=False git is killed as
+    soon as the output is known to be longer than max_lines. If a spool is given,
+    the complete output is also written to it and git always runs to the end.
+
+    Returns:
+        (kept lines, total line count or None if git was stopped early, truncated)
+    """
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        cwd=cwd
+    )
+
+    kept = []
+    total = 0
+    pending = b""
+    truncated = False
+    ends_with_newline = True
+    try:
+        while True:
+            chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            ends_with_newline = chunk.endswith(b"\n")
+            if spool is not None:
+                spool.write(chunk)
+
+            if len(kept) < max_lines:
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                room = max_lines - len(kept)
+                kept.extend(line.decode(errors="replace") for line in lines[:room])
+                total += len(lines)
+                if len(kept) < max_lines:
+                    continue
+                # Anything left over after filling the cap means the output is truncated
+                truncated = len(lines) > room or bool(pending)
+                pending = b""
+            else:
+                truncated = True
+                total += chunk.count(b"\n")
+
+            if truncated and not exact_total and spool is None:
+                return kept, None, True
+
+        if pending:
+            kept.append(pending.decode(errors="replace"))
+        if not ends_with_newline:
+            total += 1
+        return kept, total, truncated
+    except BaseException:
+        CHILD_PROCESSES.stop(process)
+        raise
+    finally:
+        if process.returncode is None and process not in CHILD_PROCESSES.reaping:
+            # Git is stopped early once truncation is certain
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+
+async def count_git_output(args: List[str], cwd: str) -> Tuple[int, int]:
+    """Run a git command and return the (bytes, lines) of its output without keeping it."""
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        cwd=cwd
+    )
+    size = lines = 0
+    ends_with_newline = True
+    try:
+        while True:
+            chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            lines += chunk.count(b"\n")
+            ends_with_newline = chunk.endswith(b"\n")
+        await process.wait()
+    except BaseException:
+        CHILD_PROCESSES.stop(process)
+        raise
+    return size, lines + (0 if ends_with_newline else 1)
+
+
+def take_lines(
+    lines: Iterable[str],
+    max_lines: int,
+    exact_total: bool = True,
+    spool: Optional[SpooledDiff] = None
+) -> Tuple[List[str], Optional[int], bool]:
+    """In-memory counterpart of stream_git_lines for lazily generated output."""
+    rest = iter(lines)
+    kept = list(itertools.islice(rest, max_lines))
+    following = next(rest, None)
+    if spool is not None:
+        spool.write_lines(kept)
+    if following is None:
+        return kept, len(kept), False
+    if spool is not None:
+        spool.write_lines([following])
+        total = len(kept) + 1
+        for line in rest:
+            spool.write_lines([line])
+            total += 1
+        return kept, total, True
+    if not exact_total:
+        return kept, None, True
+    return kept, len(kept) + 1 + sum(1 for _ in rest), True
+
+
+def parse_log_record(record: bytes) -> dict:
+    """Parse one LOG_FORMAT record, optionally followed by --name-only file names."""
+    header, _, files = record.decode(errors="replace").partition("\n")
+    sha, short_sha, author, timestamp, subject = header.split("\x1f", 4)
+    return {
+        "sha": sha,
+        "short_sha": short_sha,
+        "author": author,
+        "timestamp": int(timestamp),
+        "subject": subject,
+        "files": [name for name in files.split("\n") if name]
+    }
+
+
+async def stream_git_log(
+    cwd: str,
+    revisions: List[str],
+    max_commits: Optional[int],
+    with_files: bool = False,
+    skip: int = 0
+) -> Tuple[List[dict], int]:
+    """Run git log once, parsing at most max_commits commits and only counting the rest.
+
+    Returns:
+        (parsed commits, number of commits after skip)
+    """
+    args = ["log", f"--format={LOG_FORMAT}"]
+    if with_files:
+        args.append("--name-only")
+    if skip:
+        args.append(f"--skip={skip}")
+    process = await asyncio.create_subprocess_exec(
+        "git", *args, *revisions, "--",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        cwd=cwd
+    )
+
+    def wanted() -> bool:
+        return max_commits is None or len(commits) < max_commits
+
+    commits = []
+    total = 0
+    pending = b""
+    try:
+        while True:
+            chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            total += chunk.count(RECORD_SEPARATOR)
+            if not wanted():
+                continue
+            *records, pending = (pending + chunk).split(RECORD_SEPARATOR)
+            for record in records:
+                # The output starts with a separator, leaving an empty first piece
+                if record and wanted():
+                    commits.append(parse_log_record(record))
+        if pending and total and wanted():
+            commits.append(parse_log_record(pending))
+        return commits, total
+    except BaseException:
+        CHILD_PROCESSES.stop(process)
+        raise
+    finally:
+        if process.returncode is None and process not in CHILD_PROCESSES.reaping:
+            await process.wait()
+
+
+def render_commits(commits: List[dict], commit_format: str):
+    """Render commits as `git log --oneline` text or, for "full", as a list of dicts."""
+    if commit_format == "oneline":
+        return "".join(f"{c['short_sha']} {c['subject']}\n" for c in commits)
+    return [
+        {key: c[key] for key in ("short_sha", "author", "timestamp", "subject", "files")}
+        for c in commits
+    ]
+
+
+# Full SHA-1 or SHA-256 object names; anything else in a cursor could be read by git as an option
+COMMIT_SHA = re.compile(r"[0-9a-f]{40}(?:[0-9a-f]{24})?")
+
+# Directories this server issued commits cursors for; a cursor naming any other is rejected
+_cursor_directories = set()
+
+
+def make_commit_cursor(cwd: str, base: str, head: str, skip: int, commit_format: str) -> str:
+    """Encode everything needed for the next page of commits; SHAs keep pages stable."""
+    _cursor_directories.add(cwd)
+    state = {"cwd": cwd, "base": base, "head": head, "skip": skip, "format": commit_format}
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+
+async def get_commit_page(cursor: str, max_commits: int = 100) -> dict:
+    """Return the next page of commits that analyze_file_changes left out."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        cwd, base, head, skip, commit_format = (
+            state["cwd"], state["base"], state["head"], int(state["skip"]), state["format"]
+        )
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid commits cursor. Call analyze_file_changes again to get a new one.")
+    # The cursor comes back from the client, so only what make_commit_cursor could have written is run
+    if (
+        not isinstance(cwd, str) or cwd not in _cursor_directories
+        or not all(isinstance(sha, str) and COMMIT_SHA.fullmatch(sha) for sha in (base, head))
+        or skip < 0
+        or commit_format not in COMMIT_FORMATS
+    ):
+        raise ValueError("Invalid commits cursor. Call analyze_file_changes again to get a new one.")
+
+    commits, remaining = await stream_git_log(
+        cwd, [f"{base}..{head}"], max_commits, commit_format == "full", skip
+    )
+    end = skip + len(commits)
+    return {
+        "commits": render_commits(commits, commit_format),
+        "start": skip,
+        "end": end,
+        "total_commits": skip + remaining,
+        "commits_cursor": make_commit_cursor(cwd, base, head, end, commit_format)
+        if end < skip + remaining else None
+    }
+
+
+def file_entry(
+    path: str,
+    status: str,
+    additions: int,
+    deletions: int,
+    old_path: Optional[str] = None,
+    binary: bool = False
+) -> dict:
+    """One changed file in structured output; old_path is only given for renames and copies."""
+    entry = {"path": path, "status": status, "additions": additions, "deletions": deletions, "binary": binary}
+    if old_path is not None:
+        entry["old_path"] = old_path
+    return entry
+
+
+def parse_raw_numstat(output: str) -> List[dict]:
+    """Parse `git diff --raw --numstat -z` into structured file entries.
+
+    The raw records come first and give each file's status; the numstat records
+    that follow give its line counts ("-" for binary files).
+    """
+    tokens = iter(output.split("\0"))
+    statuses = {}
+    files = []
+    for token in tokens:
+        if not token:
+            continue
+        if token.startswith(":"):
+            # :old_mode new_mode old_sha new_sha status, then one or two paths
+            status = token.split()[-1]
+            if status[0] in "RC":
+                old_path, path = next(tokens), next(tokens)
+            else:
+                old_path, path = None, next(tokens)
+            statuses[path] = (status[0], old_path)
+        else:
+            additions, deletions, path = token.split("\t", 2)
+            if not path:
+                # Renames and copies put both paths in the following records
+                next(tokens)
+                path = next(tokens)
+            binary = additions == "-"
+            status, old_path = statuses.get(path, ("M", None))
+            files.append(file_entry(
+                path, status, 0 if binary else int(additions), 0 if binary else int(deletions), old_path, binary
+            ))
+    return files
+
+
+class SubprocessBackend:
+    """Runs the git command line, one concurrent subprocess per section."""
+
+    name = "subprocess"
+
+    async def collect(
+        self,
+        cwd: str,
+        base_branch: str,
+        include_diff: bool,
+        max_diff_lines: int,
+        exact_total_lines: bool,
+        spool: Optional[SpooledDiff] = None,
+        structured: bool = False,
+        max_commits: Optional[int] = None,
+        commit_files: bool = False,
+        diff_mode: str = "default"
+    ) -> dict:
+        async def no_diff() -> Tuple[List[str], Optional[int], bool]:
+            return [], 0, False
+
+        async def nothing() -> str:
+            return ""
+
+        # Only the file list is checked - it surfaces a bad base branch as a git error
+        if structured:
+            # One NUL-separated listing holds both the status and the line counts
+            file_sections = (
+                run_git(["diff", "--raw", "--numstat", "-z", f"{base_branch}...HEAD"], cwd, check=True),
+                nothing()
+            )
+        else:
+            file_sections = (
+                run_git(["diff", "--name-status", f"{base_branch}...HEAD"], cwd, check=True),
+                run_git(["diff", "--stat", f"{base_branch}...HEAD"], cwd)
+            )
+        files_changed, statistics, (diff_lines, total_diff_lines, truncated), (commits, total_commits) = \
+            await asyncio.gather(
+                *file_sections,
+                stream_git_lines(
+                    ["diff", *DIFF_MODES[diff_mode], f"{base_branch}...HEAD"], cwd, max_diff_lines, exact_total_lines, spool
+                ) if include_diff else no_diff(),
+                stream_git_log(cwd, [f"{base_branch}..HEAD"], max_commits, commit_files)
+            )
+        if structured:
+            return {
+                "files": parse_raw_numstat(files_changed),
+                "commits": commits,
+                "total_commits": total_commits,
+                "diff_lines": diff_lines,
+                "total_diff_lines": total_diff_lines,
+                "truncated": truncated
+            }
+        return {
+            "files_changed": files_changed,
+            "statistics": statistics,
+            "commits": commits,
+            "total_commits": total_commits,
+            "diff_lines": diff_lines,
+            "total_diff_lines": total_diff_lines,
+            "truncated": truncated
+        }
+
+    async def resolve_state(self, cwd: str, base_branch: str) -> Tuple[str, str, str, str]:
+        """Return (git dir, base SHA, merge-base SHA, HEAD SHA) with two cheap git calls."""
+        rev_parse, merge_base = await asyncio.gather(
+            run_git(["rev-parse", "--absolute-git-dir", "HEAD", f"{base_branch}^{{commit}}"], cwd, check=True),
+            run_git(["merge-base", base_branch, "HEAD"], cwd, check=True)
+        )
+        # One line per argument; the git dir may contain spaces
+        git_dir, head, base = rev_parse.splitlines()
+        return git_dir, base, merge_base.strip(), head
+
+
+class InProcessBackend:
+    """Reads the object database directly with git_objects, without forking git.
+
+    Trees and blobs are read once and every section (name-status, stat, patch and
+    commit list) is produced from the same per-file diffs. Raises GitObjectError
+    for anything git_objects cannot handle.
+    """
+
+    name = "inprocess"
+
+    async def collect(
+        self,
+        cwd: str,
+        base_branch: str,
+        include_diff: bool,
+        max_diff_lines: int,
+        exact_total_lines: bool,
+        spool: Optional[SpooledDiff] = None,
+        structured: bool = False,
+        max_commits: Optional[int] = None,
+        commit_files: bool = False,
+        diff_mode: str = "default"
+    ) -> dict:
+        return await self._run(
+            self._collect, cwd, base_branch, include_diff, max_diff_lines, exact_total_lines, spool, structured,
+            max_commits, commit_files, diff_mode
+        )
+
+    async def resolve_state(self, cwd: str, base_branch: str) -> Tuple[str, str, str, str]:
+        """Return (git dir, base SHA, merge-base SHA, HEAD SHA) from the refs on disk."""
+        return await self._run(self._resolve_state, cwd, base_branch)
+
+    @staticmethod
+    async def _run(function, *args):
+        # Object parsing is CPU and disk bound, so keep it off the event loop
+        try:
+            return await asyncio.to_thread(function, *args)
+        except OBJECT_FORMAT_ERRORS as e:
+            # A corrupt or unexpected object: let the caller fall back to git
+            raise GitObjectError(f"Cannot parse git object: {type(e).__name__}: {e}") from e
+
+    def _resolve_state(self, cwd: str, base_branch: str) -> Tuple[str, str, str, str]:
+        repo = open_repository(cwd)
+        head = repo.resolve("HEAD")
+        base = repo.resolve(base_branch)
+        merge_base = repo.merge_base(base, head)
+        if merge_base is None:
+            raise GitObjectError(f"No merge base between {base_branch} and HEAD")
+        return str(repo.git_dir), base, merge_base, head
+
+    @staticmethod
+    def _files_touched(repo, commit) -> List[str]:
+        """Paths a commit changed, like git log --name-only (which lists none for merges)."""
+        if len(commit.parents) > 1:
+            return []
+        parent_tree = repo.commit(commit.parents[0]).tree if commit.parents else None
+        return [change.path for change in repo.diff_trees(parent_tree, commit.tree)]
+
+    def _collect(
+        self,
+        cwd: str,
+        base_branch: str,
+        include_diff: bool,
+        max_diff_lines: int,
+        exact_total_lines: bool,
+        spool: Optional[SpooledDiff],
+        structured: bool,
+        max_commits: Optional[int],
+        commit_files: bool,
+        diff_mode: str
+    ) -> dict:
+        if include_diff and diff_mode not in ("default", "minimal"):
+            raise GitObjectError(f"diff_mode {diff_mode} needs the git command line")
+        repo = open_repository(cwd)
+        head = repo.resolve("HEAD")
+        base = repo.resolve(base_branch)
+        merge_base = repo.merge_base(base, head)
+        if merge_base is None:
+            raise GitObjectError(f"No merge base between {base_branch} and HEAD")
+
+        changes = repo.diff_trees(repo.commit(merge_base).tree, repo.commit(head).tree)
+        context_lines = 0 if diff_mode == "minimal" else 3
+        diffs = [FileDiff(repo, change, context_lines) for change in changes]
+        commits = repo.commits_between(base, head)
+
+        diff_lines, total_diff_lines, truncated = [], 0, False
+        if include_diff:
+            patch = (line for diff in diffs for line in diff.patch_lines())
+            diff_lines, total_diff_lines, truncated = take_lines(patch, max_diff_lines, exact_total_lines, spool)
+
+        shown = commits if max_commits is None else commits[:max_commits]
+        sections = {
+            "commits": [
+                {
+                    "sha": c.sha,
+                    "short_sha": c.sha[:7],
+                    "author": c.author,
+                    "timestamp": c.author_time,
+                    "subject": c.subject,
+                    "files": self._files_touched(repo, c) if commit_files else []
+                }
+                for c in shown
+            ],
+            "total_commits": len(commits),
+            "diff_lines": diff_lines,
+            "total_diff_lines": total_diff_lines,
+            "truncated": truncated
+        }
+        if structured:
+            sections["files"] = [
+                file_entry(d.change.path, d.change.status, d.additions, d.deletions,
+                           d.change.old_path if d.change.status == "R" else None, d.binary)
+                for d in diffs
+            ]
+        else:
+            sections["files_changed"] = format_name_status(changes)
+            sections["statistics"] = format_stat(diffs)
+        return sections
+
+
+class AnalysisCache:
+    """Bounded LRU cache of analysis results.
+
+    Keys include the merge-base and HEAD SHAs, so a cached result is valid until
+    either side of the comparison moves. Limited both by entry count and by the
+    approximate size of the cached results.
+    """
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Tuple[dict, int]]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry[0])
+
+    def put(self, key: tuple, value: dict):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.size_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (dict(value), size)
+        self.size_bytes += size
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+ANALYSIS_CACHE = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_ENTRIES", "64")),
+    max_bytes=int(os.getenv("ANALYSIS_CACHE_BYTES", str(32 * 1024 * 1024)))
+)
+
+
+class DiffPageStore:
+    """Spooled diffs of recent analyses, kept for a bounded time for paging and file lookups.
+
+    Entries expire ttl_seconds after their last use, and at most max_entries are
+    kept; the least recently used spool is closed first.
+    """
+
+    def __init__(self, max_entries: int = 16, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._spools: "OrderedDict[str, Tuple[SpooledDiff, float]]" = OrderedDict()
+        self.pages_served = 0
+        self.expired = 0
+
+    def _purge(self):
+        now = time.monotonic()
+        for token, (spool, expires_at) in list(self._spools.items()):
+            if expires_at <= now:
+                spool.close()
+                del self._spools[token]
+                self.expired += 1
+
+    def add(self, spool: SpooledDiff) -> str:
+        self._purge()
+        token = secrets.token_urlsafe(9)
+        self._spools[token] = (spool, time.monotonic() + self.ttl_seconds)
+        while len(self._spools) > self.max_entries:
+            _, (evicted, _) = self._spools.popitem(last=False)
+            evicted.close()
+        return token
+
+    def get(self, token: str) -> Optional[SpooledDiff]:
+        self._purge()
+        entry = self._spools.get(token)
+        if entry is None:
+            return None
+        self._spools[token] = (entry[0], time.monotonic() + self.ttl_seconds)
+        self._spools.move_to_end(token)
+        return entry[0]
+
+    def stats(self) -> dict:
+        self._purge()
+        return {
+            "spooled_diffs": len(self._spools),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "spooled_bytes": sum(spool.size_bytes for spool, _ in self._spools.values()),
+            "pages_served": self.pages_served,
+            "expired": self.expired
+        }
+
+
+DIFF_PAGES = DiffPageStore(
+    max_entries=int(os.getenv("DIFF_PAGE_ENTRIES", "16")),
+    ttl_seconds=float(os.getenv("DIFF_PAGE_TTL_SECONDS", "600"))
+)
+
+
+def get_file_diffs(
+    diff_id: str,
+    paths: Optional[List[str]] = None,
+    hunks: Optional[Dict[str, List[int]]] = None
+) -> dict:
+    """Return the diff of selected files or hunks from a spooled diff's file index.
+
+    Without paths, only the index is returned: every file with its line count and
+    hunk headers, so a caller can decide what to fetch.
+    """
+    spool = DIFF_PAGES.get(diff_id)
+    if spool is None:
+        raise ValueError("Unknown or expired diff_id. Call analyze_file_changes again to get a new one.")
+    files = spool.files()
+
+    if not paths:
+        return {
+            "diff_id": diff_id,
+            "files": [
+                {
+                    "path": f.path,
+                    "old_path": f.old_path if f.old_path != f.path else None,
+                    "lines": f.line_count,
+                    "hunks": [h.header for h in f.hunks]
+                }
+                for f in files.values()
+            ]
+        }
+
+    hunks = hunks or {}
+    parts = []
+    returned = []
+    not_found = []
+    for path in paths:
+        entry = files.get(path) or next((f for f in files.values() if f.old_path == path), None)
+        if entry is None:
+            not_found.append(path)
+            continue
+        wanted = hunks.get(path)
+        if wanted is None:
+            parts.append(spool.read_bytes(entry.offset, entry.length))
+        else:
+            parts.append(spool.read_bytes(entry.offset, entry.header_length))
+            for number in wanted:
+                if 1 <= number <= len(entry.hunks):
+                    hunk = entry.hunks[number - 1]
+                    parts.append(spool.read_bytes(hunk.offset, hunk.length))
+        returned.append(path)
+
+    DIFF_PAGES.pages_served += 1
+    return {
+        "diff_id": diff_id,
+        "files": returned,
+        "not_found": not_found,
+        "diff": b"".join(parts).decode(errors="replace")
+    }
+
+
+# Lockfiles, generated and vendored files rarely help a reviewer; their diffs are collapsed
+LOCKFILE_NAMES = {
+    "uv.lock", "poetry.lock", "Pipfile.lock", "package-lock.json", "yarn.lock",
+    "pnpm-lock.yaml", "Cargo.lock", "Gemfile.lock", "composer.lock", "go.sum"
+}
+GENERATED_PATTERNS = ("*.min.js", "*.min.css", "*.map", "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.generated.*")
+VENDORED_DIRS = {"vendor", "vendored", "third_party", "node_modules", "dist", "build"}
+TEST_PATTERNS = ("test_*", "*_test.*", "*.test.*", "*.spec.*", "conftest.py")
+TEST_DIRS = {"test", "tests", "__tests__", "spec"}
+DOC_PATTERNS = ("*.md", "*.mdx", "*.rst")
+DOC_DIRS = {"doc", "docs"}
+
+# Order in which file categories fill a token budget, most useful first
+FILE_CATEGORY_PRIORITY = {
+    "source": 0, "test": 1, "docs": 2,
+    "lockfile": 3, "generated": 3, "vendored": 3, "binary": 3
+}
+COLLAPSED_CATEGORIES = {"lockfile", "generated", "vendored", "binary"}
+
+
+def classify_path(path: str) -> str:
+    """Categorize a changed file as source, test, docs, lockfile, generated or vendored."""
+    parts = path.split("/")
+    name = parts[-1]
+    directories = set(parts[:-1])
+    if name in LOCKFILE_NAMES or fnmatch.fnmatch(name, "*.lock"):
+        return "lockfile"
+    if any(fnmatch.fnmatch(name, pattern) for pattern in GENERATED_PATTERNS):
+        return "generated"
+    if directories & VENDORED_DIRS:
+        return "vendored"
+    if directories & TEST_DIRS or any(fnmatch.fnmatch(name, pattern) for pattern in TEST_PATTERNS):
+        return "test"
+    if directories & DOC_DIRS or any(fnmatch.fnmatch(name, pattern) for pattern in DOC_PATTERNS):
+        return "docs"
+    return "source"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting, at about four characters per token."""
+    return (len(text) + 3) // 4
+
+
+def fit_diff_to_budget(spool: SpooledDiff, max_tokens: int, exclude: Iterable[str] = ()) -> Tuple[str, dict]:
+    """Fill a token budget with the most useful parts of a spooled diff.
+
+    Files are ranked source, tests, docs, then lockfiles, generated, vendored and
+    binary files, which are collapsed into one-line summaries. The budget is
+    filled greedily: whole files first, then as many whole hunks of a file as fit.
+    Files in exclude are left out entirely.
+    """
+    exclude = set(exclude)
+    files = sorted(
+        (entry for entry in spool.files().values() if entry.path not in exclude),
+        key=lambda f: FILE_CATEGORY_PRIORITY["binary" if f.binary else classify_path(f.path)]
+    )
+    parts = []
+    used = 0
+    included, partial, collapsed, omitted = [], [], [], []
+
+    for entry in files:
+        category = "binary" if entry.binary else classify_path(entry.path)
+        if category in COLLAPSED_CATEGORIES:
+            summary = (f"diff --git a/{entry.old_path} b/{entry.path}\n"
+                       f"... {category} diff collapsed (+{entry.additions} -{entry.deletions} lines) ...\n")
+            if used + estimate_tokens(summary) <= max_tokens:
+                parts.append(summary)
+                used += estimate_tokens(summary)
+                collapsed.append(entry.path)
+            else:
+                omitted.append(entry.path)
+            continue
+
+        text = spool.read_bytes(entry.offset, entry.length).decode(errors="replace")
+        if used + estimate_tokens(text) <= max_tokens:
+            parts.append(text)
+            used += estimate_tokens(text)
+            included.append(entry.path)
+            continue
+
+        # Take the file header and every whole hunk that still fits
+        header = spool.read_bytes(entry.offset, entry.header_length).decode(errors="replace")
+        file_parts = [header]
+        file_used = estimate_tokens(header)
+        for hunk in entry.hunks:
+            hunk_text = spool.read_bytes(hunk.offset, hunk.length).decode(errors="replace")
+            if used + file_used + estimate_tokens(hunk_text) <= max_tokens:
+                file_parts.append(hunk_text)
+                file_used += estimate_tokens(hunk_text)
+        if len(file_parts) > 1:
+            skipped = len(entry.hunks) - (len(file_parts) - 1)
+            file_parts.append(f"... {skipped} of {len(entry.hunks)} hunks omitted ...\n")
+            parts.extend(file_parts)
+            used += file_used
+            partial.append(entry.path)
+        else:
+            omitted.append(entry.path)
+
+    diff = "".join(parts)
+    if omitted or partial:
+        diff += ("\n... Diff trimmed to fit max_tokens. Use get_file_diffs with diff_id "
+                 "to fetch omitted files or hunks ...")
+    return diff, {
+        "max_tokens": max_tokens,
+        "used_tokens": used,
+        "included_files": included,
+        "partial_files": partial,
+        "collapsed_files": collapsed,
+        "omitted_files": omitted
+    }
+
+
+def diff_lines_without(spool: SpooledDiff, exclude: Iterable[str], max_lines: int) -> Tuple[List[str], int]:
+    """The first max_lines lines of a spooled diff without the files in exclude, and their total."""
+    exclude = set(exclude)
+    kept = []
+    total = 0
+    for entry in spool.files().values():
+        if entry.path in exclude:
+            continue
+        total += entry.line_count
+        if len(kept) < max_lines:
+            text = spool.read_bytes(entry.offset, entry.length).decode(errors="replace")
+            kept.extend(text.rstrip("\n").split("\n")[:max_lines - len(kept)])
+    return kept, total
+
+
+def parse_name_status(output: str) -> List[Tuple[str, Optional[str], str]]:
+    """Parse `git diff --name-status` into (status letter, old path for renames/copies, path)."""
+    changes = []
+    for line in output.splitlines():
+        fields = [unquote_path(field.encode()).decode(errors="replace") for field in line.split("\t")]
+        if len(fields) == 3:
+            changes.append((fields[0][0], fields[1], fields[2]))
+        elif len(fields) == 2:
+            changes.append((fields[0][0], None, fields[1]))
+    return changes
+
+
+def make_cursor(token: str, line: int) -> str:
+    return f"{token}:{line}"
+
+
+def get_diff_page(cursor: str, max_lines: int = 500) -> dict:
+    """Return the next page of a truncated diff without running git again."""
+    token, _, line = cursor.rpartition(":")
+    spool = DIFF_PAGES.get(token)
+    if spool is None or not line.isdigit():
+        raise ValueError("Unknown or expired cursor. Call analyze_file_changes again to get a new one.")
+
+    start = int(line)
+    lines = spool.read_lines(start, max_lines)
+    end = start + len(lines)
+    DIFF_PAGES.pages_served += 1
+    return {
+        "diff": "\n".join(lines) + ("\n" if lines else ""),
+        "start_line": start,
+        "end_line": end,
+        "total_diff_lines": spool.total_lines,
+        "next_cursor": make_cursor(token, end) if end < spool.total_lines else None
+    }
+
+
+BACKENDS = {backend.name: backend for backend in (SubprocessBackend(), InProcessBackend())}
+
+# Backend used when analyze_changes is not given one explicitly
+DEFAULT_BACKEND = os.getenv("GIT_ANALYSIS_BACKEND", "subprocess")
+
+# Repositories analyzed at once by analyze_many
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "4"))
+
+
+async def analyze_changes(
+    cwd: str,
+    base_branch: str = "main",
+    include_diff: bool = True,
+    max_diff_lines: int = 500,
+    exact_total_lines: bool = True,
+    backend: Optional[str] = None,
+    use_cache: bool = True,
+    paginate: bool = True,
+    max_tokens: Optional[int] = None,
+    structured: bool = False,
+    max_commits: Optional[int] = None,
+    commit_format: str = "oneline",
+    diff_mode: str = "default",
+    python_summary: bool = False
+) -> dict:
+    """Collect changed files, statistics, diff and commits for base_branch...HEAD.
+
+    With the subprocess backend all git commands run concurrently, so the total
+    latency is roughly that of the slowest command rather than the sum of all of
+    them. The diff is streamed and never held in memory beyond max_diff_lines.
+    The in-process backend falls back to the subprocess one when it cannot read
+    the repository.
+
+    Results are cached in ANALYSIS_CACHE, keyed by the repository, the base,
+    merge-base and HEAD SHAs and the arguments, so repeated calls skip all git
+    work until one of the branches moves.
+
+    When paginate is set, the complete diff is spooled and the result carries a
+    diff_id for get_file_diffs and, if the diff was truncated, a next_cursor for
+    get_diff_page. Spooling needs the whole diff, so it is only done when
+    exact_total_lines is set.
+
+    With max_tokens the diff is spooled regardless, and instead of the first
+    max_diff_lines lines the result holds the most useful files and hunks that
+    fit the budget (see fit_diff_to_budget).
+
+    With structured set, the name-status and stat text is replaced by a files
+    list (path, status, additions, deletions, binary and, for renames, old_path)
+    and totals, taken from a single `git diff --raw --numstat` run.
+
+    At most max_commits commits are listed, newest first, with total_commits
+    giving the full count and commits_cursor the next page for get_commit_page.
+    commit_format "full" lists author, timestamp and files touched per commit,
+    from the same single git log run.
+
+    diff_mode picks the diff shape: "minimal" (no context lines), "function"
+    (whole enclosing functions) or "word" (word-level changes, for prose).
+    Anything but "default" is spooled in full and measured against a default
+    diff run concurrently, reported as diff_savings.
+
+    With python_summary, changed .py files are described in python_changes
+    (definitions added, removed or modified, signature and decorator changes,
+    see ast_summary) and their hunks are left out of the diff. Files that do not
+    parse keep their hunks. Raw hunks stay available through get_file_diffs.
+    """
+    if diff_mode not in DIFF_MODES:
+        raise ValueError(f"Unknown diff_mode: {diff_mode}. Choose from: {', '.join(DIFF_MODES)}")
+    if commit_format not in COMMIT_FORMATS:
+        raise ValueError(f"Unknown commit_format: {commit_format}. Choose from: {', '.join(COMMIT_FORMATS)}")
+    selected = BACKENDS.get(backend or DEFAULT_BACKEND)
+    if selected is None:
+        raise ValueError(f"Unknown git backend: {backend or DEFAULT_BACKEND}. Choose from: {', '.join(BACKENDS)}")
+
+    cache_key = None
+    if use_cache and ANALYSIS_CACHE.max_entries > 0:
+        try:
+            try:
+                state = await selected.resolve_state(cwd, base_branch)
+            except GitObjectError:
+                state = await BACKENDS["subprocess"].resolve_state(cwd, base_branch)
+            cache_key = (*state, selected.name, base_branch, include_diff, max_diff_lines,
+                         exact_total_lines, paginate, max_tokens, structured, max_commits, commit_format,
+                         diff_mode, python_summary)
+        except subprocess.CalledProcessError:
+            # Let the analysis itself report the git error
+            pass
+        if cache_key is not None:
+            cached = ANALYSIS_CACHE.get(cache_key)
+            diff_id = cached and cached.get("diff_id")
+            if diff_id and DIFF_PAGES.get(diff_id) is None:
+                # The spooled diff behind diff_id and next_cursor expired, so recompute
+                cached = None
+            if cached is not None:
+                cached["cache_hit"] = True
+                return cached
+
+    budgeted = include_diff and max_tokens is not None
+    measured = include_diff and diff_mode != "default"
+    # A token budget is filled from the spooled diff, so no lines are kept while streaming
+    args = (cwd, base_branch, include_diff, 0 if budgeted else max_diff_lines, exact_total_lines)
+    options = (structured, max_commits, commit_format == "full", diff_mode)
+    # Leaving summarized files out of the diff needs the spooled file index
+    spooled = budgeted or measured or (include_diff and (python_summary or (exact_total_lines and paginate)))
+    spool = SpooledDiff() if spooled else None
+    # The default diff is only counted, alongside the real work
+    baseline = asyncio.create_task(count_git_output(["diff", f"{base_branch}...HEAD"], cwd)) if measured else None
+    try:
+        try:
+            sections = await selected.collect(*args, spool, *options)
+        except GitObjectError:
+            if spool is not None:
+                spool.close()
+                spool = SpooledDiff()
+            selected = BACKENDS["subprocess"]
+            sections = await selected.collect(*args, spool, *options)
+        diff_savings = None
+        if baseline is not None:
+            default_bytes, default_lines = await baseline
+            diff_savings = {
+                "mode": diff_mode,
+                "bytes": spool.size_bytes,
+                "lines": sections["total_diff_lines"],
+                "default_bytes": default_bytes,
+                "default_lines": default_lines,
+                "saved_bytes": default_bytes - spool.size_bytes,
+                "saved_lines": default_lines - sections["total_diff_lines"],
+                "saved_percent": round(100 * (default_bytes - spool.size_bytes) / default_bytes, 1)
+                if default_bytes else 0.0
+            }
+    except BaseException:
+        if baseline is not None:
+            baseline.cancel()
+        if spool is not None:
+            spool.close()
+        raise
+
+    diff_lines = sections["diff_lines"]
+    total_diff_lines = sections["total_diff_lines"]
+    truncated = sections["truncated"]
+
+    python_changes = None
+    summarized = []
+    if python_summary:
+        if "files" in sections:
+            changes = [(f["status"], f.get("old_path"), f["path"]) for f in sections["files"]]
+        else:
+            changes = parse_name_status(sections["files_changed"])
+        merge_base, head = await asyncio.gather(
+            run_git(["merge-base", base_branch, "HEAD"], cwd, check=True),
+            run_git(["rev-parse", "HEAD"], cwd, check=True)
+        )
+        python_changes = await summarize_python_changes(cwd, merge_base.strip(), head.strip(), changes)
+        summarized = [summary["path"] for summary in python_changes if "error" not in summary]
+
+    diff_id = next_cursor = token_budget = None
+    if spool is not None:
+        spool.total_lines = total_diff_lines
+        diff_id = DIFF_PAGES.add(spool)
+        if summarized and include_diff and not budgeted:
+            # Cursors index the full diff, so the shortened one is read per file instead
+            diff_lines, total_shown = diff_lines_without(spool, summarized, max_diff_lines)
+            truncated = total_shown > len(diff_lines)
+        elif truncated and not budgeted:
+            next_cursor = make_cursor(diff_id, len(diff_lines))
+
+    diff_content = '\n'.join(diff_lines)
+    if budgeted:
+        diff_content, token_budget = fit_diff_to_budget(spool, max_tokens, summarized)
+        truncated = bool(token_budget["partial_files"] or token_budget["omitted_files"])
+    elif truncated:
+        if summarized:
+            shown_of = total_shown
+        else:
+            shown_of = total_diff_lines if total_diff_lines is not None else f"more than {max_diff_lines}"
+        diff_content += f"\n\n... Output truncated. Showing {max_diff_lines} of {shown_of} lines ..."
+        if next_cursor:
+            diff_content += "\n... Use get_diff_page with next_cursor to see more ..."
+        elif summarized:
+            diff_content += "\n... Use get_file_diffs with diff_id to see more ..."
+        else:
+            diff_content += "\n... Use max_diff_lines parameter to see more ..."
+    elif diff_lines:
+        diff_content += "\n"
+
+    analysis = {"base_branch": base_branch}
+    if structured:
+        analysis["files"] = sections["files"]
+        analysis["totals"] = {
+            "files": len(sections["files"]),
+            "additions": sum(f["additions"] for f in sections["files"]),
+            "deletions": sum(f["deletions"] for f in sections["files"])
+        }
+    else:
+        analysis["files_changed"] = sections["files_changed"]
+        analysis["statistics"] = sections["statistics"]
+    commits = sections["commits"]
+    commits_cursor = None
+    if sections["total_commits"] > len(commits):
+        # Pin both ends so later pages don't shift when a branch moves
+        base_sha = (await run_git(["rev-parse", "--verify", f"{base_branch}^{{commit}}"], cwd, check=True)).strip()
+        head_sha = commits[0]["sha"] if commits else (await run_git(["rev-parse", "HEAD"], cwd, check=True)).strip()
+        commits_cursor = make_commit_cursor(cwd, base_sha, head_sha, len(commits), commit_format)
+
+    analysis.update({
+        "commits": render_commits(commits, commit_format),
+        "total_commits": sections["total_commits"],
+        "commits_cursor": commits_cursor,
+        "diff": diff_content if include_diff else "Diff not included (set include_diff=true to see full diff)",
+        "truncated": truncated,
+        "total_diff_lines": total_diff_lines,
+        "diff_id": diff_id,
+        "next_cursor": next_cursor,
+        "backend": selected.name
+    })
+    if token_budget is not None:
+        analysis["token_budget"] = token_budget
+    if diff_savings is not None:
+        analysis["diff_savings"] = diff_savings
+    if python_changes is not None:
+        analysis["python_changes"] = python_changes
+    if cache_key is not None:
+        ANALYSIS_CACHE.put(cache_key, analysis)
+    analysis["cache_hit"] = False
+    return analysis
+
+
+async def analyze_many(
+    repositories: List[dict],
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    **analyze_kwargs
+) -> AsyncIterator[dict]:
+    """Analyze several repositories concurrently, yielding each result as it completes.
+
+    Each repository is a dict with a working_directory and an optional
+    base_branch (default: main). At most max_concurrency analyses run at once,
+    each limited to timeout seconds. A failing repository yields an entry with
+    an error instead of an analysis.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or DEFAULT_BATCH_CONCURRENCY))
+
+    async def analyze_one(repository: dict) -> dict:
+        entry = {
+            "working_directory": repository.get("working_directory"),
+            "base_branch": repository.get("base_branch", "main")
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if not entry["working_directory"]:
+                    raise ValueError("working_directory is required")
+                entry["analysis"] = await run_with_timeout(
+                    analyze_changes(entry["working_directory"], entry["base_branch"], **analyze_kwargs),
+                    timeout,
+                    f"Analysis of {entry['working_directory']}"
+                )
+            except subprocess.CalledProcessError as e:
+                entry["error"] = f"Git error: {e.stderr}"
+            except Exception as e:
+                entry["error"] = str(e)
+            entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return entry
+
+    tasks = [asyncio.create_task(analyze_one(repository)) for repository in repositories]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
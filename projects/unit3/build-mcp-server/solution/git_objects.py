@@ -0,0 +1,823 @@
+#!/usr/bin/env python3
+"""
+Pure-Python git object reader used by the in-process analyze_file_changes backend.
+Reads refs, loose objects and packfiles directly so that one analysis needs no git
+processes and pack indexes are parsed once per server instead of once per command.
+
+Only what analyze_file_changes needs is supported. Anything else (shallow clones,
+submodules, abbreviated revisions, ...) raises GitObjectError so the caller can
+fall back to the git command line. That includes the diffs git itself would not
+compute exactly: files changed in too many lines or too large to diff quickly,
+and renames of files whose content also changed.
+"""
+
+import heapq
+import mmap
+import re
+import struct
+import threading
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Pack object type numbers
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: "commit", OBJ_TREE: "tree", OBJ_BLOB: "blob", OBJ_TAG: "tag"}
+
+TREE_MODE = "40000"
+SUBMODULE_MODE = "160000"
+
+# Number of decoded objects kept in memory per repository
+OBJECT_CACHE_SIZE = 4096
+
+# Same heuristic as git: a NUL byte in the first 8000 bytes means binary
+BINARY_CHECK_BYTES = 8000
+
+HEX_SHA = re.compile(r"^[0-9a-f]{40}$")
+
+# Edit distance (changed lines) up to which a file is diffed in-process. Below git's
+# XDL_HEUR_MIN_COST, git's diff is a shortest edit script too, so line counts agree
+MAX_DIFF_COST = 200
+# Blobs larger than this are left to git
+MAX_DIFF_BYTES = 256 * 1024
+
+
+# What parsing a corrupt or unexpected object raises; callers report these as GitObjectError
+OBJECT_FORMAT_ERRORS = (zlib.error, ValueError, struct.error, IndexError, UnicodeDecodeError)
+
+
+class GitObjectError(Exception):
+    """Raised when a repository cannot be read in-process."""
+
+
+class Commit(NamedTuple):
+    sha: str
+    tree: str
+    parents: List[str]
+    author: str
+    author_time: int
+    commit_time: int
+    message: str
+
+    @property
+    def subject(self) -> str:
+        return self.message.split("\n", 1)[0]
+
+
+class TreeEntry(NamedTuple):
+    mode: str
+    name: str
+    sha: str
+
+
+class FileChange(NamedTuple):
+    status: str  # A, D, M or R
+    old_path: Optional[str]
+    new_path: Optional[str]
+    old_mode: Optional[str]
+    new_mode: Optional[str]
+    old_sha: Optional[str]
+    new_sha: Optional[str]
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path
+
+
+class Pack:
+    """A packfile and its version 2 index, memory-mapped once."""
+
+    def __init__(self, idx_path: Path):
+        with open(idx_path, "rb") as f:
+            idx = f.read()
+        if idx[:4] != b"\377tOc" or int.from_bytes(idx[4:8], "big") != 2:
+            raise GitObjectError(f"Unsupported pack index: {idx_path.name}")
+
+        self.fanout = [int.from_bytes(idx[8 + i * 4:12 + i * 4], "big") for i in range(256)]
+        count = self.fanout[255]
+        shas_start = 8 + 256 * 4
+        offsets_start = shas_start + count * 20 + count * 4
+        large_start = offsets_start + count * 4
+        self.shas = [idx[shas_start + i * 20:shas_start + (i + 1) * 20] for i in range(count)]
+        self.offsets = []
+        for i in range(count):
+            offset = int.from_bytes(idx[offsets_start + i * 4:offsets_start + (i + 1) * 4], "big")
+            if offset & 0x80000000:
+                large = (offset & 0x7FFFFFFF) * 8
+                offset = int.from_bytes(idx[large_start + large:large_start + large + 8], "big")
+            self.offsets.append(offset)
+
+        with open(idx_path.with_suffix(".pack"), "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def offset_of(self, sha: bytes) -> Optional[int]:
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+        i = bisect_left(self.shas, sha, lo, hi)
+        if i < hi and self.shas[i] == sha:
+            return self.offsets[i]
+        return None
+
+    def read_header(self, offset: int) -> Tuple[int, int]:
+        """Return (type number, offset of the data after the size header)."""
+        byte = self.data[offset]
+        obj_type = (byte >> 4) & 7
+        offset += 1
+        while byte & 0x80:
+            byte = self.data[offset]
+            offset += 1
+        return obj_type, offset
+
+    def inflate(self, offset: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        chunks = []
+        while not decompressor.eof:
+            chunk = self.data[offset:offset + 65536]
+            if not chunk:
+                raise GitObjectError("Truncated packfile")
+            chunks.append(decompressor.decompress(chunk))
+            offset += len(chunk)
+        return b"".join(chunks)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Apply a git pack delta to its base object."""
+    pos = 0
+
+    def varint() -> int:
+        nonlocal pos
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    varint()  # base size
+    result_size = varint()
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            copy_offset = copy_size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    copy_offset |= delta[pos] << (i * 8)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    copy_size |= delta[pos] << (i * 8)
+                    pos += 1
+            out += base[copy_offset:copy_offset + (copy_size or 0x10000)]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitObjectError("Invalid delta opcode")
+    if len(out) != result_size:
+        raise GitObjectError("Delta produced an object of the wrong size")
+    return bytes(out)
+
+
+def find_git_dir(path: str) -> Path:
+    """Find the .git directory for a working directory, following gitdir files."""
+    current = Path(path).resolve()
+    for candidate in [current, *current.parents]:
+        dot_git = candidate / ".git"
+        if dot_git.is_dir():
+            return dot_git
+        if dot_git.is_file():
+            content = dot_git.read_text().strip()
+            if content.startswith("gitdir:"):
+                return (candidate / content[len("gitdir:"):].strip()).resolve()
+    raise GitObjectError(f"Not a git repository: {path}")
+
+
+class Repository:
+    """Read-only view of a git repository's refs and objects.
+
+    Shared by concurrent analyses in worker threads: the object cache and the
+    list of packs are only touched while holding the repository's lock.
+    """
+
+    def __init__(self, path: str):
+        self.git_dir = find_git_dir(path)
+        commondir = self.git_dir / "commondir"
+        self.common_dir = (
+            (self.git_dir / commondir.read_text().strip()).resolve()
+            if commondir.exists() else self.git_dir
+        )
+        if (self.common_dir / "shallow").exists():
+            raise GitObjectError("Shallow repositories are not supported")
+
+        self.object_dirs = [self.common_dir / "objects"]
+        alternates = self.common_dir / "objects" / "info" / "alternates"
+        if alternates.exists():
+            for line in alternates.read_text().splitlines():
+                if line.strip() and not line.startswith("#"):
+                    self.object_dirs.append((self.common_dir / "objects" / line.strip()).resolve())
+
+        self._packs: Dict[Path, Pack] = {}
+        self._cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        # Reentrant: resolving a REF_DELTA reads its base object
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def refresh(self):
+        """Pick up packfiles written since the repository was opened."""
+        with self._lock:
+            for objects in self.object_dirs:
+                for idx_path in sorted((objects / "pack").glob("*.idx")):
+                    if idx_path not in self._packs and idx_path.with_suffix(".pack").exists():
+                        self._packs[idx_path] = Pack(idx_path)
+
+    # ----- refs -----
+
+    def _read_ref(self, name: str) -> Optional[str]:
+        for base in (self.git_dir, self.common_dir):
+            ref_file = base / name
+            if ref_file.is_file():
+                value = ref_file.read_text().strip()
+                if value.startswith("ref:"):
+                    return self._read_ref(value[4:].strip())
+                return value
+        packed = self.common_dir / "packed-refs"
+        if packed.exists():
+            for line in packed.read_text().splitlines():
+                if line and line[0] not in "#^":
+                    sha, _, ref = line.partition(" ")
+                    if ref == name:
+                        return sha
+        return None
+
+    def resolve(self, rev: str) -> str:
+        """Resolve HEAD, a full SHA or a ref name to a commit SHA."""
+        if HEX_SHA.match(rev):
+            sha = rev
+        else:
+            candidates = [rev, f"refs/{rev}", f"refs/tags/{rev}", f"refs/heads/{rev}",
+                          f"refs/remotes/{rev}", f"refs/remotes/{rev}/HEAD"]
+            sha = next((s for s in map(self._read_ref, candidates) if s), None)
+            if sha is None:
+                raise GitObjectError(f"Cannot resolve revision: {rev}")
+
+        # Peel annotated tags
+        obj_type, data = self.read_object(sha)
+        while obj_type == "tag":
+            sha = data.split(b"\n", 1)[0].split(b" ")[1].decode()
+            obj_type, data = self.read_object(sha)
+        if obj_type != "commit":
+            raise GitObjectError(f"{rev} is not a commit")
+        return sha
+
+    # ----- objects -----
+
+    def read_object(self, sha: str) -> Tuple[str, bytes]:
+        """Return (type name, content) for an object."""
+        with self._lock:
+            cached = self._cache.get(sha)
+            if cached is not None:
+                self._cache.move_to_end(sha)
+                return cached
+
+            obj = self._read_loose(sha) or self._read_packed(bytes.fromhex(sha))
+            if obj is None:
+                self.refresh()
+                obj = self._read_packed(bytes.fromhex(sha))
+            if obj is None:
+                raise GitObjectError(f"Object not found: {sha}")
+
+            self._cache[sha] = obj
+            if len(self._cache) > OBJECT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return obj
+
+    def _read_loose(self, sha: str) -> Optional[Tuple[str, bytes]]:
+        for objects in self.object_dirs:
+            path = objects / sha[:2] / sha[2:]
+            if path.exists():
+                raw = zlib.decompress(path.read_bytes())
+                header, _, content = raw.partition(b"\0")
+                return header.split(b" ")[0].decode(), content
+        return None
+
+    def _read_packed(self, sha: bytes) -> Optional[Tuple[str, bytes]]:
+        for pack in self._packs.values():
+            offset = pack.offset_of(sha)
+            if offset is not None:
+                obj_type, data = self._read_pack_entry(pack, offset)
+                return TYPE_NAMES[obj_type], data
+        return None
+
+    def _read_pack_entry(self, pack: Pack, offset: int) -> Tuple[int, bytes]:
+        # Walk down the delta chain, then apply the deltas from the base up
+        deltas = []
+        while True:
+            obj_type, data_offset = pack.read_header(offset)
+            if obj_type == OBJ_OFS_DELTA:
+                byte = pack.data[data_offset]
+                data_offset += 1
+                distance = byte & 0x7F
+                while byte & 0x80:
+                    byte = pack.data[data_offset]
+                    data_offset += 1
+                    distance = ((distance + 1) << 7) | (byte & 0x7F)
+                deltas.append(pack.inflate(data_offset))
+                offset -= distance
+            elif obj_type == OBJ_REF_DELTA:
+                base_sha = pack.data[data_offset:data_offset + 20].hex()
+                deltas.append(pack.inflate(data_offset + 20))
+                base_type, base = self.read_object(base_sha)
+                obj_type = next(n for n, name in TYPE_NAMES.items() if name == base_type)
+                break
+            elif obj_type in TYPE_NAMES:
+                base = pack.inflate(data_offset)
+                break
+            else:
+                raise GitObjectError(f"Unknown pack object type {obj_type}")
+
+        for delta in reversed(deltas):
+            base = apply_delta(base, delta)
+        return obj_type, base
+
+    def commit(self, sha: str) -> Commit:
+        obj_type, data = self.read_object(sha)
+        if obj_type != "commit":
+            raise GitObjectError(f"{sha} is not a commit")
+        headers, _, message = data.decode(errors="replace").partition("\n\n")
+        tree, parents, author, author_time, commit_time = "", [], "", 0, 0
+        for line in headers.split("\n"):
+            key, _, value = line.partition(" ")
+            if key == "tree":
+                tree = value
+            elif key == "parent":
+                parents.append(value)
+            elif key == "author":
+                name, _, stamp = value.rpartition("> ")
+                author = name + ">"
+                author_time = int(stamp.split(" ")[0])
+            elif key == "committer":
+                commit_time = int(value.rpartition("> ")[2].split(" ")[0])
+        return Commit(sha, tree, parents, author, author_time, commit_time, message.rstrip("\n"))
+
+    def tree(self, sha: str) -> List[TreeEntry]:
+        obj_type, data = self.read_object(sha)
+        if obj_type != "tree":
+            raise GitObjectError(f"{sha} is not a tree")
+        entries = []
+        pos = 0
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            nul = data.index(b"\0", space)
+            entries.append(TreeEntry(
+                data[pos:space].decode(),
+                data[space + 1:nul].decode(errors="surrogateescape"),
+                data[nul + 1:nul + 21].hex()
+            ))
+            pos = nul + 21
+        return entries
+
+    def blob(self, sha: str) -> bytes:
+        obj_type, data = self.read_object(sha)
+        if obj_type != "blob":
+            raise GitObjectError(f"{sha} is not a blob")
+        return data
+
+    # ----- history -----
+
+    def _push(self, heap: list, sha: str, *extra):
+        heapq.heappush(heap, (-self.commit(sha).commit_time, sha, *extra))
+
+    def merge_base(self, a: str, b: str) -> Optional[str]:
+        """Best common ancestor of two commits, painting down history like git merge-base."""
+        if a == b:
+            return a
+        PARENT1, PARENT2, STALE = 1, 2, 4
+        flags = {a: PARENT1, b: PARENT2}
+        heap = []
+        self._push(heap, a)
+        self._push(heap, b)
+        results = []
+        while any(not flags[sha] & STALE for _, sha in heap):
+            _, sha = heapq.heappop(heap)
+            current = flags[sha] & (PARENT1 | PARENT2 | STALE)
+            if current == PARENT1 | PARENT2:
+                if sha not in results:
+                    results.append(sha)
+                current |= STALE
+            for parent in self.commit(sha).parents:
+                if flags.get(parent, 0) & current == current:
+                    continue
+                flags[parent] = flags.get(parent, 0) | current
+                self._push(heap, parent)
+        # Results reached from another result are not the best common ancestor
+        best = [sha for sha in results if not flags[sha] & STALE]
+        return best[0] if best else (results[0] if results else None)
+
+    def commits_between(self, base: str, head: str) -> List[Commit]:
+        """Commits reachable from head but not from base, newest first (git log base..head)."""
+        if base == head:
+            return []
+        uninteresting = {base: True, head: False}
+        heap = []
+        self._push(heap, head, False)
+        self._push(heap, base, True)
+        interesting_in_heap = 1
+        visited = {}
+        oldest_visited = None
+        # Keep walking the base side while it could still reach a visited commit
+        while heap and (interesting_in_heap or (oldest_visited is not None and -heap[0][0] >= oldest_visited)):
+            _, sha, pushed_uninteresting = heapq.heappop(heap)
+            if not pushed_uninteresting:
+                interesting_in_heap -= 1
+            commit = self.commit(sha)
+            hidden = uninteresting[sha]
+            if not hidden:
+                visited[sha] = commit
+                if oldest_visited is None or commit.commit_time < oldest_visited:
+                    oldest_visited = commit.commit_time
+            for parent in commit.parents:
+                if parent in uninteresting and (uninteresting[parent] or not hidden):
+                    continue
+                uninteresting[parent] = hidden
+                self._push(heap, parent, hidden)
+                if not hidden:
+                    interesting_in_heap += 1
+        return sorted(
+            (c for sha, c in visited.items() if not uninteresting[sha]),
+            key=lambda c: c.commit_time,
+            reverse=True
+        )
+
+    # ----- diffs -----
+
+    def diff_trees(self, old_tree: Optional[str], new_tree: Optional[str], prefix: str = "") -> List[FileChange]:
+        """Changed files between two trees, with exact renames detected.
+
+        Raises GitObjectError when deletions and additions are left over, as git
+        may pair them as renames by content similarity.
+        """
+        changes = self._diff_trees(old_tree, new_tree, prefix)
+
+        # Pair deletions and additions of identical content as renames
+        added = {}
+        for change in changes:
+            if change.status == "A":
+                added.setdefault(change.new_sha, []).append(change)
+        renamed = []
+        for change in changes:
+            if change.status == "D" and added.get(change.old_sha):
+                target = added[change.old_sha].pop(0)
+                renamed.append((change, target))
+        for old, new in renamed:
+            changes.remove(old)
+            changes.remove(new)
+            changes.append(FileChange("R", old.old_path, new.new_path, old.old_mode,
+                                      new.new_mode, old.old_sha, new.new_sha))
+        statuses = {change.status for change in changes}
+        if "A" in statuses and "D" in statuses:
+            raise GitObjectError("Possible renames with changed content need the git command line")
+        return sorted(changes, key=lambda c: c.path)
+
+    def _diff_trees(self, old_tree: Optional[str], new_tree: Optional[str], prefix: str) -> List[FileChange]:
+        old = {e.name: e for e in self.tree(old_tree)} if old_tree else {}
+        new = {e.name: e for e in self.tree(new_tree)} if new_tree else {}
+        changes = []
+        for name in sorted(set(old) | set(new)):
+            a, b = old.get(name), new.get(name)
+            path = prefix + name
+            if SUBMODULE_MODE in (a and a.mode, b and b.mode):
+                raise GitObjectError("Submodules are not supported")
+            if a and b and a.sha == b.sha and a.mode == b.mode:
+                continue
+            a_tree = a is not None and a.mode == TREE_MODE
+            b_tree = b is not None and b.mode == TREE_MODE
+            if a_tree or b_tree:
+                changes.extend(self._diff_trees(a.sha if a_tree else None, b.sha if b_tree else None, path + "/"))
+            if a and not a_tree and b and not b_tree:
+                changes.append(FileChange("M", path, path, a.mode, b.mode, a.sha, b.sha))
+                continue
+            if a and not a_tree:
+                changes.append(FileChange("D", path, None, a.mode, None, a.sha, None))
+            if b and not b_tree:
+                changes.append(FileChange("A", None, path, None, b.mode, None, b.sha))
+        return changes
+
+
+class FileDiff:
+    """Line-level diff of one changed file, computed once and shared by all outputs."""
+
+    def __init__(self, repo: Repository, change: FileChange, context_lines: int = 3):
+        self.change = change
+        old = repo.blob(change.old_sha) if change.old_sha else b""
+        new = repo.blob(change.new_sha) if change.new_sha else b""
+        self.old_size = len(old)
+        self.new_size = len(new)
+        self.binary = b"\0" in old[:BINARY_CHECK_BYTES] or b"\0" in new[:BINARY_CHECK_BYTES]
+        self.additions = self.deletions = 0
+        self.hunks = []
+
+        if self.binary or change.old_sha == change.new_sha:
+            return
+        if max(self.old_size, self.new_size) > MAX_DIFF_BYTES:
+            raise GitObjectError(f"{change.path} is too large to diff in-process")
+        self.old_lines = _split_lines(old)
+        self.new_lines = _split_lines(new)
+        opcodes = diff_opcodes(self.old_lines, self.new_lines, MAX_DIFF_COST)
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag != "equal":
+                self.deletions += i2 - i1
+                self.additions += j2 - j1
+        self.hunks = _group_opcodes(opcodes, context_lines)
+
+    def header_lines(self) -> List[str]:
+        change = self.change
+        old_path = change.old_path or change.new_path
+        new_path = change.new_path or change.old_path
+        lines = [f"diff --git a/{old_path} b/{new_path}"]
+        if change.status == "A":
+            lines.append(f"new file mode {change.new_mode}")
+        elif change.status == "D":
+            lines.append(f"deleted file mode {change.old_mode}")
+        elif change.old_mode != change.new_mode:
+            lines += [f"old mode {change.old_mode}", f"new mode {change.new_mode}"]
+        if change.status == "R":
+            lines += ["similarity index 100%", f"rename from {old_path}", f"rename to {new_path}"]
+            return lines
+
+        index = f"index {(change.old_sha or '0' * 40)[:7]}..{(change.new_sha or '0' * 40)[:7]}"
+        if change.status == "M" and change.old_mode == change.new_mode:
+            index += f" {change.new_mode}"
+        lines.append(index)
+        if self.binary:
+            lines.append(f"Binary files {'a/' + old_path if change.old_sha else '/dev/null'} and "
+                         f"{'b/' + new_path if change.new_sha else '/dev/null'} differ")
+        elif self.hunks:
+            lines.append(f"--- a/{old_path}" if change.old_sha else "--- /dev/null")
+            lines.append(f"+++ b/{new_path}" if change.new_sha else "+++ /dev/null")
+        return lines
+
+    def _function_context(self, old_start: int) -> str:
+        # git's default funcname rule: the closest earlier line starting with a letter, _ or $
+        for line in reversed(self.old_lines[:old_start]):
+            if line[:1].isalpha() or line[:1] in "_$":
+                return line.rstrip()[:80].rstrip()
+        return ""
+
+    def patch_lines(self) -> Iterator[str]:
+        """Yield the file's patch in git's unified diff format, one line at a time."""
+        yield from self.header_lines()
+        for group in self.hunks:
+            first, last = group[0], group[-1]
+            header = f"@@ -{_hunk_range(first[1], last[2])} +{_hunk_range(first[3], last[4])} @@"
+            function = self._function_context(first[1])
+            yield f"{header} {function}" if function else header
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    yield from _prefixed(" ", self.old_lines[i1:i2])
+                    continue
+                if tag in ("replace", "delete"):
+                    yield from _prefixed("-", self.old_lines[i1:i2])
+                if tag in ("replace", "insert"):
+                    yield from _prefixed("+", self.new_lines[j1:j2])
+
+
+def _shortest_edit(a: List[int], b: List[int], max_cost: int) -> List[Tuple[int, int, int]]:
+    """Matching blocks (i, j, size) of a shortest edit script, by Myers' O(ND) algorithm."""
+    n, m = len(a), len(b)
+    offset = max_cost + 1
+    # furthest[k + offset]: furthest x reached on diagonal k = x - y
+    furthest = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(max_cost + 1):
+        trace.append(furthest[:])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and furthest[k - 1 + offset] < furthest[k + 1 + offset]):
+                x = furthest[k + 1 + offset]
+            else:
+                x = furthest[k - 1 + offset] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            furthest[k + offset] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+        break
+    else:
+        raise GitObjectError(f"More than {max_cost} changed lines")
+
+    # Walk back from the end, collecting the snake that follows each edit
+    blocks = []
+    x, y = n, m
+    for d in range(d, 0, -1):
+        previous = trace[d]
+        k = x - y
+        if k == -d or (k != d and previous[k - 1 + offset] < previous[k + 1 + offset]):
+            previous_k = k + 1
+            start = previous[previous_k + offset]
+        else:
+            previous_k = k - 1
+            start = previous[previous_k + offset] + 1
+        if x > start:
+            blocks.append((start, start - k, x - start))
+        x = previous[previous_k + offset]
+        y = x - previous_k
+    if x > 0:
+        blocks.append((0, 0, x))
+    blocks.reverse()
+    return blocks
+
+
+def diff_opcodes(a: List[str], b: List[str], max_cost: int = MAX_DIFF_COST) -> List[Tuple[str, int, int, int, int]]:
+    """Opcodes like difflib's get_opcodes(), but of a shortest edit script as git computes it.
+
+    Common leading and trailing lines are trimmed first; what is left on one side
+    only is a plain insertion or deletion. Raises GitObjectError when more than
+    max_cost lines differ.
+    """
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+
+    blocks = [(0, 0, prefix)] if prefix else []
+    middle_a, middle_b = a[prefix:n - suffix], b[prefix:m - suffix]
+    if middle_a and middle_b:
+        ids = {}
+        middle = _shortest_edit(
+            [ids.setdefault(line, len(ids)) for line in middle_a],
+            [ids.setdefault(line, len(ids)) for line in middle_b],
+            max_cost
+        )
+        blocks += [(i + prefix, j + prefix, size) for i, j, size in middle]
+    if suffix:
+        blocks.append((n - suffix, m - suffix, suffix))
+
+    opcodes = []
+    i = j = 0
+    for block_i, block_j, size in blocks + [(n, m, 0)]:
+        if i < block_i and j < block_j:
+            opcodes.append(("replace", i, block_i, j, block_j))
+        elif i < block_i:
+            opcodes.append(("delete", i, block_i, j, block_j))
+        elif j < block_j:
+            opcodes.append(("insert", i, block_i, j, block_j))
+        i, j = block_i + size, block_j + size
+        if size:
+            opcodes.append(("equal", block_i, i, block_j, j))
+    return opcodes
+
+
+def _group_opcodes(opcodes: list, context_lines: int) -> list:
+    """Split opcodes into hunks with context_lines of context, as difflib's get_grouped_opcodes()."""
+    if not opcodes:
+        return []
+    opcodes = list(opcodes)
+    n = context_lines
+    tag, i1, i2, j1, j2 = opcodes[0]
+    if tag == "equal":
+        opcodes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    tag, i1, i2, j1, j2 = opcodes[-1]
+    if tag == "equal":
+        opcodes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    groups, group = [], []
+    for tag, i1, i2, j1, j2 in opcodes:
+        # A long run of equal lines ends one hunk and starts the next
+        if tag == "equal" and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+    return groups
+
+
+def _hunk_range(start: int, stop: int) -> str:
+    # Same conventions as git: 1-based start, ",count" omitted for one line
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def _split_lines(content: bytes) -> List[str]:
+    # Split on "\n" only, as git does, keeping line endings
+    lines = content.decode(errors="replace").split("\n")
+    last = lines.pop()
+    return [line + "\n" for line in lines] + ([last] if last else [])
+
+
+def _prefixed(prefix: str, lines: List[str]) -> Iterator[str]:
+    for line in lines:
+        if line.endswith("\n"):
+            yield prefix + line[:-1]
+        else:
+            yield prefix + line
+            yield "\\ No newline at end of file"
+
+
+def _scale(value: int, width: int, largest: int) -> int:
+    return 1 + (value * (width - 1) // largest) if value else 0
+
+
+def format_stat(diffs: List[FileDiff], width: int = 80) -> str:
+    """Render file diffs like git diff --stat, using git's column layout."""
+    if not diffs:
+        return ""
+    names = [d.change.path if d.change.status != "R"
+             else f"{d.change.old_path} => {d.change.new_path}" for d in diffs]
+    largest = max((d.additions + d.deletions for d in diffs if not d.binary), default=0)
+    number_width = len(str(largest))
+    if any(d.binary for d in diffs):
+        number_width = max(number_width, 3)
+
+    # Give the graph at most 3/8 of the line and the name whatever is left
+    name_width = max(len(n) for n in names)
+    graph_width = largest
+    if name_width + number_width + 6 + graph_width > width:
+        if graph_width > width * 3 // 8 - number_width - 6:
+            graph_width = max(width * 3 // 8 - number_width - 6, 6)
+        if name_width > width - number_width - 6 - graph_width:
+            name_width = width - number_width - 6 - graph_width
+        else:
+            graph_width = width - number_width - 6 - name_width
+
+    lines = []
+    for diff, name in zip(diffs, names):
+        if len(name) > name_width:
+            name = name[len(name) - (name_width - 3):]
+            slash = name.find("/")
+            name = "..." + (name[slash:] if slash >= 0 else name)
+        if diff.binary:
+            lines.append(f" {name.ljust(name_width)} | {'Bin'.rjust(number_width)} "
+                         f"{diff.old_size} -> {diff.new_size} bytes")
+            continue
+        adds, dels = diff.additions, diff.deletions
+        if graph_width <= largest:
+            total = _scale(adds + dels, graph_width, largest)
+            if total < 2 and adds and dels:
+                total = 2
+            if adds < dels:
+                adds = _scale(adds, graph_width, largest)
+                dels = total - adds
+            else:
+                dels = _scale(dels, graph_width, largest)
+                adds = total - dels
+        count = str(diff.additions + diff.deletions).rjust(number_width)
+        lines.append(f" {name.ljust(name_width)} | {count} {'+' * adds}{'-' * dels}".rstrip())
+
+    insertions = sum(d.additions for d in diffs)
+    deletions = sum(d.deletions for d in diffs)
+    summary = f" {len(diffs)} file{'s' if len(diffs) != 1 else ''} changed"
+    if insertions or not deletions:
+        summary += f", {insertions} insertion{'s' if insertions != 1 else ''}(+)"
+    if deletions or not insertions:
+        summary += f", {deletions} deletion{'s' if deletions != 1 else ''}(-)"
+    lines.append(summary)
+    return "\n".join(lines) + "\n"
+
+
+def format_name_status(changes: List[FileChange]) -> str:
+    """Render changes like git diff --name-status."""
+    lines = []
+    for change in changes:
+        if change.status == "R":
+            lines.append(f"R100\t{change.old_path}\t{change.new_path}")
+        else:
+            lines.append(f"{change.status}\t{change.path}")
+    return "".join(line + "\n" for line in lines)
+
+
+_repositories: Dict[Path, Repository] = {}
+_repositories_lock = threading.Lock()
+
+
+def open_repository(path: str) -> Repository:
+    """Open a repository, reusing parsed pack indexes from earlier calls."""
+    git_dir = find_git_dir(path)
+    with _repositories_lock:
+        repo = _repositories.get(git_dir)
+        if repo is None:
+            repo = _repositories[git_dir] = Repository(path)
+        return repo
@@ -8,7 +8,7 @@ import json
 import pytest
 import asyncio
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 # Import your implemented functions
 try:
@@ -24,6 +24,43 @@ except ImportError as e:
     IMPORT_ERROR = str(e)
 
 
+class FakeProcess:
+    """Stand-in for asyncio.subprocess.Process that replays canned git output."""
+    
+    def __init__(self, stdout="", stderr="", returncode=0):
+        self._stdout = stdout.encode()
+        self._stderr = stderr.encode()
+        self.returncode = returncode
+        self.stdout = asyncio.StreamReader()
+        self.stdout.feed_data(self._stdout)
+        self.stdout.feed_eof()
+    
+    async def communicate(self):
+        return self._stdout, self._stderr
+    
+    async def wait(self):
+        return self.returncode
+    
+    def kill(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_analysis_cache(monkeypatch):
+    """Disable the analysis cache and precomputation so every test sees its own mocked git output."""
+    import git_analysis
+    import ref_watcher
+    monkeypatch.setattr(git_analysis.ANALYSIS_CACHE, "max_entries", 0)
+    monkeypatch.setattr(ref_watcher.BACKGROUND_ANALYSIS, "enabled", False)
+
+
+def mock_git(*outputs):
+    """Patch asyncio.create_subprocess_exec so each git call returns the next output."""
+    if len(outputs) == 1:
+        return patch('asyncio.create_subprocess_exec', side_effect=lambda *a, **kw: FakeProcess(outputs[0]))
+    return patch('asyncio.create_subprocess_exec', side_effect=[FakeProcess(o) for o in outputs])
+
+
 class TestImplementation:
     """Test that the required functions are implemented."""
     
@@ -43,9 +80,7 @@ class TestAnalyzeFileChanges:
     @pytest.mark.asyncio
     async def test_returns_json_string(self):
         """Test that analyze_file_changes returns a JSON string."""
-        with patch('subprocess.run') as mock_run:
-            mock_run.return_value = MagicMock(stdout="", stderr="")
-            
+        with mock_git(""):
             result = await analyze_file_changes()
             
             assert isinstance(result, str), "Should return a string"
@@ -56,9 +91,7 @@ class TestAnalyzeFileChanges:
     @pytest.mark.asyncio
     async def test_includes_required_fields(self):
         """Test that the result includes expected fields."""
-        with patch('subprocess.run') as mock_run:
-            mock_run.return_value = MagicMock(stdout="M\tfile1.py\n", stderr="")
-            
+        with mock_git("M\tfile1.py\n"):
             result = await analyze_file_changes()
             data = json.loads(result)
             
@@ -72,21 +105,28 @@ class TestAnalyzeFileChanges:
                 # Starter code - just verify it returns something structured
                 assert isinstance(data, dict), "Should return a JSON object even if not implemented"
     
+    @pytest.mark.asyncio
+    async def test_compact_output(self):
+        """Test that compact results carry no indentation."""
+        with mock_git("M\tfile1.py\n"):
+            result = await analyze_file_changes(compact=True)
+
+        assert "\n  " not in result
+        assert json.loads(result)["files_changed"] == "M\tfile1.py\n"
+    
     @pytest.mark.asyncio
     async def test_output_limiting(self):
         """Test that large diffs are properly truncated."""
-        with patch('subprocess.run') as mock_run:
-            # Create a mock diff with many lines
-            large_diff = "\n".join([f"+ line {i}" for i in range(1000)])
-            
-            # Set up mock responses
-            mock_run.side_effect = [
-                MagicMock(stdout="M\tfile1.py\n", stderr=""),  # files changed
-                MagicMock(stdout="1 file changed, 1000 insertions(+)", stderr=""),  # stats
-                MagicMock(stdout=large_diff, stderr=""),  # diff
-                MagicMock(stdout="abc123 Initial commit", stderr="")  # commits
-            ]
-            
+        # Create a mock diff with many lines
+        large_diff = "\n".join([f"+ line {i}" for i in range(1000)])
+        
+        # Set up mock responses
+        with mock_git(
+            "M\tfile1.py\n",  # files changed
+            "1 file changed, 1000 insertions(+)",  # stats
+            large_diff,  # diff
+            "abc123 Initial commit"  # commits
+        ):
             # Test with default limit (500 lines)
             result = await analyze_file_changes(include_diff=True)
             data = json.loads(result)
@@ -107,6 +147,127 @@ class TestAnalyzeFileChanges:
                         "Should indicate diff was truncated"
 
 
+    @pytest.mark.asyncio
+    async def test_truncated_diff_can_be_paged(self):
+        """Test that a truncated diff returns a cursor for get_diff_page."""
+        from server import get_diff_page
+        
+        large_diff = "".join(f"+ line {i}\n" for i in range(1000))
+        with mock_git("M\tfile1.py\n", "", large_diff, ""):
+            data = json.loads(await analyze_file_changes(max_diff_lines=100))
+        
+        assert data["next_cursor"]
+        page = json.loads(await get_diff_page(data["next_cursor"], max_lines=10))
+        assert page["diff"].splitlines()[0] == "+ line 100"
+        assert page["end_line"] == 110
+
+
+class TestChangeClassifier:
+    """Test the local change-type classifier."""
+    
+    def test_commit_prefixes_decide(self):
+        """Test that conventional commit prefixes dominate the ranking."""
+        from change_classifier import classify_change
+        
+        ranked = classify_change(["server.py"], ["fix: handle empty diffs", "fix(cache): stale entries"])
+        assert ranked[0][0] == "bug"
+        assert abs(sum(confidence for _, confidence in ranked) - 1) < 0.05
+    
+    def test_paths_and_diff_features(self):
+        """Test that docs-only changes and new MCP tools are recognized without commit prefixes."""
+        from change_classifier import classify_change
+        
+        assert classify_change(["docs/guide.md", "README.md"], ["Update pages"])[0][0] == "docs"
+        diff = "+@mcp.tool()\n+async def get_metrics():\n+    return {}\n"
+        assert classify_change(["server.py"], ["Metrics endpoint"], diff)[0][0] == "feature"
+        assert classify_change([], []) == []
+
+    def test_resolves_change_type_variants(self):
+        """Test that common change_type spellings reach their template instead of the default."""
+        from change_classifier import ChangeTypeResolver
+        from server import TYPE_MAPPING
+
+        templates = [("bug.md", "Bug Fix"), ("docs.md", "Documentation"), ("chore.md", "Chore")]
+        resolver = ChangeTypeResolver.build(TYPE_MAPPING, templates, default="feature.md")
+
+        assert resolver.resolve("bugfix") == ("bug.md", 1.0, "exact")
+        assert resolver.resolve("perf").template == "performance.md"
+        assert resolver.resolve("tests").template == "test.md"
+        assert resolver.resolve("Docs update").template == "docs.md"
+        assert resolver.resolve("optimizing").match == "stem"
+        assert resolver.resolve("docum") == ("docs.md", 0.75, "prefix")
+        assert resolver.resolve("chores").template == "chore.md"
+        typo = resolver.resolve("perfomance")
+        assert typo.template == "performance.md" and 0 < typo.confidence < 1
+        assert resolver.resolve("xyz") == ("feature.md", 0.0, "default")
+
+    @pytest.mark.asyncio
+    async def test_analysis_suggests_templates(self):
+        """Test that analyze_file_changes returns ranked templates."""
+        log = "\x1e" + "\x1f".join(["a" * 40, "aaaaaaa", "Dev <dev@example.com>", "0", "perf: stream the diff"]) + "\n"
+        with mock_git("M\tgit_analysis.py\n", "", "+from functools import lru_cache\n", log):
+            data = json.loads(await analyze_file_changes())
+        
+        best = data["suggested_templates"][0]
+        assert best["change_type"] == "performance"
+        assert best["template"] == "performance.md"
+
+
+@pytest.mark.skipif(not IMPORTS_SUCCESSFUL, reason="Imports failed")
+class TestSessionRoots:
+    """Test that client roots are fetched once per session."""
+    
+    @pytest.fixture
+    def session(self):
+        session = MagicMock()
+        session.list_roots = AsyncMock(return_value=MagicMock(
+            roots=[MagicMock(uri=MagicMock(path="/tmp"))]
+        ))
+        context = MagicMock(session=session)
+        with patch.object(mcp, "get_context", return_value=context):
+            yield session
+    
+    @pytest.mark.asyncio
+    async def test_roots_fetched_once(self, session):
+        """Test that repeated calls reuse the cached roots."""
+        with mock_git(""):
+            await analyze_file_changes()
+            result = await analyze_file_changes()
+        
+        assert session.list_roots.await_count == 1
+        data = json.loads(result)
+        if "_debug" in data:
+            assert data["_debug"]["actual_cwd"] == "/tmp"
+    
+    @pytest.mark.asyncio
+    async def test_roots_refetched_after_list_changed(self, session):
+        """Test that a roots/list_changed notification drops the cached roots."""
+        from server import handle_roots_list_changed
+        
+        with mock_git(""):
+            await analyze_file_changes()
+            await handle_roots_list_changed(MagicMock())
+            await analyze_file_changes()
+        
+        assert session.list_roots.await_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_failed_lookup_cached(self, session):
+        """Test that a client without roots support is asked once, and the debug info reuses the answer."""
+        from mcp.shared.exceptions import McpError
+        from mcp.types import ErrorData
+        
+        session.list_roots.side_effect = McpError(ErrorData(code=-32601, message="Method not found"))
+        with mock_git(""):
+            await analyze_file_changes()
+            result = await analyze_file_changes()
+        
+        assert session.list_roots.await_count == 1
+        data = json.loads(result)
+        if "_debug" in data:
+            assert data["_debug"]["roots_check"] == {"found": False, "error": "Method not found"}
+
+
 @pytest.mark.skipif(not IMPORTS_SUCCESSFUL, reason="Imports failed")
 class TestGetPRTemplates:
     """Test the get_pr_templates tool."""
@@ -150,6 +311,82 @@ class TestGetPRTemplates:
             assert isinstance(templates, dict), "Should return structured error for starter code"
 
 
+class TestTemplateRegistry:
+    """Test that templates are served from memory and reloaded on change."""
+
+    @pytest.mark.parametrize("use_inotify", [True, False])
+    def test_discovers_and_reloads(self, tmp_path, use_inotify):
+        """Test that added and edited templates are picked up without re-reading unchanged ones."""
+        from template_registry import TemplateRegistry
+
+        (tmp_path / "bug.md").write_text("## Bug Fix\n")
+        registry = TemplateRegistry(tmp_path, {"bug.md": "Bug Fix"}, revalidate_seconds=0, use_inotify=use_inotify)
+        assert [t.type for t in registry.templates()] == ["Bug Fix"]
+        registry.templates()
+        assert registry.stats()["loads"] == 1
+
+        (tmp_path / "chore.md").write_text("## Chore\n\nRoutine maintenance\n")
+        assert registry.get("chore.md").type == "Chore"
+        (tmp_path / "bug.md").write_text("## Bug Fix\n\n### Root cause\n")
+        assert "Root cause" in registry.get("bug.md").content
+        assert [t.filename for t in registry.templates()] == ["bug.md", "chore.md"]
+
+
+@pytest.mark.skipif(not IMPORTS_SUCCESSFUL, reason="Imports failed")
+class TestTemplateResources:
+    """Test that templates are served as resources and subscribers hear about edits."""
+
+    @pytest.mark.asyncio
+    async def test_list_read_and_subscribe(self, tmp_path, monkeypatch):
+        """Test the hash index, template reads and resources/updated notifications over a client session."""
+        import server
+        from mcp import types
+        from pydantic import AnyUrl
+        from mcp.shared.memory import create_connected_server_and_client_session
+        from template_registry import TemplateRegistry
+
+        (tmp_path / "bug.md").write_text("## Bug Fix\n")
+        monkeypatch.setattr(server, "TEMPLATE_REGISTRY", TemplateRegistry(tmp_path, revalidate_seconds=0))
+        monkeypatch.setattr(server, "_template_watch", None)
+        updated = asyncio.Queue()
+
+        async def on_message(message):
+            if isinstance(message, types.ServerNotification):
+                await updated.put(message.root)
+
+        async with create_connected_server_and_client_session(mcp._mcp_server, message_handler=on_message) as client:
+            initialize = await client.initialize()
+            assert initialize.capabilities.resources.subscribe is True
+            resources = (await client.list_resources()).resources
+            assert "pr-template://index" in [str(r.uri) for r in resources]
+            templates = (await client.list_resource_templates()).resourceTemplates
+            assert "pr-template://{filename}" in [t.uriTemplate for t in templates]
+
+            index = json.loads((await client.read_resource(AnyUrl("pr-template://index"))).contents[0].text)
+            assert [entry["uri"] for entry in index] == ["pr-template://bug.md"]
+            first_hash = index[0]["hash"]
+            read = await client.read_resource(AnyUrl("pr-template://bug.md"))
+            assert read.contents[0].text == "## Bug Fix\n"
+
+            await client.subscribe_resource(AnyUrl("pr-template://bug.md"))
+            await client.subscribe_resource(AnyUrl("pr-template://index"))
+            (tmp_path / "bug.md").write_text("## Bug Fix\n\n### Root cause\n")
+            uris = set()
+            for _ in range(2):
+                notification = await asyncio.wait_for(updated.get(), 5)
+                assert isinstance(notification, types.ResourceUpdatedNotification)
+                uris.add(str(notification.params.uri))
+            assert uris == {"pr-template://bug.md", "pr-template://index"}
+
+            index = json.loads((await client.read_resource(AnyUrl("pr-template://index"))).contents[0].text)
+            assert index[0]["hash"] != first_hash
+            watch = server._template_watch
+
+        # Closing the last session stopped the watcher
+        assert server._template_watch is None and watch.done()
+        assert server.TEMPLATE_REGISTRY._wakeup is None
+
+
 @pytest.mark.skipif(not IMPORTS_SUCCESSFUL, reason="Imports failed")
 class TestSuggestTemplate:
     """Test the suggest_template tool."""
@@ -186,6 +423,17 @@ class TestSuggestTemplate:
             # Starter code - just verify it's structured correctly
             assert isinstance(suggestion, dict), "Should return structured error for starter code"
 
+    @pytest.mark.asyncio
+    async def test_content_returned_once(self):
+        """Test that the template content is sent once and the reasoning is encoded safely."""
+        result = await suggest_template('Fixed "quoted" input\nin the parser', "bug")
+        suggestion = json.loads(result)
+
+        assert suggestion["recommended_template"] == {"filename": "bug.md", "type": "Bug Fix"}
+        assert suggestion["template_content"].startswith("## Bug Fix")
+        assert result.count("### Root Cause") == 1
+        assert 'Fixed "quoted" input\nin the parser' in suggestion["reasoning"]
+
 
 @pytest.mark.skipif(not IMPORTS_SUCCESSFUL, reason="Imports failed")
 class TestToolRegistration:
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Optional SQLite store for GitHub webhook events.
+
+With WEBHOOK_EVENT_STORE=sqlite, webhook_server.py and the MCP server share
+github_events.db instead of the JSON Lines log. The database runs in WAL mode
+so the webhook server can write while the MCP server reads. Columns for received
+time, event type, workflow name, branch, head SHA and conclusion are indexed, so
+months of history can be kept without the event tools slowing down.
+
+open_event_store() returns this store or an EventLog. Both offer append(),
+append_many(), recent() and latest_workflow_runs(). BatchWriter puts either
+behind a queue, so webhook deliveries return at once and are written in
+group commits.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from event_log import EventLog, MAX_EVENT_AGE_DAYS
+
+logger = logging.getLogger(__name__)
+
+EVENT_STORE = os.getenv("WEBHOOK_EVENT_STORE", "jsonl")
+DATABASE_FILE = Path(__file__).parent / "github_events.db"
+# An indexed store can keep far more history than the JSON Lines log
+SQLITE_RETAINED_EVENTS = int(os.getenv("WEBHOOK_EVENTS_RETAINED", "100000"))
+# Inserts between retention passes
+PRUNE_INTERVAL = 100
+
+# Group commit: queued events are written after this many milliseconds, or as soon as this many are queued
+FLUSH_INTERVAL_MS = float(os.getenv("WEBHOOK_FLUSH_INTERVAL_MS", "50"))
+FLUSH_MAX_EVENTS = int(os.getenv("WEBHOOK_FLUSH_MAX_EVENTS", "100"))
+# A batch that fails with one of these is retried, after 0.1, 0.2, 0.4, ... seconds
+TRANSIENT_ERRORS = (sqlite3.OperationalError, OSError)
+FLUSH_RETRIES = int(os.getenv("WEBHOOK_FLUSH_RETRIES", "5"))
+RETRY_DELAY_SECONDS = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    received_at TEXT NOT NULL,
+    event_type TEXT,
+    action TEXT,
+    workflow_name TEXT,
+    branch TEXT,
+    head_sha TEXT,
+    conclusion TEXT,
+    updated_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_received_at ON events (received_at);
+CREATE INDEX IF NOT EXISTS events_event_type ON events (event_type);
+CREATE INDEX IF NOT EXISTS events_workflow ON events (workflow_name, updated_at);
+CREATE INDEX IF NOT EXISTS events_branch ON events (branch);
+CREATE INDEX IF NOT EXISTS events_head_sha ON events (head_sha);
+CREATE INDEX IF NOT EXISTS events_conclusion ON events (conclusion);
+"""
+
+
+def event_columns(event: dict) -> tuple:
+    """The indexed fields of an event, taken from its workflow_run or check_run."""
+    run = event.get("workflow_run") or {}
+    check = event.get("check_run") or {}
+    suite = check.get("check_suite") or {}
+    received_at = event.get("timestamp") or datetime.utcnow().isoformat()
+    return (
+        received_at,
+        event.get("event_type"),
+        event.get("action"),
+        run.get("name"),
+        run.get("head_branch") or suite.get("head_branch"),
+        run.get("head_sha") or check.get("head_sha"),
+        run.get("conclusion") or check.get("conclusion"),
+        # Never NULL, so max(updated_at) always picks a row
+        run.get("updated_at") or check.get("completed_at") or received_at
+    )
+
+
+class SQLiteEventStore:
+    """Webhook events in an SQLite database; one connection per process, opened on first use."""
+
+    def __init__(
+        self,
+        path: Path = DATABASE_FILE,
+        retained: int = SQLITE_RETAINED_EVENTS,
+        max_age_days: float = MAX_EVENT_AGE_DAYS
+    ):
+        self.path = Path(path)
+        self.retained = retained
+        self.max_age_days = max_age_days
+        self._connection: Optional[sqlite3.Connection] = None
+        self._inserts = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Callers serialize their use; the embedded listener writes from its own thread
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Sync the WAL on every commit, so a group commit is durable once written
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def append(self, event: dict):
+        self.append_many([event])
+
+    def append_many(self, events: List[dict]):
+        """Insert events in one transaction, so a group commit syncs once."""
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT INTO events (received_at, event_type, action, workflow_name, branch, head_sha,"
+                " conclusion, updated_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*event_columns(event), json.dumps(event, separators=(",", ":"))) for event in events]
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        before = self._inserts
+        self._inserts += len(events)
+        if before // PRUNE_INTERVAL != self._inserts // PRUNE_INTERVAL:
+            # The events are committed: a failed prune must not make the caller insert them again
+            try:
+                self.prune()
+            except sqlite3.Error as e:
+                logger.warning("Pruning %s failed, retried after the next %d inserts: %s", self.path, PRUNE_INTERVAL, e)
+
+    def prune(self):
+        """Drop events beyond the retained count or older than the maximum age."""
+        self.connection.execute(
+            "DELETE FROM events WHERE id <= (SELECT max(id) FROM events) - ?", (self.retained,)
+        )
+        if self.max_age_days:
+            cutoff = (datetime.utcnow() - timedelta(days=self.max_age_days)).isoformat()
+            self.connection.execute("DELETE FROM events WHERE received_at < ?", (cutoff,))
+
+    def recent(self, limit: int) -> List[dict]:
+        """The newest events, newest first."""
+        rows = self.connection.execute("SELECT data FROM events ORDER BY id DESC LIMIT ?", (limit,))
+        return [json.loads(data) for (data,) in rows]
+
+    def latest_workflow_runs(self, workflow_name: Optional[str] = None) -> List[dict]:
+        """The workflow_run event with the latest updated_at for each workflow."""
+        # SQLite takes the bare data column from the row holding max(); the grouping is
+        # served in order by the (workflow_name, updated_at) index
+        query = "SELECT data, max(updated_at) FROM events WHERE workflow_name IS NOT NULL"
+        parameters = ()
+        if workflow_name:
+            query = "SELECT data, max(updated_at) FROM events WHERE workflow_name = ?"
+            parameters = (workflow_name,)
+        rows = self.connection.execute(query + " GROUP BY workflow_name", parameters)
+        return [json.loads(data) for data, _ in rows]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class BatchWriter:
+    """Queue in front of an event store, written by one background task in group commits.
+
+    append() only queues the event. The writer waits up to interval_ms after the
+    first queued event, or until max_events are queued, then writes the batch
+    with a single append_many() (one write and fsync, or one transaction) in its
+    own thread. Batch sizes and flush times are kept for tuning.
+
+    Deliveries are acknowledged before they are written, so GitHub will not
+    redeliver them: a batch failing with a transient error (a locked database,
+    a full disk) is retried with exponential backoff, and only dropped, with a
+    logged error, after the last retry or on any other error. The stores only
+    raise before a batch is committed; pruning and compaction errors after it
+    are logged, so a retry never writes a batch twice.
+    """
+
+    def __init__(
+        self,
+        store,
+        max_events: int = FLUSH_MAX_EVENTS,
+        interval_ms: float = FLUSH_INTERVAL_MS,
+        retries: int = FLUSH_RETRIES,
+        retry_delay: float = RETRY_DELAY_SECONDS
+    ):
+        self.store = store
+        self.path = store.path
+        self.max_events = max_events
+        self.interval = interval_ms / 1000
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue: List[dict] = []
+        self._queued: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._closing = False
+        # A single thread, so batches reach the store in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-writer")
+        self.batches = 0
+        self.events = 0
+        self.max_batch = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.errors = 0
+        self.retried = 0
+        self.lost_events = 0
+
+    def append(self, event: dict):
+        self._queue.append(event)
+        if self._queued is not None:
+            self._queued.set()
+            if len(self._queue) >= self.max_events:
+                self._full.set()
+
+    def recent(self, limit: int) -> List[dict]:
+        return self.store.recent(limit)
+
+    def latest_workflow_runs(self, workflow_name: Optional[str] = None) -> List[dict]:
+        return self.store.latest_workflow_runs(workflow_name)
+
+    def start(self):
+        """Start the writer task in the running loop."""
+        if self._writer is None:
+            self._queued = asyncio.Event()
+            self._full = asyncio.Event()
+            if self._queue:
+                self._queued.set()
+            self._writer = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while not self._closing:
+            await self._queued.wait()
+            if len(self._queue) < self.max_events and not self._closing:
+                # Let more events join the batch, up to the interval
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._queued.clear()
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued, in batches of at most max_events."""
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            batch = self._queue[:self.max_events]
+            del self._queue[:self.max_events]
+            started = time.perf_counter()
+            if not await self._write_batch(loop, batch):
+                continue
+            elapsed = time.perf_counter() - started
+            self.batches += 1
+            self.events += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            self.flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    async def _write_batch(self, loop: asyncio.AbstractEventLoop, batch: List[dict]) -> bool:
+        """Write one batch, retrying transient failures; False if it was dropped."""
+        for attempt in range(self.retries + 1):
+            try:
+                await loop.run_in_executor(self._executor, self.store.append_many, batch)
+                return True
+            except TRANSIENT_ERRORS as e:
+                self.errors += 1
+                if attempt == self.retries:
+                    error = e
+                    break
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            except Exception as e:
+                # Not going to succeed on a retry, e.g. an event that cannot be serialized
+                self.errors += 1
+                error = e
+                break
+        self.lost_events += len(batch)
+        logger.error(
+            "Dropped %d webhook events after %d attempts (%s: %s); redeliver them from GitHub: %s",
+            len(batch), attempt + 1, type(error).__name__, error,
+            ", ".join(str(event.get("delivery_id") or "?") for event in batch)
+        )
+        return False
+
+    async def close(self):
+        """Stop the writer after writing what is still queued."""
+        if self._writer is not None:
+            self._closing = True
+            self._queued.set()
+            self._full.set()
+            await self._writer
+            self._writer = None
+            self._closing = False
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "batches": self.batches,
+            "events": self.events,
+            "average_batch": round(self.events / self.batches, 1) if self.batches else 0,
+            "max_batch": self.max_batch,
+            "average_flush_ms": round(1000 * self.flush_seconds / self.batches, 2) if self.batches else 0,
+            "max_flush_ms": round(1000 * self.max_flush_seconds, 2),
+            "errors": self.errors,
+            "retried": self.retried,
+            "lost_events": self.lost_events,
+            "max_events": self.max_events,
+            "interval_ms": self.interval * 1000
+        }
+
+
+def open_event_store():
+    """The event store selected by WEBHOOK_EVENT_STORE: "jsonl" (default) or "sqlite"."""
+    if EVENT_STORE == "sqlite":
+        return SQLiteEventStore()
+    if EVENT_STORE != "jsonl":
+        raise ValueError(f"Unknown WEBHOOK_EVENT_STORE {EVENT_STORE!r}; use 'jsonl' or 'sqlite'")
+    return EventLog()
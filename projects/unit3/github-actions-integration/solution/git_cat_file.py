@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Long-lived `git cat-file --batch` workers shared across tool calls.
+
+Reading objects one `git show` at a time costs a fork and exec per object. A
+worker keeps one cat-file process per repository open and pipelines requests
+over its stdin, so reading a blob is a pipe write and read. Workers that crash
+are restarted on the next request, and requests caught in a crash are retried
+once on the new process.
+
+A pool stops its processes once it has been idle for CAT_FILE_IDLE_SECONDS and
+starts them again on the next request. At most CAT_FILE_MAX_REPOSITORIES pools
+are kept; the least recently used idle one is closed to make room.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict, deque
+from typing import Deque, List, NamedTuple, Optional, Set
+
+# Default number of --batch workers per repository
+DEFAULT_POOL_SIZE = 2
+DEFAULT_IDLE_SECONDS = 300.0
+
+
+class CatFileError(Exception):
+    """Raised when git cat-file cannot serve a request."""
+
+
+class WorkerCrashed(CatFileError):
+    """Raised for requests that were in flight when a worker's process died."""
+
+
+class CatFileObject(NamedTuple):
+    sha: str
+    type: str
+    size: int
+    data: Optional[bytes]  # None for --batch-check
+
+
+class CatFileWorker:
+    """One `git cat-file` process serving pipelined requests in order."""
+
+    def __init__(self, cwd: str, mode: str = "--batch"):
+        self.cwd = cwd
+        self.mode = mode
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.pending: Deque[asyncio.Future] = deque()
+        self.reader: Optional[asyncio.Task] = None
+        self.start_lock = asyncio.Lock()
+        self.starts = 0
+        self.requests = 0
+        self.in_flight = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None and not self.reader.done()
+
+    async def _start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            "git", "cat-file", self.mode,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=self.cwd
+        )
+        # Each process gets its own queue so a late crash cannot fail its successor's requests
+        self.pending = deque()
+        self.reader = asyncio.create_task(self._read_responses(self.process, self.pending))
+        self.starts += 1
+
+    async def _read_responses(self, process: asyncio.subprocess.Process, pending: Deque[asyncio.Future]):
+        """Resolve pending requests in the order git answers them."""
+        stdout = process.stdout
+        try:
+            while True:
+                header = await stdout.readline()
+                if not header:
+                    raise WorkerCrashed(f"git cat-file exited with {process.returncode}")
+                future = pending.popleft()
+                if header.endswith((b" missing\n", b" ambiguous\n")):
+                    result = None
+                else:
+                    sha, kind, size = header.decode().split()
+                    data = None
+                    if self.mode == "--batch":
+                        # Content is always read, even for cancelled requests, to stay in sync
+                        data = (await stdout.readexactly(int(size) + 1))[:-1]
+                    result = CatFileObject(sha, kind, int(size), data)
+                if not future.done():
+                    future.set_result(result)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, WorkerCrashed) as e:
+            error = e if isinstance(e, WorkerCrashed) else WorkerCrashed(str(e))
+            while pending:
+                future = pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            if process.returncode is None:
+                process.kill()
+
+    async def request(self, spec: str) -> Optional[CatFileObject]:
+        """Look up one object name (e.g. 'HEAD:server.py'); None if it does not exist."""
+        if "\n" in spec:
+            raise CatFileError("Object names cannot contain newlines")
+        self.in_flight += 1
+        try:
+            return await self._request(spec)
+        finally:
+            self.in_flight -= 1
+
+    async def _request(self, spec: str) -> Optional[CatFileObject]:
+        for attempt in range(2):
+            if not self.alive:
+                async with self.start_lock:
+                    if not self.alive:
+                        await self.close()
+                        await self._start()
+            future = asyncio.get_running_loop().create_future()
+            # Queue and write without yielding so responses stay in request order
+            self.pending.append(future)
+            self.process.stdin.write(spec.encode() + b"\n")
+            self.requests += 1
+            try:
+                await self.process.stdin.drain()
+                return await future
+            except (WorkerCrashed, ConnectionError) as e:
+                future.cancel()
+                if attempt:
+                    raise CatFileError(f"git cat-file failed for {spec}: {e}") from e
+
+    async def close(self):
+        """Stop the process; pending requests fail with WorkerCrashed."""
+        # A request may start a new process while this one winds down
+        process, reader, self.process = self.process, self.reader, None
+        if process is None:
+            return
+        if process.returncode is None:
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), 1)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await reader
+
+
+class CatFilePool:
+    """A few --batch workers and one --batch-check worker for one repository."""
+
+    def __init__(self, cwd: str, size: int = DEFAULT_POOL_SIZE, idle_seconds: float = DEFAULT_IDLE_SECONDS):
+        self.cwd = cwd
+        self.loop = asyncio.get_running_loop()
+        self.workers = [CatFileWorker(cwd, "--batch") for _ in range(max(1, size))]
+        self.checker = CatFileWorker(cwd, "--batch-check")
+        self.idle_seconds = idle_seconds
+        self.last_used = self.loop.time()
+        self.idle_closes = 0
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+        self._closing: Optional[asyncio.Task] = None
+
+    @property
+    def busy(self) -> bool:
+        return any(worker.in_flight for worker in (*self.workers, self.checker))
+
+    async def _request(self, worker: CatFileWorker, spec: str) -> Optional[CatFileObject]:
+        self.last_used = self.loop.time()
+        try:
+            return await worker.request(spec)
+        finally:
+            self.last_used = self.loop.time()
+            if self.idle_seconds and self._idle_timer is None:
+                self._idle_timer = self.loop.call_later(self.idle_seconds, self._close_if_idle)
+
+    def _close_if_idle(self):
+        self._idle_timer = None
+        if self.busy:
+            # The last request to finish sets a new timer
+            return
+        remaining = self.last_used + self.idle_seconds - self.loop.time()
+        if remaining > 0:
+            self._idle_timer = self.loop.call_later(remaining, self._close_if_idle)
+        elif any(worker.alive for worker in (*self.workers, self.checker)):
+            self.idle_closes += 1
+            self._closing = self.loop.create_task(self._close_workers())
+
+    async def read(self, spec: str) -> Optional[CatFileObject]:
+        """Read an object's content on the least busy worker."""
+        worker = min(self.workers, key=lambda w: w.in_flight)
+        return await self._request(worker, spec)
+
+    async def read_many(self, specs: List[str]) -> List[Optional[CatFileObject]]:
+        """Read several objects, pipelined across the workers."""
+        return list(await asyncio.gather(*(self.read(spec) for spec in specs)))
+
+    async def info(self, spec: str) -> Optional[CatFileObject]:
+        """Look up an object's type and size without reading it."""
+        return await self._request(self.checker, spec)
+
+    async def _close_workers(self):
+        for worker in (*self.workers, self.checker):
+            await worker.close()
+
+    async def close(self):
+        """Stop every worker; a later request starts them again."""
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self._closing is not None:
+            await self._closing
+            self._closing = None
+        await self._close_workers()
+
+    def stats(self) -> dict:
+        workers = (*self.workers, self.checker)
+        return {
+            "workers": sum(worker.alive for worker in workers),
+            "requests": sum(worker.requests for worker in workers),
+            "restarts": sum(max(0, worker.starts - 1) for worker in workers),
+            "idle_closes": self.idle_closes
+        }
+
+
+# One pool per repository, created on first use, least recently used first
+_POOLS: "OrderedDict[str, CatFilePool]" = OrderedDict()
+# Evicted pools still shutting down their processes
+_EVICTED: Set[asyncio.Task] = set()
+
+POOL_SIZE = int(os.getenv("CAT_FILE_WORKERS", str(DEFAULT_POOL_SIZE)))
+POOL_IDLE_SECONDS = float(os.getenv("CAT_FILE_IDLE_SECONDS", str(DEFAULT_IDLE_SECONDS)))
+MAX_POOLS = int(os.getenv("CAT_FILE_MAX_REPOSITORIES", "8"))
+
+evictions = 0
+
+
+def get_cat_file_pool(cwd: str) -> CatFilePool:
+    """Get the worker pool for the repository at cwd."""
+    global evictions
+    key = os.path.realpath(cwd)
+    pool = _POOLS.get(key)
+    if pool is None or pool.loop is not asyncio.get_running_loop():
+        # Processes belong to the event loop that started them
+        pool = _POOLS[key] = CatFilePool(key, POOL_SIZE, POOL_IDLE_SECONDS)
+    _POOLS.move_to_end(key)
+    if len(_POOLS) > MAX_POOLS:
+        # Pools serving requests are skipped, so the cap may be exceeded briefly
+        for old_key, old_pool in list(_POOLS.items())[:-1]:
+            if len(_POOLS) <= MAX_POOLS:
+                break
+            if old_pool.busy:
+                continue
+            del _POOLS[old_key]
+            evictions += 1
+            if old_pool.loop is pool.loop:
+                task = pool.loop.create_task(old_pool.close())
+                _EVICTED.add(task)
+                task.add_done_callback(_EVICTED.discard)
+    return pool
+
+
+async def close_cat_file_pools():
+    """Stop every worker, e.g. on server shutdown."""
+    loop = asyncio.get_running_loop()
+    pools = list(_POOLS.values())
+    _POOLS.clear()
+    for pool in pools:
+        # Pools of another event loop cannot be driven from this one
+        if pool.loop is loop:
+            await pool.close()
+    evicted = [task for task in _EVICTED if task.get_loop() is loop]
+    if evicted:
+        await asyncio.gather(*evicted)
+
+
+def cat_file_stats() -> dict:
+    """Aggregate counters across repositories for get_server_metrics."""
+    pools = list(_POOLS.values())
+    stats = {"repositories": len(pools), "workers": 0, "requests": 0, "restarts": 0, "idle_closes": 0}
+    for pool in pools:
+        for key, value in pool.stats().items():
+            stats[key] += value
+    stats["evictions"] = evictions
+    return stats
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Background precomputation of analyze_file_changes results.
+
+Once a repository has been analyzed, its HEAD, refs and packed-refs are watched
+(with inotify on Linux, by polling elsewhere). When a branch moves, the analysis
+is recomputed in the background with the arguments of the last call, so it is
+already in ANALYSIS_CACHE when the next tool call arrives.
+
+At most max_repositories are watched; the least recently analyzed one is
+dropped to make room, and a repository that has not been analyzed for
+idle_seconds stops being watched.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from git_analysis import analyze_changes, run_git
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Files directly in the git directory that move a branch
+REF_FILES = ("HEAD", "packed-refs")
+
+# Wait this long after the last ref change before recomputing, so a rebase or
+# fetch that rewrites many refs triggers one analysis
+DEBOUNCE_SECONDS = 0.2
+
+
+class Inotify:
+    """Minimal ctypes binding for inotify; raises OSError where unavailable."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}
+
+    def add(self, path: str):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.watches[wd] = path
+
+    def read_events(self) -> List[Tuple[str, str, int]]:
+        """Drain pending events as (directory, name, mask)."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            events.append((self.watches.get(wd, ""), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def ref_paths(git_dirs: List[str]) -> List[str]:
+    """The files whose changes move branches: HEAD, packed-refs and everything under refs."""
+    paths = []
+    for git_dir in git_dirs:
+        paths.extend(os.path.join(git_dir, name) for name in REF_FILES)
+        for root, _dirs, files in os.walk(os.path.join(git_dir, "refs")):
+            paths.extend(os.path.join(root, name) for name in files)
+    return paths
+
+
+def _cancel(task: asyncio.Task):
+    """Cancel a task, which may belong to an event loop that is already closed."""
+    try:
+        task.cancel()
+    except RuntimeError:
+        pass
+
+
+class RefWatcher:
+    """Calls on_change whenever HEAD, a ref or packed-refs changes."""
+
+    def __init__(self, git_dirs: List[str], on_change: Callable[[], None],
+                 poll_interval: float = 2.0, use_inotify: bool = True):
+        self.git_dirs = list(dict.fromkeys(git_dirs))
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.inotify: Optional[Inotify] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.poller: Optional[asyncio.Task] = None
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.inotify is not None else "poll"
+
+    def start(self):
+        if self.use_inotify:
+            try:
+                self.inotify = Inotify()
+                for git_dir in self.git_dirs:
+                    self.inotify.add(git_dir)
+                    for root, _dirs, _files in os.walk(os.path.join(git_dir, "refs")):
+                        self.inotify.add(root)
+                self.loop = asyncio.get_running_loop()
+                self.loop.add_reader(self.inotify.fd, self._on_events)
+                return
+            except OSError:
+                if self.inotify is not None:
+                    self.inotify.close()
+                self.inotify = None
+        self.poller = asyncio.create_task(self._poll(self._snapshot()))
+
+    def _on_events(self):
+        changed = False
+        for directory, name, mask in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                changed = True
+            elif mask & IN_ISDIR:
+                # New ref namespaces (e.g. refs/heads/feature/) need their own watch
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.inotify.add(os.path.join(directory, name))
+                    except OSError:
+                        pass
+            elif name.endswith(".lock"):
+                continue
+            elif directory in self.git_dirs:
+                changed = changed or name in REF_FILES
+            else:
+                changed = True
+        if changed:
+            self.on_change()
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for path in ref_paths(self.git_dirs):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    async def _poll(self, previous: Dict[str, Tuple[int, int]]):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = self._snapshot()
+            if current != previous:
+                previous = current
+                self.on_change()
+
+    def stop(self):
+        if self.inotify is not None:
+            if not self.loop.is_closed():
+                self.loop.remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+        if self.poller is not None:
+            _cancel(self.poller)
+            self.poller = None
+
+
+class BackgroundAnalysis:
+    """Keeps analyze_file_changes results warm for the repositories in use."""
+
+    def __init__(self, enabled: bool = True, poll_interval: float = 2.0,
+                 debounce: float = DEBOUNCE_SECONDS, use_inotify: bool = True,
+                 max_repositories: int = 8, idle_seconds: float = 1800.0):
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_inotify = use_inotify
+        self.max_repositories = max_repositories
+        self.idle_seconds = idle_seconds
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # Least recently analyzed first
+        self.watchers: "OrderedDict[str, RefWatcher]" = OrderedDict()
+        self.arguments: Dict[str, dict] = {}
+        self.last_used: Dict[str, float] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._expiry: Optional[asyncio.TimerHandle] = None
+        self.runs = 0
+        self.failures = 0
+        self.watch_failures = 0
+        self.evictions = 0
+        self.last_duration_ms: Optional[float] = None
+
+    async def watch(self, cwd: str, **analyze_kwargs):
+        """Start watching cwd's repository and remember the arguments to precompute with.
+
+        Never raises: a repository that cannot be watched is counted in
+        watch_failures and simply not precomputed.
+        """
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Watchers belong to the event loop that started them
+            self.stop()
+            self.loop = loop
+        key = os.path.realpath(cwd)
+        self.arguments[key] = analyze_kwargs
+        self.last_used[key] = loop.time()
+        if key in self.watchers:
+            self.watchers.move_to_end(key)
+            return
+        try:
+            output = await run_git(["rev-parse", "--absolute-git-dir", "--git-common-dir"], key, check=True)
+            git_dir, common_dir = output.splitlines()
+            watcher = RefWatcher(
+                [os.path.realpath(git_dir), os.path.realpath(os.path.join(key, common_dir))],
+                lambda: self._schedule(key),
+                poll_interval=self.poll_interval,
+                use_inotify=self.use_inotify
+            )
+            watcher.start()
+        except Exception:
+            self.watch_failures += 1
+            self.arguments.pop(key, None)
+            self.last_used.pop(key, None)
+            return
+        if key in self.watchers:
+            # A concurrent call got there first
+            watcher.stop()
+            return
+        self.watchers[key] = watcher
+        while len(self.watchers) > self.max_repositories:
+            self.unwatch(next(iter(self.watchers)))
+            self.evictions += 1
+        if self.idle_seconds and self._expiry is None:
+            self._expiry = loop.call_later(self.idle_seconds, self._expire)
+
+    def unwatch(self, key: str):
+        """Stop watching one repository."""
+        watcher = self.watchers.pop(key, None)
+        if watcher is not None:
+            watcher.stop()
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            _cancel(task)
+        self.arguments.pop(key, None)
+        self.last_used.pop(key, None)
+
+    def _expire(self):
+        """Drop repositories that have not been analyzed for idle_seconds."""
+        self._expiry = None
+        now = self.loop.time()
+        for key in [key for key in self.watchers if now - self.last_used[key] >= self.idle_seconds]:
+            self.unwatch(key)
+            self.evictions += 1
+        if self.watchers:
+            oldest = min(self.last_used[key] for key in self.watchers)
+            self._expiry = self.loop.call_later(oldest + self.idle_seconds - now, self._expire)
+
+    def _schedule(self, key: str):
+        task = self.tasks.get(key)
+        if task is not None and not task.done():
+            task.cancel()
+        self.tasks[key] = asyncio.create_task(self._recompute(key))
+
+    async def _recompute(self, key: str):
+        await asyncio.sleep(self.debounce)
+        started = time.perf_counter()
+        try:
+            await analyze_changes(key, **self.arguments[key])
+        except Exception:
+            # The foreground call will report the problem; keep watching
+            self.failures += 1
+            return
+        self.runs += 1
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def stop(self):
+        """Stop every watcher and pending recomputation, e.g. on server shutdown."""
+        for watcher in self.watchers.values():
+            watcher.stop()
+        for task in self.tasks.values():
+            _cancel(task)
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        self.watchers.clear()
+        self.tasks.clear()
+        self.arguments.clear()
+        self.last_used.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "repositories": len(self.watchers),
+            "max_repositories": self.max_repositories,
+            "inotify": sum(watcher.mode == "inotify" for watcher in self.watchers.values()),
+            "runs": self.runs,
+            "failures": self.failures,
+            "watch_failures": self.watch_failures,
+            "evictions": self.evictions,
+            "last_duration_ms": self.last_duration_ms
+        }
+
+
+BACKGROUND_ANALYSIS = BackgroundAnalysis(
+    enabled=os.getenv("ANALYSIS_PRECOMPUTE", "1") != "0",
+    poll_interval=float(os.getenv("REF_POLL_SECONDS", "2")),
+    max_repositories=int(os.getenv("ANALYSIS_PRECOMPUTE_REPOSITORIES", "8")),
+    idle_seconds=float(os.getenv("ANALYSIS_PRECOMPUTE_IDLE_SECONDS", "1800"))
+)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+In-memory registry of the PR templates in the shared templates directory.
+
+Templates are read once and served from memory. The directory is watched with
+inotify where available (otherwise its files' mtimes are checked at most once
+per revalidate interval), and any change reloads it. Every .md file in the
+directory is a template; none need to be registered in code.
+
+Each template carries a hash of its content so clients can cache it, and
+watch() reports which templates changed so the server can notify them.
+"""
+
+import asyncio
+import hashlib
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from ref_watcher import Inotify
+
+
+# Seconds to wait after a change before reloading, so a burst of writes reloads once
+WATCH_DEBOUNCE = 0.1
+
+
+class Template(NamedTuple):
+    filename: str
+    type: str
+    content: str
+    # Truncated SHA-256 of the content
+    hash: str
+
+
+class TemplateRegistry:
+    """PR templates kept in memory and reloaded only when the directory changes."""
+
+    def __init__(self, directory: Path, titles: Optional[Dict[str, str]] = None,
+                 revalidate_seconds: float = 1.0, use_inotify: bool = True):
+        self.directory = Path(directory)
+        # Display names for known templates; others are named after their first heading
+        self.titles = titles or {}
+        self.revalidate_seconds = revalidate_seconds
+        self.inotify: Optional[Inotify] = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+                self.inotify.add(str(self.directory))
+            except OSError:
+                if self.inotify is not None:
+                    self.inotify.close()
+                self.inotify = None
+        self._templates: Dict[str, Template] = {}
+        self._signature: Tuple = ()
+        self._checked_at = 0.0
+        # Set on reloads, so watch() also reports changes a tool call picked up first
+        self._wakeup: Optional[asyncio.Event] = None
+        self.version = 0
+        self.loads = 0
+        self._load()
+
+    def _scan(self) -> Tuple:
+        """Names, sizes and mtimes of the template files, to detect edits without reading them."""
+        signature = []
+        for path in sorted(self.directory.glob("*.md")):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            signature.append((path.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _title(self, filename: str, content: str) -> str:
+        if filename in self.titles:
+            return self.titles[filename]
+        for line in content.splitlines():
+            if line.startswith("#"):
+                return line.lstrip("#").strip()
+        return Path(filename).stem.replace("_", " ").replace("-", " ").title()
+
+    def _load(self):
+        self._signature = self._scan()
+        templates = {}
+        for name, _mtime, _size in self._signature:
+            try:
+                content = (self.directory / name).read_text()
+            except OSError:
+                continue
+            digest = hashlib.sha256(content.encode()).hexdigest()[:16]
+            templates[name] = Template(name, self._title(name, content), content, digest)
+        # Known templates first, in their configured order, then discovered ones by name
+        ordered = {name: templates[name] for name in self.titles if name in templates}
+        ordered.update(templates)
+        self._templates = ordered
+        self.version += 1
+        self.loads += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _stale(self) -> bool:
+        if self.inotify is not None:
+            # Draining the event queue is a non-blocking syscall, no disk access
+            return bool(self.inotify.read_events())
+        now = time.monotonic()
+        if now - self._checked_at < self.revalidate_seconds:
+            return False
+        self._checked_at = now
+        return self._scan() != self._signature
+
+    def templates(self) -> List[Template]:
+        """All templates, reloading first if the directory changed."""
+        if self._stale():
+            self._load()
+        return list(self._templates.values())
+
+    def get(self, filename: str) -> Optional[Template]:
+        if self._stale():
+            self._load()
+        return self._templates.get(filename)
+
+    async def watch(self, on_change: Callable[[Dict[str, str]], Awaitable[None]]):
+        """Call on_change with {filename: "added" | "removed" | "modified"} after each change, until cancelled."""
+        loop = asyncio.get_running_loop()
+        wakeup = self._wakeup = asyncio.Event()
+        if self.inotify is not None:
+            loop.add_reader(self.inotify.fd, wakeup.set)
+        known = {t.filename: t.hash for t in self._templates.values()}
+        try:
+            while True:
+                if self.inotify is not None:
+                    await wakeup.wait()
+                    await asyncio.sleep(WATCH_DEBOUNCE)
+                else:
+                    await asyncio.sleep(max(self.revalidate_seconds, WATCH_DEBOUNCE))
+                # Compared with what was last reported, since tool calls may have reloaded already
+                current = {t.filename: t.hash for t in self.templates()}
+                wakeup.clear()
+                changed = {}
+                for name in known.keys() | current.keys():
+                    if name not in current:
+                        changed[name] = "removed"
+                    elif name not in known:
+                        changed[name] = "added"
+                    elif known[name] != current[name]:
+                        changed[name] = "modified"
+                known = current
+                if changed:
+                    await on_change(changed)
+        finally:
+            self._wakeup = None
+            if self.inotify is not None and not loop.is_closed():
+                loop.remove_reader(self.inotify.fd)
+
+    def stats(self) -> dict:
+        return {
+            "templates": len(self._templates),
+            "version": self.version,
+            "loads": self.loads,
+            "watch": "inotify" if self.inotify is not None else "mtime"
+        }
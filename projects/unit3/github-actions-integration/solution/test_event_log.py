@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the webhook event log, SQLite event store and in-memory ring buffer
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+
+import pytest
+
+from event_log import EventLog, READ_BLOCK_SIZE
+from event_store import BatchWriter, SQLiteEventStore
+from event_buffer import EventRingBuffer
+
+
+def workflow_event(name: str, run_number: int, updated_at: str = "2025-05-30T22:42:00Z") -> dict:
+    return {
+        "timestamp": "2025-05-30T22:42:00",
+        "event_type": "workflow_run",
+        "action": "completed",
+        "workflow_run": {"name": name, "run_number": run_number, "updated_at": updated_at},
+        "check_run": None
+    }
+
+
+class TestEventLog:
+    """Test appending, compaction and reading from the end."""
+
+    def test_append_and_read_newest_first(self, tmp_path):
+        """Test that events come back newest first, even across read blocks."""
+        log = EventLog(tmp_path / "events.jsonl", legacy_path=None)
+        padding = "x" * (READ_BLOCK_SIZE // 3)
+        for i in range(10):
+            log.append({**workflow_event("CI", i), "padding": padding})
+
+        assert [e["workflow_run"]["run_number"] for e in log.events()] == list(range(9, -1, -1))
+        assert len((tmp_path / "events.jsonl").read_bytes().splitlines()) == 10
+
+    def test_compaction_keeps_retained_events(self, tmp_path):
+        """Test that the log is compacted to the newest events once it doubles."""
+        log = EventLog(tmp_path / "events.jsonl", retained=5, legacy_path=None)
+        for i in range(12):
+            log.append(workflow_event("CI", i))
+
+        assert log.compactions == 1
+        numbers = [e["workflow_run"]["run_number"] for e in log.events()]
+        assert numbers == [11, 10, 9, 8, 7, 6, 5]
+        assert not (tmp_path / "events.jsonl.tmp").exists()
+
+    def test_filters_skip_unrelated_lines(self, tmp_path):
+        """Test byte filters, partial lines and migration from the old JSON file."""
+        legacy = tmp_path / "events.json"
+        legacy.write_text(json.dumps([workflow_event("CI", 1), {"event_type": "check_run", "workflow_run": None}], indent=2))
+        log = EventLog(tmp_path / "events.jsonl", legacy_path=legacy)
+        assert len(list(log.events())) == 2
+
+        log.append(workflow_event("Deploy", 2))
+        with open(tmp_path / "events.jsonl", "ab") as f:
+            f.write(b'{"event_type": "workflow_ru')
+
+        assert [e["workflow_run"]["name"] for e in log.events([b'"workflow_run":{'])] == ["Deploy", "CI"]
+        assert [e["workflow_run"]["run_number"] for e in log.events([b'"name":"CI"'])] == [1]
+
+    def test_append_during_compaction_is_kept(self, tmp_path, monkeypatch):
+        """Test that an event another writer appends while the log is being compacted survives it."""
+        path = tmp_path / "events.jsonl"
+        log = EventLog(path, retained=5, legacy_path=None)
+        other = EventLog(path, retained=5, legacy_path=None)
+        delivery = threading.Thread(target=other.append, args=(workflow_event("Other", 1),))
+        replace = os.replace
+
+        def replace_after_delivery(source, destination):
+            # The other writer's event arrives after the retained lines were copied
+            delivery.start()
+            delivery.join(0.2)
+            replace(source, destination)
+
+        monkeypatch.setattr(os, "replace", replace_after_delivery)
+        for i in range(10):
+            log.append(workflow_event("CI", i))
+        delivery.join()
+
+        assert log.compactions == 1
+        assert [e["workflow_run"]["name"] for e in log.recent(6)] == ["Other"] + ["CI"] * 5
+
+@pytest.fixture(params=["jsonl", "sqlite", "memory"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield EventRingBuffer(3)
+    elif request.param == "sqlite":
+        store = SQLiteEventStore(tmp_path / "events.db", retained=5)
+        yield store
+        store.close()
+    else:
+        yield EventLog(tmp_path / "events.jsonl", retained=5, legacy_path=None)
+
+
+class TestEventStores:
+    """Test the queries the event tools make, against both stores."""
+
+    def test_recent_and_latest_workflow_runs(self, store):
+        """Test newest-first reads and the latest run per workflow by updated_at."""
+        store.append(workflow_event("CI", 1, "2025-05-30T10:00:00Z"))
+        store.append(workflow_event("Deploy", 2, "2025-05-30T11:00:00Z"))
+        # Delivered late: an older run of CI must not replace the newer one
+        store.append(workflow_event("CI", 3, "2025-05-30T12:00:00Z"))
+        store.append(workflow_event("CI", 2, "2025-05-30T11:30:00Z"))
+        store.append({"timestamp": "2025-05-30T12:01:00", "event_type": "check_run",
+                      "workflow_run": None, "check_run": {"name": "lint", "head_sha": "abc"}})
+
+        assert [e["event_type"] for e in store.recent(2)] == ["check_run", "workflow_run"]
+        latest = {e["workflow_run"]["name"]: e["workflow_run"]["run_number"] for e in store.latest_workflow_runs()}
+        assert latest == {"CI": 3, "Deploy": 2}
+        assert [e["workflow_run"]["run_number"] for e in store.latest_workflow_runs("CI")] == [3]
+
+    def test_sqlite_retention(self, tmp_path):
+        """Test that pruning keeps the newest retained events."""
+        store = SQLiteEventStore(tmp_path / "events.db", retained=5)
+        for i in range(12):
+            store.append(workflow_event("CI", i))
+        store.prune()
+
+        assert [e["workflow_run"]["run_number"] for e in store.recent(10)] == [11, 10, 9, 8, 7]
+        assert store.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        store.close()
+
+
+class TestEmbeddedListener:
+    """Test the webhook route served from the MCP server's own event loop."""
+
+    @pytest.mark.asyncio
+    async def test_webhook_visible_to_tools(self, tmp_path, monkeypatch):
+        """Test that a delivery reaches the event tools from memory and is persisted behind."""
+        import aiohttp
+        import server
+        from mcp.shared.memory import create_connected_server_and_client_session
+
+        with socket.socket() as probe:
+            probe.bind(("localhost", 0))
+            port = probe.getsockname()[1]
+        log = EventLog(tmp_path / "events.jsonl", legacy_path=None)
+        log.append(workflow_event("CI", 1, "2025-05-30T10:00:00Z"))
+        monkeypatch.setattr(server, "EMBEDDED_WEBHOOK_PORT", port)
+        monkeypatch.setattr(server, "EVENT_STORE", EventRingBuffer(10, BatchWriter(log)))
+
+        async with create_connected_server_and_client_session(server.mcp._mcp_server):
+            async with aiohttp.ClientSession() as http:
+                payload = {"action": "completed", "workflow_run": {"name": "CI", "run_number": 2,
+                                                                   "updated_at": "2025-05-30T11:00:00Z"}}
+                async with http.post(f"http://localhost:{port}/webhook/github", json=payload,
+                                     headers={"X-GitHub-Event": "workflow_run"}) as response:
+                    assert response.status == 200
+
+            status = json.loads(await server.get_workflow_status("CI"))
+            assert status[0]["run_number"] == 2
+            recent = json.loads(await server.get_recent_actions_events(5))
+            assert [e["workflow_run"]["run_number"] for e in recent] == [1, 2]
+
+        # Closing the last session flushed the write-behind queue
+        assert [e["workflow_run"]["run_number"] for e in log.events()] == [2, 1]
+
+
+class TestBatchWriter:
+    """Test group commits of queued webhook events."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("kind", ["jsonl", "sqlite"])
+    async def test_storm_is_written_in_batches(self, kind, tmp_path):
+        """Test that a burst of deliveries is written in a few batches, in order."""
+        if kind == "sqlite":
+            store = SQLiteEventStore(tmp_path / "events.db")
+        else:
+            store = EventLog(tmp_path / "events.jsonl", legacy_path=None)
+        writer = BatchWriter(store, max_events=20, interval_ms=1000)
+        writer.start()
+        for i in range(50):
+            writer.append(workflow_event("CI", i))
+        assert store.recent(1) == []
+
+        await asyncio.sleep(0.1)
+        # A full batch is written without waiting for the interval, along with the rest of the queue
+        stats = writer.stats()
+        assert (stats["batches"], stats["events"], stats["max_batch"], stats["queued"]) == (3, 50, 20, 0)
+        assert [e["workflow_run"]["run_number"] for e in store.recent(50)] == list(range(49, -1, -1))
+
+        # A few events wait for the interval, or for close()
+        for i in range(50, 53):
+            writer.append(workflow_event("CI", i))
+        await asyncio.sleep(0.1)
+        assert writer.stats()["queued"] == 3
+        await writer.close()
+        assert writer.stats()["batches"] == 4
+        assert store.recent(1)[0]["workflow_run"]["run_number"] == 52
+
+    @pytest.mark.asyncio
+    async def test_webhook_server_queues_and_reports(self, tmp_path):
+        """Test that the standalone webhook server answers before writing and reports its batches."""
+        from aiohttp.test_utils import TestClient, TestServer
+        from webhook_server import create_app
+
+        log = EventLog(tmp_path / "events.jsonl", legacy_path=None)
+        async with TestClient(TestServer(create_app(BatchWriter(log, interval_ms=10)))) as client:
+            for i in range(5):
+                response = await client.post("/webhook/github", json={"action": "completed"},
+                                             headers={"X-GitHub-Event": "check_run"})
+                assert (await response.json()) == {"status": "received"}
+            await asyncio.sleep(0.1)
+            stats = await (await client.get("/webhook/stats")).json()
+
+        assert stats["events"] == 5 and stats["batches"] >= 1
+        assert len(log.recent(10)) == 5
+
+    @pytest.mark.asyncio
+    async def test_transient_failures_are_retried(self, tmp_path, caplog):
+        """Test that a locked database is retried, and a batch that keeps failing is logged."""
+        class FlakyLog(EventLog):
+            failures = 2
+
+            def append_many(self, events, sync=True):
+                if self.failures:
+                    self.failures -= 1
+                    raise sqlite3.OperationalError("database is locked")
+                super().append_many(events, sync)
+
+        log = FlakyLog(tmp_path / "events.jsonl", legacy_path=None)
+        writer = BatchWriter(log, retries=3, retry_delay=0.01)
+        writer.append({**workflow_event("CI", 1), "delivery_id": "d-1"})
+        await writer.close()
+
+        assert [e["workflow_run"]["run_number"] for e in log.recent(5)] == [1]
+        assert (writer.stats()["retried"], writer.stats()["lost_events"]) == (2, 0)
+
+        log.failures = 5
+        writer.append({**workflow_event("CI", 2), "delivery_id": "d-2"})
+        with caplog.at_level(logging.ERROR, logger="event_store"):
+            await writer.close()
+
+        assert writer.stats()["lost_events"] == 1
+        assert "Dropped 1 webhook events after 4 attempts" in caplog.text
+        assert "d-2" in caplog.text
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("kind", ["jsonl", "sqlite"])
+    async def test_failed_maintenance_does_not_rewrite_batch(self, kind, tmp_path):
+        """Test that a prune or compaction failing after the commit is not retried as a failed batch."""
+        if kind == "sqlite":
+            class Store(SQLiteEventStore):
+                def prune(self):
+                    raise sqlite3.OperationalError("database is locked")
+            store = Store(tmp_path / "events.db")
+        else:
+            class Store(EventLog):
+                def _compact(self):
+                    raise OSError("No space left on device")
+            store = Store(tmp_path / "events.jsonl", retained=50, legacy_path=None)
+        writer = BatchWriter(store, retry_delay=0.01)
+        for i in range(100):
+            writer.append(workflow_event("CI", i))
+        await writer.close()
+
+        assert (writer.stats()["retried"], writer.stats()["lost_events"]) == (0, 0)
+        assert len(store.recent(500)) == 100
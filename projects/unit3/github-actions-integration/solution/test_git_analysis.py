@@ -0,0 +1,1006 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the git helpers behind analyze_file_changes.
+These run against a real temporary git repository.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import zlib
+from collections import OrderedDict
+import pytest
+
+import git_analysis
+import git_cat_file
+import git_objects
+from git_analysis import (
+    AnalysisCache, SpooledDiff, run_git, stream_git_lines, analyze_changes,
+    get_diff_page, get_file_diffs, classify_path, analyze_many, ChildProcesses, run_with_timeout,
+    get_commit_page
+)
+from git_cat_file import CatFilePool, close_cat_file_pools, get_cat_file_pool
+from ref_watcher import BackgroundAnalysis
+import ast_summary
+from ast_summary import close_summary_workers, summarize_source_change
+
+
+def git(repo, *args):
+    """Run a git command in the test repository."""
+    subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+
+def make_repo(path):
+    """A repository with one commit on main and two on a feature branch."""
+    path.mkdir(exist_ok=True)
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "user.email", "test@example.com")
+    git(path, "config", "user.name", "Test")
+    (path / "app.py").write_text("def hello():\n    return 'hello'\n")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "Initial commit")
+
+    git(path, "checkout", "-q", "-b", "feature")
+    (path / "app.py").write_text("def hello():\n    return 'hello world'\n")
+    git(path, "commit", "-q", "-am", "fix: greet the world")
+    (path / "big.txt").write_text("".join(f"line {i}\n" for i in range(200)))
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "Add big file")
+    return path
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """A repository with one commit on main and two on a feature branch."""
+    return make_repo(tmp_path)
+
+
+class TestRunGit:
+    """Test the asyncio git runner."""
+
+    @pytest.mark.asyncio
+    async def test_returns_stdout(self, repo):
+        """Test that stdout is returned as text."""
+        output = await run_git(["rev-parse", "--abbrev-ref", "HEAD"], str(repo))
+        assert output.strip() == "feature"
+
+    @pytest.mark.asyncio
+    async def test_check_raises_on_failure(self, repo):
+        """Test that check=True surfaces git failures."""
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            await run_git(["diff", "no-such-branch...HEAD"], str(repo), check=True)
+        assert excinfo.value.stderr
+
+
+class TestChildProcesses:
+    """Test that git processes of cancelled calls are stopped."""
+
+    @pytest.fixture
+    def children(self, monkeypatch):
+        children = ChildProcesses(grace_seconds=0.5)
+        monkeypatch.setattr(git_analysis, "CHILD_PROCESSES", children)
+        return children
+
+    @pytest.fixture
+    def slow_git(self, tmp_path, monkeypatch):
+        """Put a git on PATH that just hangs."""
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "git").write_text("#!/bin/sh\nexec sleep 5\n")
+        (bin_dir / "git").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    async def wait_reaped(self, children):
+        for _ in range(100):
+            if not children.reaping:
+                return
+            await asyncio.sleep(0.02)
+        pytest.fail("process was not reaped")
+
+    @pytest.mark.asyncio
+    async def test_cancelled_git_is_terminated(self, tmp_path, children, slow_git):
+        """Test that cancelling a call terminates its git process."""
+        task = asyncio.create_task(run_git(["status"], str(tmp_path)))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await self.wait_reaped(children)
+
+        assert children.stats()["terminated"] == 1
+
+    @pytest.mark.asyncio
+    async def test_timeout(self, tmp_path, children, slow_git):
+        """Test that a timed out call reports an error and stops git."""
+        with pytest.raises(TimeoutError, match="timed out after 0.2 seconds"):
+            await run_with_timeout(run_git(["status"], str(tmp_path)), 0.2, "Slow git")
+        await self.wait_reaped(children)
+
+        assert children.stats()["timeouts"] == 1
+        assert children.stats()["terminated"] == 1
+
+    @pytest.mark.asyncio
+    async def test_kills_after_grace_period(self, children):
+        """Test that a process ignoring SIGTERM is killed."""
+        process = await asyncio.create_subprocess_exec("sh", "-c", "trap '' TERM; sleep 5")
+        await asyncio.sleep(0.1)
+        children.stop(process)
+        await self.wait_reaped(children)
+
+        assert process.returncode is not None
+        assert children.stats()["killed"] == 1
+
+
+class TestStreamGitLines:
+    """Test the streaming line reader."""
+
+    @pytest.mark.asyncio
+    async def test_counts_lines_past_cap(self, repo):
+        """Test that lines past the cap are counted but not kept."""
+        lines, total, truncated = await stream_git_lines(["show", "HEAD:big.txt"], str(repo), 10)
+
+        assert lines == [f"line {i}" for i in range(10)]
+        assert total == 200
+        assert truncated is True
+
+    @pytest.mark.asyncio
+    async def test_output_at_cap_is_not_truncated(self, repo):
+        """Test that output exactly as long as the cap is returned whole."""
+        lines, total, truncated = await stream_git_lines(["show", "HEAD:big.txt"], str(repo), 200)
+
+        assert len(lines) == 200
+        assert total == 200
+        assert truncated is False
+
+    @pytest.mark.asyncio
+    async def test_stops_early_without_exact_total(self, repo):
+        """Test that git is stopped once truncation is certain."""
+        lines, total, truncated = await stream_git_lines(
+            ["show", "HEAD:big.txt"], str(repo), 10, exact_total=False
+        )
+
+        assert len(lines) == 10
+        assert total is None
+        assert truncated is True
+
+
+class TestAnalyzeChanges:
+    """Test the combined analysis."""
+
+    @pytest.mark.asyncio
+    async def test_collects_all_sections(self, repo):
+        """Test that files, statistics, commits and diff are collected."""
+        analysis = await analyze_changes(str(repo), "main")
+
+        assert "M\tapp.py" in analysis["files_changed"]
+        assert "A\tbig.txt" in analysis["files_changed"]
+        assert "2 files changed" in analysis["statistics"]
+        assert "fix: greet the world" in analysis["commits"]
+        assert "+    return 'hello world'" in analysis["diff"]
+        assert analysis["truncated"] is False
+
+    @pytest.mark.asyncio
+    async def test_truncates_diff(self, repo):
+        """Test that the diff is cut at max_diff_lines."""
+        analysis = await analyze_changes(str(repo), "main", max_diff_lines=20)
+
+        assert analysis["truncated"] is True
+        assert analysis["total_diff_lines"] > 200
+        assert "Showing 20 of" in analysis["diff"]
+
+    @pytest.mark.asyncio
+    async def test_truncates_without_exact_total(self, repo):
+        """Test that the total is reported as unknown when git is stopped early."""
+        analysis = await analyze_changes(str(repo), "main", max_diff_lines=20, exact_total_lines=False)
+
+        assert analysis["truncated"] is True
+        assert analysis["total_diff_lines"] is None
+        assert "Showing 20 of more than 20 lines" in analysis["diff"]
+
+    @pytest.mark.asyncio
+    async def test_without_diff(self, repo):
+        """Test that the diff can be skipped."""
+        analysis = await analyze_changes(str(repo), "main", include_diff=False)
+
+        assert "Diff not included" in analysis["diff"]
+        assert analysis["total_diff_lines"] == 0
+
+
+class TestInProcessBackend:
+    """Test the pure-Python backend against the git command line."""
+
+    async def compare_backends(self, repo):
+        expected = await analyze_changes(str(repo), "main", backend="subprocess", use_cache=False)
+        actual = await analyze_changes(str(repo), "main", backend="inprocess", use_cache=False)
+
+        assert actual["backend"] == "inprocess"
+        for key in ("files_changed", "statistics", "commits", "total_diff_lines"):
+            assert actual[key] == expected[key], key
+        return actual
+
+    @pytest.mark.asyncio
+    async def test_matches_git_with_loose_objects(self, repo):
+        """Test that loose objects are read correctly."""
+        analysis = await self.compare_backends(repo)
+        assert "+    return 'hello world'" in analysis["diff"]
+
+    @pytest.mark.asyncio
+    async def test_matches_git_with_packfiles(self, repo):
+        """Test that packed and deltified objects are read correctly."""
+        (repo / "app.py").write_text("def hello():\n    return 'hello world!'\n")
+        git(repo, "commit", "-q", "-am", "Tweak greeting")
+        git(repo, "gc", "-q", "--aggressive")
+
+        analysis = await self.compare_backends(repo)
+        assert "+    return 'hello world!'" in analysis["diff"]
+
+    @pytest.mark.asyncio
+    async def test_merge_base_of_diverged_branches(self, repo):
+        """Test that the diff starts at the merge base, not at the tip of main."""
+        git(repo, "checkout", "-q", "main")
+        (repo / "other.py").write_text("x = 1\n")
+        git(repo, "add", ".")
+        git(repo, "commit", "-q", "-m", "Work on main")
+        git(repo, "checkout", "-q", "feature")
+
+        analysis = await self.compare_backends(repo)
+        assert "other.py" not in analysis["files_changed"]
+
+    @pytest.mark.asyncio
+    async def test_detects_exact_renames(self, repo):
+        """Test that moved files are reported as renames."""
+        git(repo, "mv", "big.txt", "moved.txt")
+        git(repo, "commit", "-q", "-m", "Move big file")
+        git(repo, "commit", "-q", "--allow-empty", "-m", "Empty commit")
+
+        await self.compare_backends(repo)
+
+    @pytest.mark.asyncio
+    async def test_structured_output_matches_git(self, repo):
+        """Test that both backends report the same structured file list."""
+        git(repo, "mv", "big.txt", "moved.txt")
+        (repo / "logo.png").write_bytes(b"\x89PNG\0\0data")
+        git(repo, "add", ".")
+        git(repo, "commit", "-q", "-m", "Move big file and add a logo")
+
+        expected = await analyze_changes(str(repo), "main", backend="subprocess", use_cache=False, structured=True)
+        actual = await analyze_changes(str(repo), "main", backend="inprocess", use_cache=False, structured=True)
+
+        by_path = {f["path"]: f for f in expected["files"]}
+        assert by_path["app.py"] == {"path": "app.py", "status": "M", "additions": 1, "deletions": 1, "binary": False}
+        assert by_path["logo.png"]["binary"] is True
+        assert "files_changed" not in expected
+        assert expected["totals"] == {"files": 3, "additions": 201, "deletions": 1}
+        assert sorted(actual["files"], key=lambda f: f["path"]) == sorted(expected["files"], key=lambda f: f["path"])
+
+    @pytest.mark.asyncio
+    async def test_counts_match_git_shortest_edit(self, repo):
+        """Test a change where difflib's longest-match alignment takes more lines than git."""
+        git(repo, "checkout", "-q", "main")
+        (repo / "letters.txt").write_text("b\na\nb\n")
+        git(repo, "add", ".")
+        git(repo, "commit", "-q", "-m", "Add letters")
+        git(repo, "checkout", "-q", "feature")
+        git(repo, "rebase", "-q", "main")
+        (repo / "letters.txt").write_text("a\nc\nb\n")
+        git(repo, "commit", "-q", "-am", "Edit letters")
+
+        analysis = await self.compare_backends(repo)
+        assert "-b\n a\n+c\n b" in analysis["diff"]
+
+    @pytest.mark.asyncio
+    async def test_branch_without_commits(self, repo):
+        """Test that a branch still at its base has no commits of its own."""
+        git(repo, "checkout", "-q", "-b", "fresh", "main")
+
+        analysis = await self.compare_backends(repo)
+        assert analysis["commits"] == "" and analysis["total_commits"] == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_analyses_share_repository(self, repo, monkeypatch):
+        """Test that analyses in parallel threads can share one repository's object cache."""
+        monkeypatch.setattr(git_objects, "OBJECT_CACHE_SIZE", 2)
+        expected = await analyze_changes(str(repo), "main", backend="subprocess", use_cache=False)
+
+        results = await asyncio.gather(*(
+            analyze_changes(str(repo), "main", backend="inprocess", use_cache=False) for _ in range(8)
+        ))
+        assert {r["backend"] for r in results} == {"inprocess"}
+        assert {r["statistics"] for r in results} == {expected["statistics"]}
+
+    @pytest.mark.asyncio
+    async def test_corrupt_object_falls_back(self, repo, monkeypatch):
+        """Test that a parse error in an object is reported like any unsupported case."""
+        def corrupt(self, sha):
+            raise zlib.error("Error -3 while decompressing data: incorrect header check")
+        monkeypatch.setattr(git_objects.Repository, "tree", corrupt)
+
+        analysis = await analyze_changes(str(repo), "main", backend="inprocess", use_cache=False)
+        assert analysis["backend"] == "subprocess"
+        assert "M\tapp.py" in analysis["files_changed"]
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_subprocess(self, repo):
+        """Test that unsupported revisions fall back to the git command line."""
+        analysis = await analyze_changes(str(repo), "HEAD~2", backend="inprocess")
+
+        assert analysis["backend"] == "subprocess"
+        assert "A\tbig.txt" in analysis["files_changed"]
+
+    @pytest.mark.asyncio
+    async def test_falls_back_for_diffs_git_computes_differently(self, repo):
+        """Test that heavy rewrites and possible renames with edits are left to git."""
+        (repo / "app.py").write_text("".join(f"step_{i} = {i}\n" for i in range(300)))
+        git(repo, "commit", "-q", "-am", "Rewrite app")
+        rewritten = await analyze_changes(str(repo), "main", backend="inprocess", use_cache=False)
+        assert rewritten["backend"] == "subprocess"
+
+        git(repo, "reset", "-q", "--hard", "HEAD~1")
+        git(repo, "mv", "app.py", "greeting.py")
+        (repo / "greeting.py").write_text("def hello():\n    return 'hello'\n\nprint(hello())\n")
+        git(repo, "commit", "-q", "-am", "Rename and extend app")
+        renamed = await analyze_changes(str(repo), "main", backend="inprocess", use_cache=False)
+        assert renamed["backend"] == "subprocess"
+        assert "app.py => greeting.py" in renamed["statistics"]
+
+
+class TestStructuredOutput:
+    """Test parsing of git diff --raw --numstat -z."""
+
+    def test_parses_renames_and_binaries(self):
+        """Test that renames keep their source path and binaries are flagged."""
+        output = (
+            ":000000 100644 0000000 d5d0b8b A\0bin.dat\0"
+            ":100644 100644 187597d 11768db R099\0big.txt\0huge.txt\0"
+            "-\t-\tbin.dat\0"
+            "1\t0\t\0big.txt\0huge.txt\0"
+        )
+        assert git_analysis.parse_raw_numstat(output) == [
+            {"path": "bin.dat", "status": "A", "additions": 0, "deletions": 0, "binary": True},
+            {"path": "huge.txt", "status": "R", "additions": 1, "deletions": 0, "binary": False,
+             "old_path": "big.txt"}
+        ]
+
+
+class TestCommitHistory:
+    """Test the commit cap, paging and full format."""
+
+    @pytest.mark.asyncio
+    async def test_caps_commits_and_pages(self, repo):
+        """Test that older commits are counted and reachable through the cursor."""
+        analysis = await analyze_changes(str(repo), "main", max_commits=1, use_cache=False)
+
+        assert analysis["commits"].endswith(" Add big file\n")
+        assert analysis["total_commits"] == 2
+
+        # A new commit on the branch must not shift the pinned pages
+        (repo / "app.py").write_text("def hello():\n    return 'hi'\n")
+        git(repo, "commit", "-q", "-am", "Later commit")
+        page = await get_commit_page(analysis["commits_cursor"], max_commits=5)
+
+        assert page["commits"].endswith(" fix: greet the world\n")
+        assert (page["start"], page["end"], page["total_commits"]) == (1, 2, 2)
+        assert page["commits_cursor"] is None
+
+    @pytest.mark.asyncio
+    async def test_no_cursor_when_all_commits_fit(self, repo):
+        """Test that short histories need no cursor."""
+        analysis = await analyze_changes(str(repo), "main", use_cache=False)
+
+        assert len(analysis["commits"].splitlines()) == 2
+        assert analysis["commits_cursor"] is None
+
+    @pytest.mark.asyncio
+    async def test_full_format_matches_between_backends(self, repo):
+        """Test that author, timestamp and files come out the same from both backends."""
+        expected = await analyze_changes(str(repo), "main", backend="subprocess", use_cache=False,
+                                         commit_format="full")
+        actual = await analyze_changes(str(repo), "main", backend="inprocess", use_cache=False,
+                                       commit_format="full")
+
+        newest = expected["commits"][0]
+        assert newest["author"] == "Test <test@example.com>"
+        assert newest["files"] == ["big.txt"]
+        assert newest["subject"] == "Add big file"
+        assert actual["commits"] == expected["commits"]
+
+    @pytest.mark.asyncio
+    async def test_tampered_cursor(self, repo, tmp_path_factory):
+        """Test that a cursor is rejected unless it names full SHAs and a directory analyzed here."""
+        analysis = await analyze_changes(str(repo), "main", max_commits=1, use_cache=False)
+        state = json.loads(base64.urlsafe_b64decode(analysis["commits_cursor"]))
+
+        for tampered in (
+            {"base": "--output=/tmp/owned"},
+            {"head": "HEAD"},
+            {"cwd": str(tmp_path_factory.mktemp("elsewhere"))},
+            {"cwd": ["not", "a", "path"]}
+        ):
+            cursor = base64.urlsafe_b64encode(json.dumps({**state, **tampered}).encode()).decode()
+            with pytest.raises(ValueError, match="Invalid commits cursor"):
+                await get_commit_page(cursor)
+
+    def test_invalid_cursor(self):
+        """Test that a garbled cursor is rejected."""
+        with pytest.raises(ValueError):
+            asyncio.run(get_commit_page("not-a-cursor"))
+
+
+class TestDiffModes:
+    """Test the context-reduced diff modes."""
+
+    @pytest.fixture
+    def function_repo(self, repo):
+        """A branch that changes one line in the middle of a long function."""
+        body = "".join(f"    step_{i}()\n" for i in range(20))
+        (repo / "app.py").write_text(f"def hello():\n{body}    return 'hello'\n\n\ndef other():\n    pass\n")
+        git(repo, "commit", "-q", "-am", "Long function")
+        (repo / "app.py").write_text(
+            f"def hello():\n{body.replace('step_10', 'step_ten')}    return 'hello'\n\n\ndef other():\n    pass\n"
+        )
+        git(repo, "commit", "-q", "-am", "Rename a step")
+        return repo
+
+    @pytest.mark.asyncio
+    async def test_minimal_reports_savings(self, function_repo):
+        """Test that zero context is smaller than the default and says by how much."""
+        analysis = await analyze_changes(str(function_repo), "HEAD~1", diff_mode="minimal", use_cache=False)
+
+        savings = analysis["diff_savings"]
+        assert "    step_9()" not in analysis["diff"]
+        assert "+    step_ten()" in analysis["diff"]
+        assert savings["saved_lines"] == 6
+        assert savings["saved_bytes"] == savings["default_bytes"] - savings["bytes"] > 0
+
+    @pytest.mark.asyncio
+    async def test_function_context_shows_whole_function(self, function_repo):
+        """Test that a hunk covers its enclosing function."""
+        analysis = await analyze_changes(str(function_repo), "HEAD~1", diff_mode="function", use_cache=False)
+
+        assert " def hello():" in analysis["diff"]
+        assert "     return 'hello'" in analysis["diff"]
+        assert analysis["diff_savings"]["saved_lines"] < 0
+
+    @pytest.mark.asyncio
+    async def test_word_diff(self, function_repo):
+        """Test that word diffs mark changed words inline."""
+        analysis = await analyze_changes(str(function_repo), "HEAD~1", diff_mode="word", use_cache=False)
+
+        assert "[-step_10()-]{+step_ten()+}" in analysis["diff"]
+
+    @pytest.mark.asyncio
+    async def test_inprocess_minimal_matches_git(self, function_repo):
+        """Test that the in-process backend produces the same zero-context diff."""
+        git(function_repo, "branch", "long-function", "HEAD~1")
+        expected = await analyze_changes(str(function_repo), "long-function", diff_mode="minimal",
+                                         backend="subprocess", use_cache=False)
+        actual = await analyze_changes(str(function_repo), "long-function", diff_mode="minimal",
+                                       backend="inprocess", use_cache=False)
+
+        assert actual["backend"] == "inprocess"
+        assert actual["diff"] == expected["diff"]
+        assert actual["diff_savings"] == expected["diff_savings"]
+
+    @pytest.mark.asyncio
+    async def test_default_mode_is_not_measured(self, repo):
+        """Test that the default diff runs no extra git command."""
+        analysis = await analyze_changes(str(repo), "main", use_cache=False)
+
+        assert "diff_savings" not in analysis
+
+
+class TestPythonSummary:
+    """Test semantic summaries of changed Python files."""
+
+    def test_summarizes_definitions(self):
+        """Test added, removed and modified definitions, signatures and decorators."""
+        old = (
+            "class Server:\n"
+            "    def start(self):\n        pass\n\n"
+            "    def stop(self):\n        pass\n\n"
+            "def helper(x):\n    return x\n"
+        )
+        new = (
+            "class Server:\n"
+            "    def start(self, port: int = 80) -> None:\n        pass\n\n"
+            "@mcp.tool()\nasync def analyze():\n    return 1\n\n"
+            "def helper(x):\n    return x + 1\n"
+        )
+        summary = summarize_source_change("server.py", "M", old, new)
+
+        assert summary["added"] == ["analyze"]
+        assert summary["removed"] == ["Server.stop"]
+        assert summary["modified"] == ["Server.start", "helper"]
+        assert summary["signature_changes"] == [{
+            "name": "Server.start",
+            "old": "def start(self)",
+            "new": "def start(self, port: int=80) -> None"
+        }]
+        assert summary["decorators_added"] == [{"name": "analyze", "decorator": "mcp.tool()"}]
+        assert "decorators_removed" not in summary
+
+    def test_reports_syntax_errors(self):
+        """Test that unparsable files are flagged rather than summarized."""
+        summary = summarize_source_change("broken.py", "M", "x = 1\n", "def (:\n")
+
+        assert summary["error"].startswith("SyntaxError")
+
+    def test_reports_unparsable_source(self):
+        """Test that NUL bytes and deep nesting are flagged like syntax errors."""
+        nul = summarize_source_change("nul.py", "M", "x = 1\n", "x = 1\0\n")
+        nested = summarize_source_change("deep.py", "A", None, "x = " + "1 + " * 100000 + "1\n")
+
+        # A ValueError or a SyntaxError, depending on the Python version
+        assert "null bytes" in nul["error"]
+        assert nested["error"].startswith("RecursionError")
+        assert "added" not in nested
+
+    @pytest.mark.asyncio
+    async def test_workers_are_stopped(self, repo):
+        """Test that the parsing processes are shut down and restarted on demand."""
+        await analyze_changes(str(repo), "main", python_summary=True, use_cache=False)
+        executor = ast_summary._executor
+        await close_summary_workers()
+
+        assert ast_summary._executor is None and not executor._processes
+        analysis = await analyze_changes(str(repo), "main", python_summary=True, use_cache=False)
+        assert analysis["python_changes"][0]["modified"] == ["hello"]
+        await close_summary_workers()
+
+    @pytest.mark.asyncio
+    async def test_replaces_python_hunks(self, repo):
+        """Test that .py hunks give way to a summary while other files keep theirs."""
+        analysis = await analyze_changes(str(repo), "main", python_summary=True, use_cache=False)
+
+        assert analysis["python_changes"] == [{"path": "app.py", "status": "M", "modified": ["hello"]}]
+        assert "app.py" not in analysis["diff"]
+        assert "+line 0" in analysis["diff"]
+        assert get_file_diffs(analysis["diff_id"], ["app.py"])["files"] == ["app.py"]
+
+
+class TestAnalysisCache:
+    """Test the LRU result cache."""
+
+    @pytest.fixture(autouse=True)
+    def fresh_cache(self, monkeypatch):
+        monkeypatch.setattr(git_analysis, "ANALYSIS_CACHE", AnalysisCache(max_entries=2))
+
+    @pytest.mark.asyncio
+    async def test_hit_until_head_moves(self, repo):
+        """Test that repeated calls hit the cache until HEAD changes."""
+        first = await analyze_changes(str(repo), "main")
+        second = await analyze_changes(str(repo), "main")
+
+        assert first["cache_hit"] is False
+        assert second["cache_hit"] is True
+        assert second["diff"] == first["diff"]
+
+        git(repo, "commit", "-q", "--allow-empty", "-m", "Move HEAD")
+        third = await analyze_changes(str(repo), "main")
+        assert third["cache_hit"] is False
+        assert "Move HEAD" in third["commits"]
+
+        stats = git_analysis.ANALYSIS_CACHE.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 2)
+
+    @pytest.mark.asyncio
+    async def test_arguments_are_part_of_key(self, repo):
+        """Test that different arguments are cached separately."""
+        await analyze_changes(str(repo), "main", max_diff_lines=10)
+        other = await analyze_changes(str(repo), "main", max_diff_lines=20)
+
+        assert other["cache_hit"] is False
+        assert "Showing 20 of" in other["diff"]
+
+    @pytest.mark.asyncio
+    async def test_repository_path_with_spaces(self, tmp_path):
+        """Test that the cache key lookup handles a git dir containing spaces."""
+        repo = make_repo(tmp_path / "sp ace")
+        first = await analyze_changes(str(repo), "main", backend="subprocess")
+        second = await analyze_changes(str(repo), "main", backend="subprocess")
+
+        assert "error" not in first
+        assert (first["cache_hit"], second["cache_hit"]) == (False, True)
+        assert "greet the world" in first["commits"]
+
+    def test_evicts_least_recently_used(self):
+        """Test the entry limit."""
+        cache = AnalysisCache(max_entries=2)
+        cache.put(("a",), {"v": 1})
+        cache.put(("b",), {"v": 2})
+        cache.get(("a",))
+        cache.put(("c",), {"v": 3})
+
+        assert cache.get(("b",)) is None
+        assert cache.get(("a",)) == {"v": 1}
+        assert cache.stats()["evictions"] == 1
+
+    def test_respects_byte_limit(self):
+        """Test the size limit."""
+        cache = AnalysisCache(max_entries=10, max_bytes=100)
+        cache.put(("a",), {"v": "x" * 60})
+        cache.put(("b",), {"v": "y" * 60})
+
+        assert cache.get(("a",)) is None
+        assert cache.stats()["size_bytes"] <= 100
+
+
+class TestDiffPagination:
+    """Test cursor-based paging over spooled diffs."""
+
+    @pytest.mark.asyncio
+    async def test_pages_cover_the_whole_diff(self, repo):
+        """Test that following cursors returns exactly the full diff."""
+        full = await analyze_changes(str(repo), "main", max_diff_lines=10 ** 6, use_cache=False)
+        first = await analyze_changes(str(repo), "main", max_diff_lines=20, use_cache=False)
+
+        lines = first["diff"].split("\n")[:20]
+        cursor = first["next_cursor"]
+        while cursor:
+            page = get_diff_page(cursor, max_lines=50)
+            assert len(page["diff"].splitlines()) <= 50
+            lines += page["diff"].splitlines()
+            cursor = page["next_cursor"]
+
+        assert "\n".join(lines) + "\n" == full["diff"]
+        assert page["total_diff_lines"] == full["total_diff_lines"]
+
+    @pytest.mark.asyncio
+    async def test_pages_from_inprocess_backend(self, repo):
+        """Test that the in-process backend spools its patch too."""
+        first = await analyze_changes(str(repo), "main", max_diff_lines=5, backend="inprocess", use_cache=False)
+        page = get_diff_page(first["next_cursor"], max_lines=3)
+
+        assert page["start_line"] == 5
+        assert page["end_line"] == 8
+
+    @pytest.mark.asyncio
+    async def test_no_cursor_without_truncation(self, repo):
+        """Test that complete diffs carry no cursor."""
+        analysis = await analyze_changes(str(repo), "main", use_cache=False)
+        assert analysis["next_cursor"] is None
+
+    def test_unknown_cursor(self):
+        """Test that stale cursors are rejected."""
+        with pytest.raises(ValueError):
+            get_diff_page("missing:10")
+
+    def test_spool_index_across_strides(self):
+        """Test reading pages that start in the middle of an index stride."""
+        spool = SpooledDiff()
+        spool.write_lines(f"line {i}" for i in range(1000))
+
+        assert spool.read_lines(0, 2) == ["line 0", "line 1"]
+        assert spool.read_lines(300, 2) == ["line 300", "line 301"]
+        assert spool.read_lines(998, 5) == ["line 998", "line 999"]
+
+
+class TestFileDiffIndex:
+    """Test selective retrieval of files and hunks from a spooled diff."""
+
+    @pytest.fixture
+    def multi_hunk_repo(self, repo):
+        # Two separate edits in big.txt give it two hunks
+        lines = [f"line {i}\n" for i in range(200)]
+        lines[10] = "changed 10\n"
+        lines[150] = "changed 150\n"
+        (repo / "big.txt").write_text("".join(lines))
+        git(repo, "commit", "-q", "-am", "Edit big file")
+        git(repo, "checkout", "-q", "-b", "review")
+        return repo
+
+    @pytest.mark.asyncio
+    async def test_lists_index_without_paths(self, repo):
+        """Test that the index lists every file with its hunks."""
+        analysis = await analyze_changes(str(repo), "main", max_diff_lines=5, use_cache=False)
+        index = get_file_diffs(analysis["diff_id"])
+
+        by_path = {f["path"]: f for f in index["files"]}
+        assert set(by_path) == {"app.py", "big.txt"}
+        assert by_path["app.py"]["hunks"] == ["@@ -1,2 +1,2 @@"]
+        assert sum(f["lines"] for f in index["files"]) == analysis["total_diff_lines"]
+
+    @pytest.mark.asyncio
+    async def test_returns_selected_file(self, repo):
+        """Test that one file's diff is returned even when the full diff was truncated."""
+        analysis = await analyze_changes(str(repo), "main", max_diff_lines=5, use_cache=False)
+        result = get_file_diffs(analysis["diff_id"], ["app.py", "missing.py"])
+
+        assert result["files"] == ["app.py"]
+        assert result["not_found"] == ["missing.py"]
+        assert result["diff"].startswith("diff --git a/app.py b/app.py")
+        assert "big.txt" not in result["diff"]
+
+    @pytest.mark.asyncio
+    async def test_returns_selected_hunk(self, multi_hunk_repo):
+        """Test that a single hunk is returned with its file header."""
+        analysis = await analyze_changes(str(multi_hunk_repo), "HEAD~1", use_cache=False)
+        result = get_file_diffs(analysis["diff_id"], ["big.txt"], {"big.txt": [2]})
+
+        assert "+++ b/big.txt" in result["diff"]
+        assert "+changed 150" in result["diff"]
+        assert "changed 10" not in result["diff"]
+
+    @pytest.mark.asyncio
+    async def test_paths_git_quotes(self, repo):
+        """Test that files with non-ASCII or special characters in their names are found by name."""
+        (repo / "café.py").write_text("x = 1\n")
+        (repo / 'say "hi".txt').write_text("hi\n")
+        git(repo, "add", ".")
+        git(repo, "commit", "-q", "-m", "Add files with quoted names")
+
+        analysis = await analyze_changes(str(repo), "main", backend="subprocess", python_summary=True,
+                                         use_cache=False)
+        assert "café.py" in [change["path"] for change in analysis["python_changes"]]
+        result = get_file_diffs(analysis["diff_id"], ["café.py", 'say "hi".txt'])
+        assert result["files"] == ["café.py", 'say "hi".txt']
+        assert "+x = 1" in result["diff"] and "+hi" in result["diff"]
+
+
+class TestTokenBudget:
+    """Test token-budgeted diffs."""
+
+    @pytest.fixture
+    def mixed_repo(self, repo):
+        """The feature branch plus a test file and a lockfile."""
+        (repo / "test_app.py").write_text("def test_hello():\n    assert True\n")
+        (repo / "uv.lock").write_text("".join(f"pin = {i}\n" for i in range(300)))
+        git(repo, "add", ".")
+        git(repo, "commit", "-q", "-m", "Add tests and lockfile")
+        return repo
+
+    def test_classify_path(self):
+        """Test that paths are sorted into review categories."""
+        assert classify_path("src/server.py") == "source"
+        assert classify_path("tests/helpers.py") == "test"
+        assert classify_path("test_server.py") == "test"
+        assert classify_path("README.md") == "docs"
+        assert classify_path("uv.lock") == "lockfile"
+        assert classify_path("static/app.min.js") == "generated"
+        assert classify_path("vendor/lib/util.go") == "vendored"
+
+    @pytest.mark.asyncio
+    async def test_collapses_lockfiles(self, mixed_repo):
+        """Test that lockfile hunks become a one-line summary."""
+        analysis = await analyze_changes(str(mixed_repo), "main", max_tokens=10000, use_cache=False)
+
+        budget = analysis["token_budget"]
+        assert budget["collapsed_files"] == ["uv.lock"]
+        assert "lockfile diff collapsed (+300 -0 lines)" in analysis["diff"]
+        assert "pin = 5" not in analysis["diff"]
+        assert set(budget["included_files"]) == {"app.py", "test_app.py", "big.txt"}
+        assert analysis["truncated"] is False
+
+    @pytest.mark.asyncio
+    async def test_ranks_source_before_tests(self, mixed_repo):
+        """Test that a tight budget keeps source files and drops the rest."""
+        analysis = await analyze_changes(str(mixed_repo), "main", max_tokens=60, use_cache=False)
+
+        budget = analysis["token_budget"]
+        assert budget["included_files"] == ["app.py"]
+        assert "test_app.py" in budget["omitted_files"]
+        assert budget["used_tokens"] <= 60
+        assert analysis["truncated"] is True
+        assert analysis["next_cursor"] is None
+        assert get_file_diffs(analysis["diff_id"], ["test_app.py"])["files"] == ["test_app.py"]
+
+    @pytest.mark.asyncio
+    async def test_fills_with_whole_hunks(self, mixed_repo):
+        """Test that a file too large for the budget contributes the hunks that fit."""
+        lines = [f"line {i}\n" for i in range(200)]
+        lines[10] = "changed 10\n"
+        lines[150] = "changed 150\n"
+        (mixed_repo / "big.txt").write_text("".join(lines))
+        git(mixed_repo, "commit", "-q", "-am", "Edit big file")
+        analysis = await analyze_changes(str(mixed_repo), "HEAD~1", max_tokens=50, use_cache=False)
+
+        assert analysis["token_budget"]["partial_files"] == ["big.txt"]
+        assert "+changed 10" in analysis["diff"]
+        assert "1 of 2 hunks omitted" in analysis["diff"]
+
+
+class TestCatFilePool:
+    """Test the persistent git cat-file workers."""
+
+    @pytest.mark.asyncio
+    async def test_reads_objects(self, repo):
+        """Test that contents, sizes and missing objects are reported."""
+        pool = CatFilePool(str(repo))
+        try:
+            blob = await pool.read("HEAD:app.py")
+            info = await pool.info("HEAD:big.txt")
+            missing = await pool.read("HEAD:missing.py")
+        finally:
+            await pool.close()
+
+        assert blob.type == "blob"
+        assert blob.data == b"def hello():\n    return 'hello world'\n"
+        assert info.size == len("".join(f"line {i}\n" for i in range(200)))
+        assert info.data is None
+        assert missing is None
+
+    @pytest.mark.asyncio
+    async def test_pipelines_requests(self, repo):
+        """Test that concurrent requests reuse the same processes."""
+        pool = CatFilePool(str(repo), size=2)
+        try:
+            specs = ["HEAD:app.py", "main:app.py", "HEAD:big.txt"] * 20
+            objects = await pool.read_many(specs)
+            stats = pool.stats()
+        finally:
+            await pool.close()
+
+        assert [obj.data.startswith(b"def hello") for obj in objects[:2]] == [True, True]
+        assert objects[1].data == b"def hello():\n    return 'hello'\n"
+        assert stats["requests"] == 60
+        assert stats["workers"] == 2
+        assert stats["restarts"] == 0
+
+    @pytest.mark.asyncio
+    async def test_restarts_crashed_worker(self, repo):
+        """Test that a killed worker is replaced on the next request."""
+        pool = CatFilePool(str(repo), size=1)
+        try:
+            await pool.read("HEAD:app.py")
+            worker = pool.workers[0]
+            worker.process.kill()
+            await worker.process.wait()
+
+            blob = await pool.read("HEAD:app.py")
+            assert blob.data.startswith(b"def hello")
+            assert pool.stats()["restarts"] == 1
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_pool_is_shared_per_repository(self, repo):
+        """Test that tool calls in one repository share a pool."""
+        pool = get_cat_file_pool(str(repo))
+        try:
+            assert get_cat_file_pool(str(repo / ".")) is pool
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_idle_pool_stops_its_processes(self, repo):
+        """Test that an idle pool closes its workers and starts them again when used."""
+        pool = CatFilePool(str(repo), size=1, idle_seconds=0.1)
+        try:
+            await pool.read("HEAD:app.py")
+            assert pool.stats()["workers"] == 1
+            await asyncio.sleep(0.3)
+            assert pool.stats()["workers"] == 0
+            assert pool.stats()["idle_closes"] == 1
+
+            blob = await pool.read("HEAD:app.py")
+            assert blob.data.startswith(b"def hello")
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_pool_is_evicted(self, repo, tmp_path, monkeypatch):
+        """Test that pools beyond the repository cap are closed, oldest first."""
+        monkeypatch.setattr(git_cat_file, "_POOLS", OrderedDict())
+        monkeypatch.setattr(git_cat_file, "MAX_POOLS", 2)
+        first = get_cat_file_pool(str(repo))
+        await first.read("HEAD:app.py")
+        second = get_cat_file_pool(str(tmp_path / "a"))
+        get_cat_file_pool(str(repo))
+        get_cat_file_pool(str(tmp_path / "b"))
+
+        assert list(git_cat_file._POOLS.values())[0] is first
+        assert second not in git_cat_file._POOLS.values()
+        await close_cat_file_pools()
+        assert first.stats()["workers"] == 0
+
+
+class TestBackgroundAnalysis:
+    """Test precomputing analyses when refs move."""
+
+    async def commit_and_wait(self, repo, background):
+        """Commit on the watched branch and wait for the background run."""
+        (repo / "app.py").write_text("def hello():\n    return 'hi'\n")
+        git(repo, "commit", "-q", "-am", "Shorter greeting")
+        for _ in range(100):
+            if background.runs:
+                return
+            await asyncio.sleep(0.05)
+        pytest.fail("analysis was not recomputed")
+
+    @pytest.mark.parametrize("use_inotify", [True, False])
+    @pytest.mark.asyncio
+    async def test_new_commit_is_precomputed(self, repo, use_inotify):
+        """Test that the first call after a commit is served from the cache."""
+        background = BackgroundAnalysis(poll_interval=0.05, debounce=0.01, use_inotify=use_inotify)
+        git_analysis.ANALYSIS_CACHE.clear()
+        try:
+            await background.watch(str(repo), base_branch="main")
+            await self.commit_and_wait(repo, background)
+            analysis = await analyze_changes(str(repo), "main")
+        finally:
+            background.stop()
+
+        assert analysis["cache_hit"] is True
+        assert "+    return 'hi'" in analysis["diff"]
+        assert background.stats()["failures"] == 0
+
+    @pytest.mark.asyncio
+    async def test_disabled(self, repo):
+        """Test that nothing is watched when precomputation is off."""
+        background = BackgroundAnalysis(enabled=False)
+        await background.watch(str(repo), base_branch="main")
+
+        assert background.stats()["repositories"] == 0
+
+    @pytest.mark.asyncio
+    async def test_watches_are_capped_and_expire(self, tmp_path):
+        """Test that the least recently analyzed repository is dropped, and idle ones expire."""
+        repos = [str(make_repo(tmp_path / name)) for name in ("a", "b", "c")]
+        background = BackgroundAnalysis(use_inotify=False, max_repositories=2, idle_seconds=0.3)
+        try:
+            await background.watch(repos[0], base_branch="main")
+            await background.watch(repos[1], base_branch="main")
+            await background.watch(repos[0], base_branch="main")
+            await background.watch(repos[2], base_branch="main")
+            assert list(background.watchers) == [repos[0], repos[2]]
+            assert background.stats()["evictions"] == 1
+
+            await asyncio.sleep(0.5)
+            assert background.stats()["repositories"] == 0
+            assert background.stats()["evictions"] == 3
+        finally:
+            background.stop()
+
+    @pytest.mark.asyncio
+    async def test_watch_failures_are_counted(self, tmp_path):
+        """Test that a directory outside any repository is counted, not raised."""
+        background = BackgroundAnalysis(use_inotify=False)
+        await background.watch(str(tmp_path), base_branch="main")
+
+        assert background.stats()["repositories"] == 0
+        assert background.stats()["watch_failures"] == 1
+
+
+class TestAnalyzeMany:
+    """Test analyzing several repositories at once."""
+
+    @pytest.mark.asyncio
+    async def test_yields_every_repository(self, repo, tmp_path_factory):
+        """Test that each repository gets an analysis or an error."""
+        not_a_repo = tmp_path_factory.mktemp("plain")
+        repositories = [
+            {"working_directory": str(repo)},
+            {"working_directory": str(repo), "base_branch": "HEAD~1"},
+            {"working_directory": str(not_a_repo)}
+        ]
+        entries = [entry async for entry in analyze_many(repositories, 2, use_cache=False)]
+
+        by_base = {(e["working_directory"], e["base_branch"]): e for e in entries}
+        assert "big.txt" in by_base[(str(repo), "main")]["analysis"]["files_changed"]
+        assert "app.py" not in by_base[(str(repo), "HEAD~1")]["analysis"]["files_changed"]
+        assert "error" in by_base[(str(not_a_repo), "main")]
+
+    @pytest.mark.asyncio
+    async def test_respects_concurrency_cap(self, repo, monkeypatch):
+        """Test that no more than max_concurrency analyses run at once."""
+        running = peak = 0
+        real_analyze = git_analysis.analyze_changes
+
+        async def tracking_analyze(*args, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            try:
+                await asyncio.sleep(0.01)
+                return await real_analyze(*args, **kwargs)
+            finally:
+                running -= 1
+
+        monkeypatch.setattr(git_analysis, "analyze_changes", tracking_analyze)
+        repositories = [{"working_directory": str(repo)}] * 6
+        entries = [entry async for entry in analyze_many(repositories, 2)]
+
+        assert len(entries) == 6
+        assert peak == 2
@@ -1,16 +1,17 @@
 #!/usr/bin/env python3
 """
 Simple webhook server for GitHub Actions events.
-Stores events in a JSON file that the MCP server can read.
+Stores events in a JSON Lines log or SQLite database that the MCP server can read.
+The MCP server can also serve the same route itself (EMBEDDED_WEBHOOK_PORT).
 """
 
-import json
 from datetime import datetime
-from pathlib import Path
 from aiohttp import web
 
-# File to store events
-EVENTS_FILE = Path(__file__).parent / "github_events.json"
+from event_store import BatchWriter, open_event_store
+
+# Where the application's handler stores events
+EVENT_STORE_KEY = web.AppKey("event_store", object)
 
 async def handle_webhook(request):
     """Handle incoming GitHub webhook"""
@@ -21,6 +22,8 @@ async def handle_webhook(request):
         event = {
             "timestamp": datetime.utcnow().isoformat(),
             "event_type": request.headers.get("X-GitHub-Event", "unknown"),
+            # Lets a delivery the writer had to drop be redelivered from GitHub
+            "delivery_id": request.headers.get("X-GitHub-Delivery"),
             "action": data.get("action"),
             "workflow_run": data.get("workflow_run"),
             "check_run": data.get("check_run"),
@@ -28,30 +31,40 @@ async def handle_webhook(request):
             "sender": data.get("sender", {}).get("login")
         }
         
-        # Load existing events
-        events = []
-        if EVENTS_FILE.exists():
-            with open(EVENTS_FILE, 'r') as f:
-                events = json.load(f)
-        
-        # Add new event and keep last 100
-        events.append(event)
-        events = events[-100:]
-        
-        # Save events
-        with open(EVENTS_FILE, 'w') as f:
-            json.dump(events, f, indent=2)
+        # Queue the event; it is written with others in the next group commit
+        request.app[EVENT_STORE_KEY].append(event)
         
         return web.json_response({"status": "received"})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=400)
 
-# Create app and add route
-app = web.Application()
-app.router.add_post('/webhook/github', handle_webhook)
+async def handle_stats(request):
+    """Report the event writer's batch sizes and flush times"""
+    return web.json_response(request.app[EVENT_STORE_KEY].stats())
+
+async def start_event_store(app):
+    app[EVENT_STORE_KEY].start()
+
+async def close_event_store(app):
+    # Write the events still queued
+    await app[EVENT_STORE_KEY].close()
+
+def create_app(event_store) -> web.Application:
+    """Create the app and add the routes, storing events in event_store (a BatchWriter or EventRingBuffer)"""
+    app = web.Application()
+    app[EVENT_STORE_KEY] = event_store
+    app.on_startup.append(start_event_store)
+    app.on_cleanup.append(close_event_store)
+    app.router.add_post('/webhook/github', handle_webhook)
+    app.router.add_get('/webhook/stats', handle_stats)
+    return app
 
 if __name__ == '__main__':
+    # Where events are stored: JSON Lines log or SQLite (WEBHOOK_EVENT_STORE), in group commits
+    event_store = BatchWriter(open_event_store())
+    app = create_app(event_store)
     print("🚀 Starting webhook server on http://localhost:8080")
-    print("📝 Events will be saved to:", EVENTS_FILE)
+    print("📝 Events will be saved to:", event_store.path)
     print("🔗 Webhook URL: http://localhost:8080/webhook/github")
+    print("📊 Writer stats: http://localhost:8080/webhook/stats")
     web.run_app(app, host='localhost', port=8080)
\ No newline at end of file
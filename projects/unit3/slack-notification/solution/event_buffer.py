@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+In-memory ring buffer of webhook events for the embedded webhook listener.
+
+When the MCP server receives webhooks itself (EMBEDDED_WEBHOOK_PORT), events
+go into a fixed-capacity buffer that the event tools read directly, so a
+delivery is visible to the next tool call without any file I/O. Persistence
+is optional and write-behind: new events are handed to a BatchWriter, which
+writes them to the configured event store in group commits.
+"""
+
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from event_store import BatchWriter
+
+
+class EventRingBuffer:
+    """The newest events in memory; same queries as EventLog and SQLiteEventStore."""
+
+    def __init__(self, capacity: int, persist: Optional[BatchWriter] = None):
+        self.capacity = capacity
+        self.events: Deque[dict] = deque(maxlen=capacity)
+        # Latest run per workflow, kept when the event itself falls out of the buffer
+        self.latest_runs: Dict[str, dict] = {}
+        self.persist = persist
+        if persist is not None:
+            # Start from the stored history
+            for event in reversed(persist.recent(capacity)):
+                self.events.append(event)
+            for event in persist.latest_workflow_runs():
+                self.latest_runs[event["workflow_run"]["name"]] = event
+
+    def append(self, event: dict):
+        self.events.append(event)
+        run = event.get("workflow_run")
+        if run and run.get("name"):
+            current = self.latest_runs.get(run["name"])
+            if current is None or run.get("updated_at", "") >= current["workflow_run"].get("updated_at", ""):
+                self.latest_runs[run["name"]] = event
+        if self.persist is not None:
+            self.persist.append(event)
+
+    def recent(self, limit: int) -> List[dict]:
+        """The newest events, newest first."""
+        return list(itertools.islice(reversed(self.events), limit))
+
+    def latest_workflow_runs(self, workflow_name: Optional[str] = None) -> List[dict]:
+        """The workflow_run event with the latest updated_at for each workflow."""
+        if workflow_name:
+            return [self.latest_runs[workflow_name]] if workflow_name in self.latest_runs else []
+        return list(self.latest_runs.values())
+
+    def start(self):
+        """Start writing behind in the running loop."""
+        if self.persist is not None:
+            self.persist.start()
+
+    async def close(self):
+        """Stop the writer after persisting what is still queued."""
+        if self.persist is not None:
+            await self.persist.close()
+
+    def stats(self) -> dict:
+        stats = {"events": len(self.events), "capacity": self.capacity}
+        if self.persist is not None:
+            stats["writer"] = self.persist.stats()
+        return stats
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Append-only log of GitHub webhook events, one JSON object per line.
+
+webhook_server.py appends each event with a single write, so ingest costs the
+same however long the history is and concurrent deliveries cannot overwrite
+each other. Once the file holds twice the retained number of events it is
+compacted: the newest events are copied to a new file that atomically replaces
+it. The MCP tools read the file backwards from the end and only parse the
+events they need.
+
+Several processes may write the same log (webhook_server.py and the MCP
+server's embedded listener): appends and compactions hold an exclusive flock
+on the log, so a compaction never replaces events another writer just added.
+Without fcntl (Windows) there must be a single writer.
+"""
+
+import itertools
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no file locks, so there must be a single writer
+    fcntl = None
+
+EVENTS_FILE = Path(__file__).parent / "github_events.jsonl"
+# Written by earlier versions as one JSON array; read until the first new event arrives
+LEGACY_EVENTS_FILE = Path(__file__).parent / "github_events.json"
+
+# Events kept at compaction, and the age beyond which they are dropped (0 keeps any age)
+RETAINED_EVENTS = int(os.getenv("WEBHOOK_EVENTS_RETAINED", "100"))
+MAX_EVENT_AGE_DAYS = float(os.getenv("WEBHOOK_EVENTS_MAX_AGE_DAYS", "0"))
+
+READ_BLOCK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def encode_event(event: dict) -> bytes:
+    """One log line; compact separators, which the byte filters of events() rely on."""
+    return (json.dumps(event, separators=(",", ":")) + "\n").encode()
+
+
+class EventLog:
+    """JSONL event file with any number of writers, serialized by a file lock, and readers."""
+
+    def __init__(
+        self,
+        path: Path = EVENTS_FILE,
+        retained: int = RETAINED_EVENTS,
+        max_age_days: float = MAX_EVENT_AGE_DAYS,
+        legacy_path: Optional[Path] = LEGACY_EVENTS_FILE
+    ):
+        self.path = Path(path)
+        self.retained = retained
+        self.max_age_days = max_age_days
+        self.legacy_path = legacy_path
+        # Lines in the file, counted on the first append
+        self._lines: Optional[int] = None
+        self.compactions = 0
+
+    def _legacy_lines(self) -> list:
+        if self.legacy_path is None or not self.legacy_path.exists():
+            return []
+        with open(self.legacy_path) as f:
+            return [encode_event(event) for event in json.load(f)]
+
+    def _start(self):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            pass
+        else:
+            # This writer created the log: carry over the events of the old JSON file once
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, b"".join(self._legacy_lines()))
+            finally:
+                os.close(fd)
+
+    def _count_lines(self):
+        with open(self.path, "rb") as f:
+            self._lines = sum(block.count(b"\n") for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""))
+
+    def _open_locked(self) -> int:
+        """An O_APPEND descriptor of the current log file, holding its exclusive lock."""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if fcntl is None:
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # Another writer may have compacted while this one waited, replacing the file
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def append(self, event: dict):
+        """Add one event at the end of the log; O(1) apart from the occasional compaction."""
+        self.append_many([event], sync=False)
+
+    def append_many(self, events: List[dict], sync: bool = True):
+        """Add events with one write, and with sync one fsync, for group commits."""
+        if self._lines is None:
+            self._start()
+        # A single write on an O_APPEND descriptor lands whole at the end of the file
+        fd = self._open_locked()
+        try:
+            if self._lines is None:
+                self._count_lines()
+            os.write(fd, b"".join(encode_event(event) for event in events))
+            if sync:
+                os.fsync(fd)
+            # Only this writer's appends are counted, so with several writers the log
+            # may grow further before one of them compacts it
+            self._lines += len(events)
+            if self._lines >= 2 * self.retained:
+                # The events are written: a failed compaction must not make the caller write them again
+                try:
+                    self._compact()
+                except OSError as e:
+                    logger.warning("Compacting %s failed, retried on the next append: %s", self.path, e)
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def compact(self):
+        """Rewrite the log with only the retained events, replacing it atomically."""
+        if self._lines is None:
+            self._start()
+        fd = self._open_locked()
+        try:
+            self._compact()
+        finally:
+            os.close(fd)
+
+    def _compact(self):
+        # Called with the log's lock held
+        lines = []
+        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days) if self.max_age_days else None
+        for line in self._reverse_lines():
+            if len(lines) >= self.retained:
+                break
+            if cutoff is not None:
+                try:
+                    if datetime.fromisoformat(json.loads(line)["timestamp"]) < cutoff:
+                        break
+                except (ValueError, KeyError, TypeError):
+                    continue
+            lines.append(line + b"\n")
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary, "wb") as f:
+            f.writelines(reversed(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self._lines = len(lines)
+        self.compactions += 1
+
+    def _reverse_lines(self) -> Iterator[bytes]:
+        """Lines of the log, newest first, read in blocks from the end."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            yield from (line.rstrip(b"\n") for line in reversed(self._legacy_lines()))
+            return
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            rest = b""
+            while position > 0:
+                size = min(READ_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + rest).split(b"\n")
+                # The first piece may continue a line that starts earlier in the file
+                rest = lines.pop(0)
+                for line in reversed(lines):
+                    if line:
+                        yield line
+            if rest:
+                yield rest
+
+    def events(self, contains: Iterable[bytes] = ()) -> Iterator[dict]:
+        """Events newest first; lines lacking any of the contains byte strings are skipped unparsed."""
+        contains = tuple(contains)
+        for line in self._reverse_lines():
+            if all(needle in line for needle in contains):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A line still being written
+                    continue
+
+    def recent(self, limit: int) -> List[dict]:
+        """The newest events, newest first."""
+        return list(itertools.islice(self.events(), limit))
+
+    def latest_workflow_runs(self, workflow_name: Optional[str] = None) -> List[dict]:
+        """The workflow_run event with the latest updated_at for each workflow."""
+        # Other events are skipped before being parsed
+        needles = [b'"workflow_run":{']
+        if workflow_name:
+            needles.append(f'"name":{json.dumps(workflow_name)}'.encode())
+        latest = {}
+        for event in self.events(needles):
+            run = event.get("workflow_run")
+            if not run or (workflow_name and run.get("name") != workflow_name):
+                continue
+            current = latest.get(run["name"])
+            if current is None or run.get("updated_at", "") > current["workflow_run"].get("updated_at", ""):
+                latest[run["name"]] = event
+        return list(latest.values())
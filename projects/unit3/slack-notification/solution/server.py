@@ -4,22 +4,114 @@ Module 3: Slack Notification Integration - Complete Solution
 Combines all MCP primitives (Tools and Prompts) for complete team communication workflows.
 """
 
+import asyncio
 import json
 import os
 import subprocess
+import weakref
+from contextlib import asynccontextmanager
 import requests
-from typing import Optional
+from typing import Dict, List, Optional
 from pathlib import Path
 
+import anyio
+from mcp import types
 from mcp.server.fastmcp import FastMCP
+from mcp.shared.exceptions import McpError
+from pydantic import AnyUrl
+
+from git_analysis import (
+    ANALYSIS_CACHE,
+    CHILD_PROCESSES,
+    DIFF_PAGES,
+    analyze_changes,
+    analyze_many,
+    get_commit_page as read_commit_page,
+    get_diff_page as read_diff_page,
+    get_file_diffs as read_file_diffs,
+    run_with_timeout
+)
+from git_cat_file import cat_file_stats, close_cat_file_pools
+from ast_summary import close_summary_workers
+from change_classifier import ChangeTypeResolver, classify_analysis
+from ref_watcher import BACKGROUND_ANALYSIS
+from template_registry import TemplateRegistry
+from event_store import BatchWriter, open_event_store
+from event_buffer import EventRingBuffer
+
+# Serve /webhook/github from this process on this port (0 leaves it to webhook_server.py)
+EMBEDDED_WEBHOOK_PORT = int(os.getenv("EMBEDDED_WEBHOOK_PORT", "0"))
+EMBEDDED_WEBHOOK_HOST = os.getenv("EMBEDDED_WEBHOOK_HOST", "localhost")
+# Events the embedded listener keeps in memory, and whether it also writes them to the event store
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+EVENT_BUFFER_PERSIST = os.getenv("EVENT_BUFFER_PERSIST", "1") != "0"
+
+# The embedded listener's aiohttp runner, shared by all sessions being served
+_webhook_runner = None
+_webhook_users = 0
+
+
+@asynccontextmanager
+async def embedded_webhook(server: FastMCP):
+    """Run the webhook listener in the server's event loop while sessions are served, if enabled."""
+    global _webhook_runner, _webhook_users
+    if not EMBEDDED_WEBHOOK_PORT:
+        yield {}
+        return
+    _webhook_users += 1
+    try:
+        if _webhook_users == 1:
+            from aiohttp import web
+            from webhook_server import create_app
+            runner = web.AppRunner(create_app(EVENT_STORE))
+            await runner.setup()
+            await web.TCPSite(runner, EMBEDDED_WEBHOOK_HOST, EMBEDDED_WEBHOOK_PORT).start()
+            _webhook_runner = runner
+        yield {}
+    finally:
+        _webhook_users -= 1
+        if _webhook_users == 0 and _webhook_runner is not None:
+            # Shielded, so queued events are persisted even when the server is shut down by cancellation
+            with anyio.CancelScope(shield=True):
+                await _webhook_runner.cleanup()
+                _webhook_runner = None
+
+
+# Sessions being served; the shared git workers and ref watchers are stopped when the last one ends
+_git_sessions = 0
+
+
+@asynccontextmanager
+async def git_workers(server: FastMCP):
+    """Stop the git workers, ref watchers and template watcher once no session is being served."""
+    global _git_sessions
+    _git_sessions += 1
+    try:
+        yield {}
+    finally:
+        _git_sessions -= 1
+        if _git_sessions == 0:
+            BACKGROUND_ANALYSIS.stop()
+            with anyio.CancelScope(shield=True):
+                await stop_template_watch()
+                await close_cat_file_pools()
+                await close_summary_workers()
+
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP):
+    async with git_workers(server), embedded_webhook(server):
+        yield {}
+
 
 # Initialize the FastMCP server
-mcp = FastMCP("pr-agent-slack")
+mcp = FastMCP("pr-agent-slack", lifespan=server_lifespan)
 
 # PR template directory (shared between starter and solution)
 TEMPLATES_DIR = Path(__file__).parent.parent.parent / "templates"
 
-# Default PR templates
+# Display names of the bundled PR templates; any other .md file in TEMPLATES_DIR
+# is discovered and named after its first heading
 DEFAULT_TEMPLATES = {
     "bug.md": "Bug Fix",
     "feature.md": "Feature",
@@ -30,8 +122,22 @@ DEFAULT_TEMPLATES = {
     "security.md": "Security"
 }
 
-# File where webhook server stores events
-EVENTS_FILE = Path(__file__).parent / "github_events.json"
+# Templates are read once and reloaded when the directory changes
+TEMPLATE_REGISTRY = TemplateRegistry(TEMPLATES_DIR, DEFAULT_TEMPLATES)
+
+# Where the webhook server stores events: JSON Lines log or SQLite (WEBHOOK_EVENT_STORE).
+# The embedded listener keeps them in a ring buffer in front of that store instead
+if EMBEDDED_WEBHOOK_PORT:
+    EVENT_STORE = EventRingBuffer(EVENT_BUFFER_SIZE, BatchWriter(open_event_store()) if EVENT_BUFFER_PERSIST else None)
+else:
+    EVENT_STORE = open_event_store()
+
+# Seconds a git-backed tool may run before its git processes are stopped (0 disables)
+TOOL_TIMEOUTS = {
+    "analyze_file_changes": float(os.getenv("ANALYZE_TIMEOUT_SECONDS", "120")),
+    # Applies to each repository separately
+    "analyze_repositories": float(os.getenv("BATCH_ANALYZE_TIMEOUT_SECONDS", "120"))
+}
 
 # Type mapping for PR templates
 TYPE_MAPPING = {
@@ -53,11 +159,85 @@ TYPE_MAPPING = {
 
 # ===== Tools from Modules 1 & 2 (Complete with output limiting) =====
 
+# (registry version, resolver) for the templates the resolver was built from
+_type_resolver: Optional[tuple] = None
+
+
+def get_type_resolver() -> ChangeTypeResolver:
+    """Resolver for suggest_template's change_type, rebuilt when the templates change."""
+    global _type_resolver
+    templates = TEMPLATE_REGISTRY.templates()
+    if _type_resolver is None or _type_resolver[0] != TEMPLATE_REGISTRY.version:
+        resolver = ChangeTypeResolver.build(
+            TYPE_MAPPING, [(t.filename, t.type) for t in templates], default="feature.md"
+        )
+        _type_resolver = (TEMPLATE_REGISTRY.version, resolver)
+    return _type_resolver[1]
+
+
+def rank_templates(analysis: dict, limit: int = 3) -> List[dict]:
+    """Candidate PR templates for an analysis, best first, from the local change classifier."""
+    return [
+        {"change_type": change_type, "template": TYPE_MAPPING[change_type], "confidence": confidence}
+        for change_type, confidence in classify_analysis(analysis)[:limit]
+    ]
+
+
+def to_json(data: dict, compact: bool = False) -> str:
+    """Serialize a tool result, without any whitespace when compact."""
+    if compact:
+        return json.dumps(data, separators=(",", ":"))
+    return json.dumps(data, indent=2)
+
+
+# Client roots per session, fetched once and dropped when the client reports a change
+session_roots: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+async def get_session_roots() -> types.ListRootsResult:
+    """Get the roots of the current client session, asking the client only once.
+
+    An error answer (from a client without roots support, say) is cached too, and
+    raised again until the client sends notifications/roots/list_changed.
+    """
+    session = mcp.get_context().session
+    roots_result = session_roots.get(session)
+    if roots_result is None:
+        try:
+            roots_result = await session.list_roots()
+        except McpError as e:
+            roots_result = e
+        session_roots[session] = roots_result
+    if isinstance(roots_result, McpError):
+        raise McpError(roots_result.error)
+    return roots_result
+
+
+async def handle_roots_list_changed(notification: types.RootsListChangedNotification) -> None:
+    """Forget cached roots when a client sends notifications/roots/list_changed."""
+    # Notifications don't carry their session, so every session refetches its roots
+    session_roots.clear()
+
+
+# Internals of mcp 1.9 (pyproject.toml requires >=1.9,<2): the low-level server has a decorator
+# only for progress notifications, so the handler goes straight into its notification_handlers
+# table. Recheck before raising the upper bound
+mcp._mcp_server.notification_handlers[types.RootsListChangedNotification] = handle_roots_list_changed
+
+
 @mcp.tool()
 async def analyze_file_changes(
     base_branch: str = "main",
     include_diff: bool = True,
     max_diff_lines: int = 500,
+    exact_total_lines: bool = True,
+    max_tokens: Optional[int] = None,
+    structured: bool = False,
+    compact: bool = False,
+    max_commits: int = 100,
+    commit_format: str = "oneline",
+    diff_mode: str = "default",
+    python_summary: bool = False,
     working_directory: Optional[str] = None
 ) -> str:
     """Get the full diff and list of changed files in the current git repository.
@@ -66,14 +246,26 @@ async def analyze_file_changes(
         base_branch: Base branch to compare against (default: main)
         include_diff: Include the full diff content (default: true)
         max_diff_lines: Maximum number of diff lines to include (default: 500)
+        exact_total_lines: Keep counting diff lines past the limit to report an exact total (default: true)
+        max_tokens: Token budget for the diff; ranks source before tests and collapses lockfiles,
+            generated, vendored and binary files instead of cutting at max_diff_lines (default: none)
+        structured: Return a files list with status, additions, deletions, rename source and binary flag
+            instead of name-status and stat text (default: false)
+        compact: Serialize the result without indentation to save tokens (default: false)
+        max_commits: Maximum number of commits to list; older ones are paged with get_commit_page (default: 100)
+        commit_format: "oneline" for `git log --oneline` text, or "full" for author, timestamp and
+            files touched per commit (default: oneline)
+        diff_mode: "default" (3 lines of context), "minimal" (no context), "function" (whole enclosing
+            functions) or "word" (word-level, for prose and docs); other modes report diff_savings (default: default)
+        python_summary: Describe changed .py files by the functions, classes, signatures and decorators that
+            changed instead of including their hunks (default: false)
         working_directory: Directory to run git commands in (default: current directory)
     """
     try:
         # Try to get working directory from roots first
         if working_directory is None:
             try:
-                context = mcp.get_context()
-                roots_result = await context.session.list_roots()
+                roots_result = await get_session_roots()
                 # Get the first root - Claude Code sets this to the CWD
                 root = roots_result.roots[0]
                 # FileUrl object has a .path property that gives us the path directly
@@ -84,63 +276,44 @@ async def analyze_file_changes(
         
         # Use provided working directory or current directory
         cwd = working_directory if working_directory else os.getcwd()
-        # Get list of changed files
-        files_result = subprocess.run(
-            ["git", "diff", "--name-status", f"{base_branch}...HEAD"],
-            capture_output=True,
-            text=True,
-            check=True,
-            cwd=cwd
-        )
-        
-        # Get diff statistics
-        stat_result = subprocess.run(
-            ["git", "diff", "--stat", f"{base_branch}...HEAD"],
-            capture_output=True,
-            text=True,
-            cwd=cwd
+        analysis = await run_with_timeout(
+            analyze_changes(
+                cwd,
+                base_branch,
+                include_diff=include_diff,
+                max_diff_lines=max_diff_lines,
+                exact_total_lines=exact_total_lines,
+                max_tokens=max_tokens,
+                structured=structured,
+                max_commits=max_commits,
+                commit_format=commit_format,
+                diff_mode=diff_mode,
+                python_summary=python_summary
+            ),
+            TOOL_TIMEOUTS["analyze_file_changes"],
+            "analyze_file_changes"
         )
-        
-        # Get the actual diff if requested
-        diff_content = ""
-        truncated = False
-        if include_diff:
-            diff_result = subprocess.run(
-                ["git", "diff", f"{base_branch}...HEAD"],
-                capture_output=True,
-                text=True,
-                cwd=cwd
-            )
-            diff_lines = diff_result.stdout.split('\n')
-            
-            # Check if we need to truncate
-            if len(diff_lines) > max_diff_lines:
-                diff_content = '\n'.join(diff_lines[:max_diff_lines])
-                diff_content += f"\n\n... Output truncated. Showing {max_diff_lines} of {len(diff_lines)} lines ..."
-                diff_content += "\n... Use max_diff_lines parameter to see more ..."
-                truncated = True
-            else:
-                diff_content = diff_result.stdout
-        
-        # Get commit messages for context
-        commits_result = subprocess.run(
-            ["git", "log", "--oneline", f"{base_branch}..HEAD"],
-            capture_output=True,
-            text=True,
-            cwd=cwd
+
+        # Recompute in the background whenever a branch moves, so the next call is warm;
+        # repositories that cannot be watched are counted in get_server_metrics
+        await BACKGROUND_ANALYSIS.watch(
+            cwd,
+            base_branch=base_branch,
+            include_diff=include_diff,
+            max_diff_lines=max_diff_lines,
+            exact_total_lines=exact_total_lines,
+            max_tokens=max_tokens,
+            structured=structured,
+            max_commits=max_commits,
+            commit_format=commit_format,
+            diff_mode=diff_mode,
+            python_summary=python_summary
         )
+
+        # Rank templates locally so the model doesn't have to guess a change type first
+        analysis["suggested_templates"] = rank_templates(analysis)
         
-        analysis = {
-            "base_branch": base_branch,
-            "files_changed": files_result.stdout,
-            "statistics": stat_result.stdout,
-            "commits": commits_result.stdout,
-            "diff": diff_content if include_diff else "Diff not included (set include_diff=true to see full diff)",
-            "truncated": truncated,
-            "total_diff_lines": len(diff_lines) if include_diff else 0
-        }
-        
-        return json.dumps(analysis, indent=2)
+        return to_json(analysis, compact)
         
     except subprocess.CalledProcessError as e:
         return json.dumps({"error": f"Git error: {e.stderr}"})
@@ -148,17 +321,113 @@ async def analyze_file_changes(
         return json.dumps({"error": str(e)})
 
 
+@mcp.tool()
+async def analyze_repositories(
+    repositories: List[Dict[str, str]],
+    include_diff: bool = True,
+    max_diff_lines: int = 500,
+    max_tokens: Optional[int] = None,
+    structured: bool = False,
+    compact: bool = False,
+    max_commits: int = 100,
+    max_concurrency: Optional[int] = None
+) -> str:
+    """Analyze changes in several git repositories at once.
+    
+    Each repository is reported to the client as a progress message as soon as it
+    completes; the final result lists all of them in completion order.
+    
+    Args:
+        repositories: List of {"working_directory": ..., "base_branch": ...} entries (base_branch defaults to main)
+        include_diff: Include the diff content for each repository (default: true)
+        max_diff_lines: Maximum number of diff lines per repository (default: 500)
+        max_tokens: Token budget for each repository's diff (default: none)
+        structured: Return structured files lists instead of name-status and stat text (default: false)
+        compact: Serialize the result without indentation to save tokens (default: false)
+        max_commits: Maximum number of commits to list per repository (default: 100)
+        max_concurrency: Maximum number of repositories analyzed at once (default: 4)
+    """
+    ctx = mcp.get_context()
+    results = []
+    async for entry in analyze_many(
+        repositories,
+        max_concurrency,
+        TOOL_TIMEOUTS["analyze_repositories"],
+        include_diff=include_diff,
+        max_diff_lines=max_diff_lines,
+        max_tokens=max_tokens,
+        structured=structured,
+        max_commits=max_commits
+    ):
+        results.append(entry)
+        if "error" in entry:
+            status = "failed"
+        elif structured:
+            status = f"{entry['analysis']['totals']['files']} files changed"
+        else:
+            status = f"{len(entry['analysis']['files_changed'].splitlines())} files changed"
+        try:
+            await ctx.report_progress(len(results), len(repositories), f"{entry['working_directory']}: {status}")
+        except Exception:
+            # Progress is best effort; the results are still returned below
+            pass
+    
+    return to_json({"results": results}, compact)
+
+
+@mcp.tool()
+async def get_diff_page(cursor: str, max_lines: int = 500) -> str:
+    """Get the next page of a diff that analyze_file_changes truncated, without re-running git.
+    
+    Args:
+        cursor: The next_cursor value from analyze_file_changes or a previous get_diff_page call
+        max_lines: Maximum number of diff lines to return (default: 500)
+    """
+    try:
+        return json.dumps(read_diff_page(cursor, max_lines), indent=2)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+async def get_commit_page(cursor: str, max_commits: int = 100) -> str:
+    """Get older commits that analyze_file_changes left out because of max_commits.
+    
+    Args:
+        cursor: The commits_cursor value from analyze_file_changes or a previous get_commit_page call
+        max_commits: Maximum number of commits to return (default: 100)
+    """
+    try:
+        return json.dumps(await read_commit_page(cursor, max_commits), indent=2)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+
+@mcp.tool()
+async def get_file_diffs(
+    diff_id: str,
+    paths: Optional[List[str]] = None,
+    hunks: Optional[Dict[str, List[int]]] = None
+) -> str:
+    """Get the diff of only some files or hunks from an earlier analyze_file_changes call.
+    
+    Call without paths first to list the files in the diff with their line counts and hunk headers.
+    
+    Args:
+        diff_id: The diff_id value from analyze_file_changes
+        paths: Files to return the diff for (default: none, list the index instead)
+        hunks: Optional map of path to 1-based hunk numbers, to return only those hunks of a file
+    """
+    try:
+        return json.dumps(read_file_diffs(diff_id, paths, hunks), indent=2)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+
 @mcp.tool()
 async def get_pr_templates() -> str:
     """List available PR templates with their content."""
-    templates = [
-        {
-            "filename": filename,
-            "type": template_type,
-            "content": (TEMPLATES_DIR / filename).read_text()
-        }
-        for filename, template_type in DEFAULT_TEMPLATES.items()
-    ]
+    templates = [template._asdict() for template in TEMPLATE_REGISTRY.templates()]
     
     return json.dumps(templates, indent=2)
 
@@ -172,27 +441,151 @@ async def suggest_template(changes_summary: str, change_type: str) -> str:
         change_type: The type of change you've identified (bug, feature, docs, refactor, test, etc.)
     """
     
-    # Get available templates
-    templates_response = await get_pr_templates()
-    templates = json.loads(templates_response)
-    
-    # Find matching template
-    template_file = TYPE_MAPPING.get(change_type.lower(), "feature.md")
-    selected_template = next(
-        (t for t in templates if t["filename"] == template_file),
-        templates[0]  # Default to first template if no match
-    )
+    # Find matching template, tolerating variants such as "bugfix", "perf" or "Docs update"
+    resolution = get_type_resolver().resolve(change_type)
+    template = TEMPLATE_REGISTRY.get(resolution.template)
+    if template is None:
+        # Default to first template if no match
+        templates = TEMPLATE_REGISTRY.templates()
+        if not templates:
+            return json.dumps({"error": f"No PR templates found in {TEMPLATES_DIR}"})
+        template = templates[0]
     
+    # The content is included once, under template_content
     suggestion = {
-        "recommended_template": selected_template,
+        "recommended_template": {"filename": template.filename, "type": template.type},
         "reasoning": f"Based on your analysis: '{changes_summary}', this appears to be a {change_type} change.",
-        "template_content": selected_template["content"],
+        "change_type_match": {"confidence": resolution.confidence, "match": resolution.match},
+        "template_content": template.content,
         "usage_hint": "Claude can help you fill out this template based on the specific changes in your PR."
     }
     
     return json.dumps(suggestion, indent=2)
 
 
+# Templates are also resources, so clients can cache them by hash and subscribe to changes
+TEMPLATE_URI_PREFIX = "pr-template://"
+TEMPLATE_INDEX_URI = TEMPLATE_URI_PREFIX + "index"
+
+# Sessions that read or subscribed to template resources, with their subscribed URIs
+template_subscriptions: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_template_watch: Optional[asyncio.Task] = None
+
+
+def track_template_session() -> set:
+    """Remember the current session for notifications and start watching the templates."""
+    global _template_watch
+    if _template_watch is None or _template_watch.done():
+        _template_watch = asyncio.create_task(TEMPLATE_REGISTRY.watch(notify_template_changes))
+    return template_subscriptions.setdefault(mcp.get_context().session, set())
+
+
+async def stop_template_watch() -> None:
+    """Cancel the template watcher, which also removes its inotify reader from the loop."""
+    global _template_watch
+    watch, _template_watch = _template_watch, None
+    if watch is not None and watch.get_loop() is asyncio.get_running_loop():
+        watch.cancel()
+        # Waits for the watcher's cleanup without raising its CancelledError here
+        await asyncio.wait([watch])
+
+
+async def notify_template_changes(changed: Dict[str, str]) -> None:
+    """Send resources/updated for changed templates, and for the index on any change, to their subscribers."""
+    uris = [TEMPLATE_URI_PREFIX + filename for filename in sorted(changed)] + [TEMPLATE_INDEX_URI]
+    for session, subscribed in list(template_subscriptions.items()):
+        try:
+            for uri in uris:
+                if uri in subscribed:
+                    await session.send_resource_updated(AnyUrl(uri))
+        except Exception:
+            # The client went away
+            template_subscriptions.pop(session, None)
+
+
+@mcp.resource(
+    TEMPLATE_INDEX_URI,
+    name="pr-template-index",
+    description="The PR templates with their resource URIs, types, sizes and content hashes",
+    mime_type="application/json"
+)
+def pr_template_index() -> str:
+    """List the templates; a client re-reads a template only when its hash changes."""
+    track_template_session()
+    return json.dumps([
+        {
+            "uri": TEMPLATE_URI_PREFIX + template.filename,
+            "filename": template.filename,
+            "type": template.type,
+            "size": len(template.content.encode()),
+            "hash": template.hash
+        }
+        for template in TEMPLATE_REGISTRY.templates()
+    ], indent=2)
+
+
+@mcp.resource(
+    TEMPLATE_URI_PREFIX + "{filename}",
+    name="pr-template",
+    description="A PR template from the templates directory, by file name",
+    mime_type="text/markdown"
+)
+def pr_template(filename: str) -> str:
+    """The content of one PR template."""
+    track_template_session()
+    template = TEMPLATE_REGISTRY.get(filename)
+    if template is None:
+        raise ValueError(f"Unknown PR template: {filename}")
+    return template.content
+
+
+# FastMCP has no API for subscriptions, so these use the low-level server's decorators
+@mcp._mcp_server.subscribe_resource()
+async def subscribe_resource(uri: AnyUrl) -> None:
+    if str(uri).startswith(TEMPLATE_URI_PREFIX):
+        track_template_session().add(str(uri))
+
+
+@mcp._mcp_server.unsubscribe_resource()
+async def unsubscribe_resource(uri: AnyUrl) -> None:
+    template_subscriptions.get(mcp.get_context().session, set()).discard(str(uri))
+
+
+# Internals of mcp 1.9 (pyproject.toml requires >=1.9,<2): Server.get_capabilities always
+# reports subscribe=False, even with a subscribe handler registered. Recheck before raising
+# the upper bound, and drop this once it does not
+_get_capabilities = mcp._mcp_server.get_capabilities
+
+
+def get_capabilities(*args, **kwargs) -> types.ServerCapabilities:
+    """Advertise the template resource subscriptions."""
+    capabilities = _get_capabilities(*args, **kwargs)
+    if capabilities.resources is not None:
+        capabilities.resources.subscribe = True
+    return capabilities
+
+
+mcp._mcp_server.get_capabilities = get_capabilities
+
+
+@mcp.tool()
+async def get_server_metrics() -> str:
+    """Get performance counters for the server's caches, useful for tuning their limits."""
+    metrics = {
+        "analysis_cache": ANALYSIS_CACHE.stats(),
+        "diff_pages": DIFF_PAGES.stats(),
+        "cat_file": cat_file_stats(),
+        "background_analysis": BACKGROUND_ANALYSIS.stats(),
+        "child_processes": CHILD_PROCESSES.stats(),
+        "templates": TEMPLATE_REGISTRY.stats()
+    }
+    if EMBEDDED_WEBHOOK_PORT:
+        # Ring buffer size, and batch sizes and flush times of its write-behind
+        metrics["webhook_events"] = EVENT_STORE.stats()
+    
+    return json.dumps(metrics, indent=2)
+
+
 @mcp.tool()
 async def get_recent_actions_events(limit: int = 10) -> str:
     """Get recent GitHub Actions events received via webhook.
@@ -200,15 +593,8 @@ async def get_recent_actions_events(limit: int = 10) -> str:
     Args:
         limit: Maximum number of events to return (default: 10)
     """
-    # Read events from file
-    if not EVENTS_FILE.exists():
-        return json.dumps([])
-    
-    with open(EVENTS_FILE, 'r') as f:
-        events = json.load(f)
-    
-    # Return most recent events
-    recent = events[-limit:]
+    # Read only the most recent events, oldest first
+    recent = EVENT_STORE.recent(limit)[::-1]
     return json.dumps(recent, indent=2)
 
 
@@ -219,44 +605,23 @@ async def get_workflow_status(workflow_name: Optional[str] = None) -> str:
     Args:
         workflow_name: Optional specific workflow name to filter by
     """
-    # Read events from file
-    if not EVENTS_FILE.exists():
+    if not EVENT_STORE.recent(1):
         return json.dumps({"message": "No GitHub Actions events received yet"})
     
-    with open(EVENTS_FILE, 'r') as f:
-        events = json.load(f)
-    
-    if not events:
-        return json.dumps({"message": "No GitHub Actions events received yet"})
-    
-    # Filter for workflow events
-    workflow_events = [
-        e for e in events 
-        if e.get("workflow_run") is not None
-    ]
-    
-    if workflow_name:
-        workflow_events = [
-            e for e in workflow_events
-            if e["workflow_run"].get("name") == workflow_name
-        ]
-    
-    # Group by workflow and get latest status
-    workflows = {}
-    for event in workflow_events:
+    # Latest run of each workflow, looked up by the store
+    workflows = []
+    for event in EVENT_STORE.latest_workflow_runs(workflow_name):
         run = event["workflow_run"]
-        name = run["name"]
-        if name not in workflows or run["updated_at"] > workflows[name]["updated_at"]:
-            workflows[name] = {
-                "name": name,
-                "status": run["status"],
-                "conclusion": run.get("conclusion"),
-                "run_number": run["run_number"],
-                "updated_at": run["updated_at"],
-                "html_url": run["html_url"]
-            }
+        workflows.append({
+            "name": run["name"],
+            "status": run.get("status"),
+            "conclusion": run.get("conclusion"),
+            "run_number": run.get("run_number"),
+            "updated_at": run.get("updated_at"),
+            "html_url": run.get("html_url")
+        })
     
-    return json.dumps(list(workflows.values()), indent=2)
+    return json.dumps(workflows, indent=2)
 
 
 # ===== New Module 3: Slack Integration Tools =====
@@ -497,6 +862,9 @@ if __name__ == "__main__":
     # Run MCP server normally
     print("Starting PR Agent Slack MCP server...")
     print("Make sure to set SLACK_WEBHOOK_URL environment variable")
-    print("To receive GitHub webhooks, run the webhook server separately:")
-    print("  python webhook_server.py")
+    if EMBEDDED_WEBHOOK_PORT:
+        print(f"Receiving GitHub webhooks on http://{EMBEDDED_WEBHOOK_HOST}:{EMBEDDED_WEBHOOK_PORT}/webhook/github")
+    else:
+        print("To receive GitHub webhooks, run the webhook server separately:")
+        print("  python webhook_server.py")
     mcp.run()
\ No newline at end of file